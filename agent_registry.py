@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Agent 注册表
+
+创建 Agent 时会解析工具列表，配置了 MCP Server 时还会启动子进程并建立连接，耗时可达数秒。
+本模块按 (Agent 类型, LLM 配置, 工具列表, 系统提示词等) 缓存已创建的 Agent，
+相同配置的 Agent 在进程内只创建一次，由所有会话共用
+
+Qwen Agent 的 Agent 不在实例上保存会话状态（消息通过 run 的参数传入），可以被多个会话并发使用
+
+数据库配置不参与缓存键：postgres_tool / mysql_tool 的工具读取模块级的 db_config，
+一个进程只连接一个数据库，set_db_config 切换数据库后，已缓存的 Agent 同样访问新的数据库
+"""
+
+import json
+import threading
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def make_agent_key(agent_cls, **kwargs):
+    """将 Agent 类型和构造参数转换为可哈希的缓存键"""
+    return (f"{agent_cls.__module__}.{agent_cls.__qualname__}", _dumps(kwargs))
+
+
+class AgentRegistry:
+    """线程安全的 Agent 缓存"""
+
+    def __init__(self):
+        self._agents = {}
+        # 每个键一把锁：同一配置只创建一次，不同配置的 Agent 可以同时创建
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get_or_create(self, agent_cls, **kwargs):
+        """
+        获取缓存的 Agent，不存在时创建
+
+        :param agent_cls: Agent 类，如 Assistant、ReActChat
+        :param kwargs: Agent 的构造参数，如 llm、function_list、system_message
+        :return: Agent 实例
+        """
+        key = make_agent_key(agent_cls, **kwargs)
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._stats['hits'] += 1
+                return agent
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                agent = self._agents.get(key)
+                if agent is not None:
+                    self._stats['hits'] += 1
+                    return agent
+
+            agent = agent_cls(**kwargs)
+            with self._lock:
+                self._agents[key] = agent
+                self._key_locks.pop(key, None)
+                self._stats['misses'] += 1
+            return agent
+
+    def discard(self):
+        """移除所有缓存的 Agent，如修改了工具的注册信息之后"""
+        with self._lock:
+            self._agents.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['agents'] = len(self._agents)
+        return stats
+
+
+# 进程级的 Agent 注册表
+agent_registry = AgentRegistry()
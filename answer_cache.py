@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+语义答案缓存
+
+用户经常换一种说法重复提问（「用户 103 的订单」「查一下 103 号用户的订单」），
+每次都要完整运行 Workflow 和 ReAct Agent。本模块用 bge-m3 为提问生成向量，
+找到语义相近的历史提问后，直接返回缓存的最终答案，或至少复用缓存的表结构提示
+
+主要功能:
+- 按数据库划分缓存空间，条目按 TTL 过期，每个空间的条目数有上限
+- 相似度阈值可配置
+- 提问中的数字和英文标识（如用户编号、订单号）必须完全一致才算命中，
+  避免「用户 103 的订单」命中「用户 104 的订单」
+- embedding 服务不可用时不使用缓存，不影响正常回答
+"""
+
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+import requests
+
+from table_index import EmbeddingClient
+
+
+# 提问中必须完全一致的部分：数字、英文单词和标识符
+_LITERAL_RE = re.compile(r'[0-9]+(?:\.[0-9]+)?|[A-Za-z_][A-Za-z0-9_\-]*')
+
+
+def question_literals(question: str) -> tuple:
+    """提取提问中的数字和英文标识，用于精确比对"""
+    return tuple(sorted(token.lower() for token in _LITERAL_RE.findall(question)))
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.split())
+
+
+def cache_scope(db_config: dict):
+    """数据库配置对应的缓存空间"""
+    return (db_config.get('host'), str(db_config.get('port')), db_config.get('database'))
+
+
+# 最近生成的向量的缓存数量
+RECENT_VECTORS = 256
+
+# 未提供的字段，用于区分「未缓存」和「缓存的值为 None」
+_UNSET = object()
+
+
+class CacheEntry:
+    """一条缓存的提问"""
+
+    def __init__(self, question, vector):
+        self.question = question
+        self.vector = vector
+        self.literals = question_literals(question)
+        self.answer = None
+        # 表结构提示，与 PGWorkflow.schema_hint 的返回值一致：None 表示没有可用表
+        self.hint = _UNSET
+        self.expires_at = 0.0
+
+
+class CacheMatch:
+    """命中结果"""
+
+    def __init__(self, entry: CacheEntry, score: float):
+        self.question = entry.question
+        self.answer = entry.answer
+        self.has_hint = entry.hint is not _UNSET
+        self.hint = entry.hint if self.has_hint else None
+        self.score = score
+
+    def __repr__(self):
+        return f"CacheMatch(question={self.question!r}, score={self.score:.4f})"
+
+
+class SemanticAnswerCache:
+    """线程安全的语义答案缓存"""
+
+    def __init__(self, embed=None, threshold=0.92, ttl=600, max_entries=1000):
+        """
+        :param embed: 文本转 L2 归一化向量的函数，默认使用 bge-m3 服务
+        :param threshold: 余弦相似度不低于该值时视为同一个问题
+        :param ttl: 条目的存活时间（秒）
+        :param max_entries: 每个缓存空间最多保留的条目数，超出时淘汰最早写入的条目
+        """
+        self.embed = embed or EmbeddingClient()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # scope -> OrderedDict(normalized question -> CacheEntry)
+        self._scopes = {}
+        self._stats = {'hits': 0, 'misses': 0, 'exact_hits': 0, 'embed_errors': 0}
+        # 最近生成的向量：lookup 未命中后紧接着 put 同一个问题，无需再次请求 embedding 服务
+        self._recent_vectors = OrderedDict()
+
+    def _embed(self, question):
+        with self._lock:
+            vector = self._recent_vectors.get(question)
+        if vector is not None:
+            return vector
+
+        try:
+            vector = self.embed(question)
+        except (requests.RequestException, ValueError):
+            with self._lock:
+                self._stats['embed_errors'] += 1
+            return None
+
+        with self._lock:
+            self._recent_vectors[question] = vector
+            while len(self._recent_vectors) > RECENT_VECTORS:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+    def _live_entries(self, scope):
+        """调用方需持有锁，顺带清理过期条目"""
+        entries = self._scopes.setdefault(scope, OrderedDict())
+        now = time.monotonic()
+        for key in [k for k, e in entries.items() if e.expires_at <= now]:
+            del entries[key]
+        return entries
+
+    def lookup(self, scope, question: str):
+        """
+        查找语义相近的历史提问
+
+        :param scope: 缓存空间，见 cache_scope
+        :param question: 用户提问
+        :return: CacheMatch，未命中时返回 None
+        """
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._live_entries(scope).get(key)
+            if entry is not None:
+                self._stats['hits'] += 1
+                self._stats['exact_hits'] += 1
+                return CacheMatch(entry, 1.0)
+
+        vector = self._embed(key)
+        if vector is None:
+            return None
+
+        literals = question_literals(key)
+        with self._lock:
+            candidates = [e for e in self._live_entries(scope).values()
+                          if e.literals == literals and e.vector is not None]
+            best, best_score = None, self.threshold
+            if candidates:
+                scores = np.vstack([e.vector for e in candidates]) @ vector
+                i = int(np.argmax(scores))
+                if scores[i] >= best_score:
+                    best, best_score = candidates[i], float(scores[i])
+
+            self._stats['hits' if best is not None else 'misses'] += 1
+            return CacheMatch(best, best_score) if best is not None else None
+
+    def put(self, scope, question: str, answer=None, hint=_UNSET):
+        """
+        写入或更新缓存，已有条目时只更新传入的字段
+
+        :param scope: 缓存空间
+        :param question: 用户提问
+        :param answer: 最终答案
+        :param hint: PGWorkflow.schema_hint 返回的表结构提示（可以为 None）
+        """
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._live_entries(scope).get(key)
+        vector = entry.vector if entry is not None else self._embed(key)
+
+        with self._lock:
+            entries = self._live_entries(scope)
+            entry = entries.pop(key, None) or CacheEntry(key, vector)
+            if answer is not None:
+                entry.answer = answer
+            if hint is not _UNSET:
+                entry.hint = hint
+            entry.expires_at = time.monotonic() + self.ttl
+            entries[key] = entry
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, scope=None):
+        """清空缓存，scope 为 None 时清空所有数据库的缓存"""
+        with self._lock:
+            if scope is None:
+                self._scopes.clear()
+            else:
+                self._scopes.pop(scope, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = sum(len(v) for v in self._scopes.values())
+        return stats
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+"""
+数据库连接池
+
+进程级、线程安全的通用连接池，供 PostgreSQL / MySQL 工具共享连接，避免每次工具调用都重新建连
+
+主要功能:
+- 最小 / 最大连接数控制，连接耗尽时阻塞等待
+- 取出连接时做健康检查，失效连接自动丢弃并重建
+- 回收空闲过久的连接，以及超过最长存活时间的连接
+- 按数据库配置分别建池，配置变更时可整体替换
+- 提供连接池统计信息
+"""
+
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """等待空闲连接超时"""
+
+
+class ConnectionPool:
+    """通用的线程安全连接池"""
+
+    def __init__(self,
+                 connect,
+                 close=None,
+                 validate=None,
+                 reset=None,
+                 min_size=1,
+                 max_size=10,
+                 max_idle_time=300,
+                 max_lifetime=None,
+                 check_interval=30,
+                 timeout=30):
+        """
+        :param connect: 无参函数，返回一个新的数据库连接
+        :param close: 关闭连接的函数，默认调用 conn.close()
+        :param validate: 健康检查函数，连接可用时返回 True
+        :param reset: 归还连接时的重置函数，例如回滚未结束的事务
+        :param min_size: 保留的最少连接数
+        :param max_size: 允许同时存在的最多连接数
+        :param max_idle_time: 空闲连接的最长保留时间（秒），超过后被回收
+        :param max_lifetime: 连接的最长存活时间（秒），超过后在归还或取出时关闭，None 表示不限制
+        :param check_interval: 空闲超过该时间（秒）的连接，在取出时做健康检查
+        :param timeout: 等待空闲连接的最长时间（秒）
+        """
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("连接池大小配置有误：需满足 0 <= min_size <= max_size 且 max_size >= 1")
+
+        self._connect = connect
+        self._close = close or (lambda conn: conn.close())
+        self._validate = validate
+        self._reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.timeout = timeout
+
+        # 空闲连接队列，元素为 (conn, 最近一次归还的时间)
+        self._idle = deque()
+        self._size = 0
+        # 连接的创建时间，键为 id(conn)
+        self._created_at = {}
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+        self._stats = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'checkout_failures': 0,
+            'health_check_failures': 0,
+            'idle_reaped': 0,
+            'lifetime_expired': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def _open(self):
+        """在锁外建立新连接，失败时释放占用的名额"""
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['connections_created'] += 1
+            self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        """关闭连接并释放名额"""
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._created_at.pop(id(conn), None)
+            self._stats['connections_closed'] += 1
+            self._cond.notify()
+
+    def _is_expired(self, conn, now=None):
+        """调用方需持有锁"""
+        if self.max_lifetime is None:
+            return False
+        created_at = self._created_at.get(id(conn))
+        if created_at is None:
+            return False
+        now = time.monotonic() if now is None else now
+        return now - created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, idle_since):
+        if self._validate is None:
+            return True
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            return bool(self._validate(conn))
+        except Exception:
+            return False
+
+    def acquire(self, timeout=None):
+        """取出一个可用连接，必要时新建连接或等待其他线程归还"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited = False
+        start = time.monotonic()
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("连接池已关闭")
+
+                item = None
+                need_open = False
+                while True:
+                    if self._idle:
+                        item = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        need_open = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['checkout_failures'] += 1
+                        raise PoolTimeout(f"等待数据库连接超时（{timeout} 秒），连接池已满：{self.max_size}")
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if waited:
+                    self._stats['waits'] += 1
+                    self._stats['wait_time_total'] += time.monotonic() - start
+                    waited = False
+
+            if need_open:
+                conn = self._open()
+            else:
+                conn, idle_since = item
+                with self._cond:
+                    expired = self._is_expired(conn)
+                    if expired:
+                        self._stats['lifetime_expired'] += 1
+                if expired:
+                    self._discard(conn)
+                    continue
+                if not self._is_healthy(conn, idle_since):
+                    with self._cond:
+                        self._stats['health_check_failures'] += 1
+                    self._discard(conn)
+                    continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+            return conn
+
+    def release(self, conn, discard=False):
+        """归还连接；discard 为 True 或重置失败时直接关闭连接"""
+        if not discard and self._reset is not None:
+            try:
+                self._reset(conn)
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if not discard and self._is_expired(conn):
+                self._stats['lifetime_expired'] += 1
+                discard = True
+            if not discard and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """上下文管理器：取出连接，退出时归还"""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def reap_idle(self):
+        """回收超过最长存活时间的连接，以及空闲过久的连接（保留至少 min_size 个连接）"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            kept = deque()
+            # 队列左侧是最早归还的连接
+            while self._idle:
+                conn, idle_since = self._idle.popleft()
+                if self._is_expired(conn, now):
+                    self._stats['lifetime_expired'] += 1
+                    expired.append(conn)
+                elif (now - idle_since > self.max_idle_time
+                        and self._size - len(expired) > self.min_size):
+                    self._stats['idle_reaped'] += 1
+                    expired.append(conn)
+                else:
+                    kept.append((conn, idle_since))
+            self._idle = kept
+
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def close(self):
+        """关闭连接池及所有空闲连接，使用中的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """连接池统计信息"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'closed': self._closed,
+            })
+        return stats
+
+
+def make_pool_key(config: dict):
+    """将数据库配置转换为可哈希的连接池键"""
+    return tuple(sorted((k, str(v)) for k, v in config.items()))
+
+
+class PoolRegistry:
+    """按数据库配置管理多个连接池，并在后台定期回收空闲连接"""
+
+    def __init__(self, pool_factory, reap_interval=60):
+        """
+        :param pool_factory: 接收数据库配置、返回 ConnectionPool 的函数
+        :param reap_interval: 后台回收空闲连接的间隔（秒），为 None 时不启动回收线程
+        """
+        self._pool_factory = pool_factory
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._reap_interval = reap_interval
+        self._reaper = None
+
+    def get(self, config: dict) -> ConnectionPool:
+        """获取配置对应的连接池，不存在时创建"""
+        key = make_pool_key(config)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pool_factory(dict(config))
+                self._pools[key] = pool
+                self._start_reaper()
+            return pool
+
+    def discard(self, config: dict):
+        """关闭并移除配置对应的连接池"""
+        key = make_pool_key(config)
+        with self._lock:
+            pool = self._pools.pop(key, None)
+        if pool is not None:
+            pool.close()
+
+    def close_all(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        """所有连接池的统计信息，键为 host:port/database"""
+        with self._lock:
+            items = list(self._pools.items())
+
+        result = {}
+        for key, pool in items:
+            config = dict(key)
+            name = f"{config.get('host')}:{config.get('port')}/{config.get('database')}"
+            result[name] = pool.stats()
+        return result
+
+    def reap_idle(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        return sum(pool.reap_idle() for pool in pools)
+
+    def _start_reaper(self):
+        if self._reap_interval is None or self._reaper is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self._reap_interval)
+                try:
+                    self.reap_idle()
+                except Exception:
+                    pass
+
+        self._reaper = threading.Thread(target=loop, name='db-pool-reaper', daemon=True)
+        self._reaper.start()
@@ -20,10 +20,24 @@ Postgres Agent
 """
 
 from datetime import datetime
-from gradio_ui import create_ui
+from gradio_ui import QueueMetrics, create_ui
+from history_manager import HistoryManager
 from postgres_agent import PGAgent
 
 
+# 同时处理的请求数：不超过数据库连接池的最大连接数（默认 10）
+CONCURRENCY_LIMIT = 8
+
+# 排队请求数上限，超出时拒绝新请求
+MAX_QUEUE_SIZE = 64
+
+# 排队指标，可通过 queue_metrics.stats() 查看
+queue_metrics = QueueMetrics()
+
+# 历史记录按 token 数截取，较早的工具输出先被压缩
+history_manager = HistoryManager(max_tokens=4096)
+
+
 # LLM 配置
 LLM_CFG = {
     'model': 'Qwen3-0.6B-FP8',
@@ -56,7 +70,7 @@ def create_react_agent(llm_cfg, db_config):
 my_bot = create_react_agent(LLM_CFG, DB_CONFIG)
 
 
-def generate_response(message, history, max_history=6):
+def generate_response(message, history):
     if not message.strip():
         return message, history
 
@@ -73,8 +87,8 @@ def generate_response(message, history, max_history=6):
         ])
     }]
 
-    # 保留最后 max_history 条历史记录
-    messages = history[-max_history:] + messages
+    # 按 token 预算保留历史记录，预算中扣除本轮消息
+    messages = history_manager.trim(history, reserve=history_manager.count(messages[-1])) + messages
 
     history.append({"role": "user", "content": message})
     history.append({"role": "assistant", "content": ""})
@@ -93,7 +107,10 @@ if __name__ == "__main__":
     demo = create_ui(llm_func=generate_response,
                      tab_name="Gradio APP - Postgres Agent",
                      main_title="Postgres Agent Demo",
-                     sub_title=f"{model_name}")
+                     sub_title=f"{model_name}",
+                     concurrency_limit=CONCURRENCY_LIMIT,
+                     max_size=MAX_QUEUE_SIZE,
+                     metrics=queue_metrics)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
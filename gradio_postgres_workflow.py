@@ -19,11 +19,25 @@ Postgres Workflow
     - 查一下该用户订单的物流状态
 """
 
-from gradio_ui import create_ui
-from postgres_agent import PGAgent
+from answer_cache import SemanticAnswerCache, cache_scope
+from gradio_ui import QueueMetrics, create_ui
+from history_manager import HistoryManager
 from postgres_workflow import PGWorkflow
 
 
+# 同时处理的请求数：不超过数据库连接池的最大连接数（默认 10）
+CONCURRENCY_LIMIT = 8
+
+# 排队请求数上限，超出时拒绝新请求
+MAX_QUEUE_SIZE = 64
+
+# 排队指标，可通过 queue_metrics.stats() 查看
+queue_metrics = QueueMetrics()
+
+# 历史记录按 token 数截取，较早的工具输出先被压缩
+history_manager = HistoryManager(max_tokens=3072)
+
+
 # LLM 配置
 LLM_CFG = {
     'model': 'Qwen3-0.6B-FP8',
@@ -46,38 +60,71 @@ DB_CONFIG = {
 }
 
 
-def create_react_agent(llm_cfg, db_config):
-    # 实例化 Workflow
-    pga = PGAgent(llm_cfg, db_config)
-    react_agent = pga.create_react_agent()
-    return react_agent
+pgwf = PGWorkflow(LLM_CFG, DB_CONFIG)
 
+# 语义答案缓存，需要先启动 bge-m3 embedding 服务；服务不可用时自动跳过缓存
+answer_cache = SemanticAnswerCache(threshold=0.92, ttl=600)
+cache_key = cache_scope(DB_CONFIG)
 
-pgwf = PGWorkflow(LLM_CFG, DB_CONFIG)
-my_bot = create_react_agent(LLM_CFG, DB_CONFIG)
+# 各阶段在界面上显示的进度
+STAGE_LABELS = {
+    'tables': "正在定位数据表 ...",
+    'schema': "正在查询表结构 ...",
+}
 
 
-def generate_response(message, history, max_history=4):
+def render_progress(event: dict) -> str:
+    """将 workflow 的阶段事件渲染为回答框中的进度提示"""
+    label = STAGE_LABELS[event['stage']]
+    if event['content']:
+        return f"{label}\n\n> " + event['content'].replace("\n", "\n> ")
+    return label
+
+
+def generate_response(message, history):
     if not message.strip():
         return message, history
 
     messages = [{'role': 'user', 'content': message}]
 
-    # 保留最后 max_history 条历史记录
-    messages = history[-max_history:] + messages
+    # 按 token 预算保留历史记录，预算中扣除本轮消息
+    messages = history_manager.trim(history, reserve=history_manager.count(messages[-1])) + messages
 
-    history.append({"role": "user", "content": message})
-    history.append({"role": "assistant", "content": "工作流运行中 ..."})
+    # 有历史记录时，同样的问题可能指代不同的对象（如「该用户」），不复用答案，只复用表结构提示
+    reuse_answer = not history
 
-    # 注入 context 后的 messages
-    messages = pgwf.workflow(messages)
+    history.append({"role": "user", "content": message})
+    history.append({"role": "assistant", "content": STAGE_LABELS['tables']})
+    yield "", history
 
-    # 流式响应
-    for chunk in my_bot.run(messages):
-        content = chunk[-1].get("content", "")
-        history[-1]["content"] = content
+    match = answer_cache.lookup(cache_key, message)
+    if match is not None and reuse_answer and match.answer:
+        history[-1]["content"] = match.answer
+        yield "", history
+        return
+
+    # 命中缓存时跳过定位数据表的步骤，直接回答
+    if match is not None and match.has_hint:
+        events = pgwf.answer_stream(messages, message, match.hint)
+    else:
+        events = pgwf.workflow_stream(messages)
+
+    # 流式显示各阶段的进度和回答
+    content = ""
+    for event in events:
+        if event['stage'] == 'hint':
+            answer_cache.put(cache_key, message, hint=event['hint'])
+            continue
+        if event['stage'] == 'answer':
+            content = event['content']
+            history[-1]["content"] = content
+        else:
+            history[-1]["content"] = render_progress(event)
         yield "", history
 
+    if reuse_answer and content:
+        answer_cache.put(cache_key, message, answer=content)
+
     yield "", history
 
 
@@ -86,7 +133,10 @@ if __name__ == "__main__":
     demo = create_ui(llm_func=generate_response,
                      tab_name="Gradio APP - Postgres Workflow",
                      main_title="Postgres Workflow Demo",
-                     sub_title=f"{model_name}")
+                     sub_title=f"{model_name}",
+                     concurrency_limit=CONCURRENCY_LIMIT,
+                     max_size=MAX_QUEUE_SIZE,
+                     metrics=queue_metrics)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
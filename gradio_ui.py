@@ -4,13 +4,22 @@
 Gradio 聊天界面
 
 定义聊天界面样式，通过 `generate_response` 函数模拟大语言模型的回复。
+
+并发：请求进入 Gradio 的有界队列，最多 concurrency_limit 个请求同时处理，队列满时拒绝新请求；
+QueueMetrics 记录排队深度、等待时间和处理中的请求数
 """
 
 import gradio as gr
+import inspect
+import logging
 import random
+import threading
 import time
 
 
+logger = logging.getLogger(__name__)
+
+
 # 模拟大语言模型生成回复
 def generate_response(message, history):
     if not message.strip():
@@ -173,8 +182,112 @@ html, body {
 """
 
 
-def create_ui(llm_func, tab_name, main_title, sub_title):
-    """创建聊天界面"""
+class QueueMetrics:
+    """
+    线程安全的排队指标
+
+    排队深度和等待时间取自 Gradio 队列中的事件：被拒绝（队列已满）的请求不会进入队列，
+    客户端断开的请求由 Gradio 移出队列，都不会计入排队深度
+    """
+
+    def __init__(self, window=200):
+        """
+        :param window: 统计最近多少个请求的等待时间
+        """
+        self.window = window
+        self._blocks = None
+        self._lock = threading.Lock()
+        self._waits = []
+        self._stats = {'started': 0, 'finished': 0, 'active': 0}
+
+    def bind(self, blocks: gr.Blocks):
+        """关联 Gradio 应用，从其队列中读取排队的事件"""
+        self._blocks = blocks
+
+    def _queue(self):
+        return getattr(self._blocks, '_queue', None)
+
+    def _event_wait(self, session_hash, now):
+        """该会话正在处理的事件在队列中等待的时间（秒），找不到时返回 None"""
+        queue = self._queue()
+        if queue is None:
+            return None
+        for job in list(queue.active_jobs):
+            for event in job or []:
+                if event.session_hash != session_hash:
+                    continue
+                # Gradio 6 在事件上记录进入队列的时间（monotonic），更早的版本记录在 event_analytics 中（time.time）
+                if getattr(event, 'enqueue_time', None) is not None:
+                    return now - event.enqueue_time
+                analytics = getattr(queue, 'event_analytics', {}).get(event._id)
+                if analytics is not None:
+                    return time.time() - analytics['time']
+        return None
+
+    def start(self, request: gr.Request = None) -> float:
+        """请求开始处理，返回排队等待的时间（秒）"""
+        wait = None
+        if request is not None:
+            wait = self._event_wait(request.session_hash, time.monotonic())
+        with self._lock:
+            if wait is not None:
+                self._waits.append(wait)
+                del self._waits[:-self.window]
+            self._stats['started'] += 1
+            self._stats['active'] += 1
+        return wait or 0.0
+
+    def finish(self):
+        with self._lock:
+            self._stats['finished'] += 1
+            self._stats['active'] -= 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+        queue = self._queue()
+        stats['queued'] = len(queue) if queue is not None else 0
+        stats['avg_wait'] = sum(waits) / len(waits) if waits else 0.0
+        stats['p95_wait'] = waits[int(len(waits) * 0.95)] if waits else 0.0
+        stats['max_wait'] = waits[-1] if waits else 0.0
+        return stats
+
+
+def instrument(llm_func, metrics: QueueMetrics):
+    """为回复函数（流式或非流式）增加排队指标的记录；Gradio 向返回的函数注入 gr.Request"""
+
+    def handler(message, history, request: gr.Request):
+        wait = metrics.start(request)
+        try:
+            response = llm_func(message, history)
+            if inspect.isgenerator(response):
+                yield from response
+            else:
+                yield response
+        finally:
+            metrics.finish()
+            if logger.isEnabledFor(logging.DEBUG):
+                stats = metrics.stats()
+                logger.debug("等待 %.2fs，排队 %d，处理中 %d，平均等待 %.2fs",
+                             wait, stats['queued'], stats['active'], stats['avg_wait'])
+
+    return handler
+
+
+def create_ui(llm_func, tab_name, main_title, sub_title,
+              concurrency_limit=8, max_size=64, metrics=None):
+    """
+    创建聊天界面
+
+    :param llm_func: 流式回复函数，参数为 (message, history)
+    :param concurrency_limit: 同时处理的请求数，应与 LLM 服务（及数据库连接池）的容量匹配
+    :param max_size: 排队请求数上限，队列满时拒绝新请求
+    :param metrics: QueueMetrics 实例，不传时新建
+    """
+    metrics = metrics or QueueMetrics()
+    handler = instrument(llm_func, metrics)
+
     with gr.Blocks(
         title=tab_name,
         theme=gr.themes.Soft(primary_hue="blue", secondary_hue="blue"),
@@ -211,22 +324,18 @@ def create_ui(llm_func, tab_name, main_title, sub_title):
             )
             submit_btn = gr.Button("发送", elem_classes=["button"])
 
-        # 交互逻辑
-        def clear_input():
-            return ""
+        # 交互逻辑：排队执行回复函数
+        for trigger in (msg.submit, submit_btn.click):
+            trigger(
+                handler,
+                [msg, chatbot],
+                [msg, chatbot],
+                concurrency_limit=concurrency_limit,
+                concurrency_id="chat"
+            )
 
-        msg.submit(
-            llm_func,
-            [msg, chatbot],
-            [msg, chatbot]
-        )
-        
-        submit_btn.click(
-            llm_func,
-            [msg, chatbot],
-            [msg, chatbot]
-        )
-    
+    ui.queue(default_concurrency_limit=concurrency_limit, max_size=max_size)
+    metrics.bind(ui)
     return ui
 
 
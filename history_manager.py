@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+对话历史管理
+
+Gradio 应用原先按消息条数截取历史记录（history[-max_history:]），
+一条很长的工具输出就可能撑满上下文、拖慢 prefill，而简短的对话又会过早丢掉有用的上下文。
+本模块按 token 数截取历史记录，Gradio 应用共用
+
+主要功能:
+- 从最新的消息向前保留，直到用完 token 预算
+- 较早的工具输出（ReAct 的 Observation、function / tool 消息）先被压缩或丢弃，最近的工具输出保留原文
+- 每条消息的 token 数按内容缓存，每轮对话只需计算新增的消息
+- 默认使用本地模型的 tokenizer 计数；transformers 或模型文件不可用时按字符数估算
+"""
+
+import hashlib
+import re
+import threading
+
+from collections import OrderedDict
+
+
+# 本地模型目录，见 model/download_qwen.py
+TOKENIZER_PATH = './model/Qwen/Qwen3-0.6B-FP8'
+
+# ReActChat 回复中的工具输出：从 Observation: 到下一个 Thought: 或结尾
+_OBSERVATION_RE = re.compile(r'(Observation:)(.*?)(?=\nThought:|\Z)', re.DOTALL)
+
+# 工具输出的消息角色
+TOOL_ROLES = ('function', 'tool')
+
+# 中日韩字符大致一个字符一个 token，其他字符大致四个字符一个 token
+_CJK_RE = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """不依赖 tokenizer，粗略估算 token 数"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def load_token_counter(tokenizer_path=TOKENIZER_PATH):
+    """
+    加载 tokenizer 计数函数
+
+    :return: 文本 -> token 数的函数；transformers 未安装或模型文件不存在时返回 estimate_tokens
+    """
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+    except (ImportError, OSError, ValueError):
+        return estimate_tokens
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def message_text(message: dict) -> str:
+    """消息的文本内容；多模态消息只计算其中的文本"""
+    content = message.get('content') or ''
+    if isinstance(content, list):
+        return "".join(item.get('text', '') for item in content if isinstance(item, dict))
+    return str(content)
+
+
+class HistoryManager:
+    """按 token 预算截取对话历史，线程安全"""
+
+    def __init__(self, max_tokens=4096, max_messages=None, count_tokens=None,
+                 keep_tool_outputs=1, max_observation_chars=200, cache_size=4096):
+        """
+        :param max_tokens: 历史记录的 token 预算
+        :param max_messages: 历史记录的条数上限，None 表示只按 token 数截取
+        :param count_tokens: 文本 -> token 数的函数，默认见 load_token_counter
+        :param keep_tool_outputs: 保留原文工具输出的最近助手消息数，更早的工具输出被压缩或丢弃
+        :param max_observation_chars: 压缩后每段工具输出保留的字符数
+        :param cache_size: 缓存的消息 token 数的条数
+        """
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self._count_tokens = count_tokens
+        self.keep_tool_outputs = keep_tool_outputs
+        self.max_observation_chars = max_observation_chars
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # 消息内容的摘要 -> token 数
+        self._token_cache = OrderedDict()
+
+    @property
+    def count_tokens(self):
+        # tokenizer 在第一次使用时才加载
+        if self._count_tokens is None:
+            self._count_tokens = load_token_counter()
+        return self._count_tokens
+
+    def count(self, message: dict) -> int:
+        """消息的 token 数，按角色和内容缓存"""
+        text = message_text(message)
+        key = hashlib.md5(f"{message.get('role')}\0{text}".encode('utf-8')).digest()
+        with self._lock:
+            tokens = self._token_cache.get(key)
+            if tokens is not None:
+                self._token_cache.move_to_end(key)
+                return tokens
+
+        # 每条消息另有角色标记等固定开销
+        tokens = self.count_tokens(text) + 4
+        with self._lock:
+            self._token_cache[key] = tokens
+            while len(self._token_cache) > self.cache_size:
+                self._token_cache.popitem(last=False)
+        return tokens
+
+    def compact(self, message: dict):
+        """
+        压缩消息中的工具输出
+
+        :return: 压缩后的消息；function / tool 消息返回 None，表示丢弃
+        """
+        if message.get('role') in TOOL_ROLES:
+            return None
+        content = message.get('content')
+        if message.get('role') != 'assistant' or not isinstance(content, str) or 'Observation:' not in content:
+            return message
+
+        limit = self.max_observation_chars
+
+        def shorten(match):
+            observation = match.group(2)
+            if len(observation) <= limit:
+                return match.group()
+            return f"{match.group(1)}{observation[:limit]} ...（工具输出已省略 {len(observation) - limit} 字符）"
+
+        return dict(message, content=_OBSERVATION_RE.sub(shorten, content))
+
+    def trim(self, history: list, reserve=0) -> list:
+        """
+        截取对话历史
+
+        :param history: Gradio 的对话历史（messages 格式）
+        :param reserve: 预算中预留给本轮新消息的 token 数
+        :return: 截取后的历史记录，以用户消息开头
+        """
+        budget = self.max_tokens - reserve
+        kept = []
+        used = 0
+        recent_tool_outputs = 0
+        for message in reversed(history):
+            if self.max_messages is not None and len(kept) >= self.max_messages:
+                break
+
+            # 最近的工具输出保留原文，更早的先压缩再计入预算
+            if message.get('role') in TOOL_ROLES or 'Observation:' in message_text(message):
+                if recent_tool_outputs >= self.keep_tool_outputs:
+                    message = self.compact(message)
+                    if message is None:
+                        continue
+                recent_tool_outputs += 1
+
+            tokens = self.count(message)
+            if used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+
+        kept.reverse()
+        # 不从助手的回复或工具输出开始
+        while kept and kept[0].get('role') != 'user':
+            kept.pop(0)
+        return kept
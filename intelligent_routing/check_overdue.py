@@ -15,6 +15,7 @@ import psycopg2
 from dotenv import load_dotenv
 from qwen_agent.tools.base import BaseTool, register_tool
 from qwen_agent.agents import Assistant
+from table_renderer import render_rows
 
 
 # 从 .env 读取数据库配置
@@ -63,23 +64,8 @@ def get_uid_info(uid: int) -> str:
         if not records:
             return ""
 
-        result = [
-            "| 订单号 | 订单状态 | 订单时间戳 | 物流状态 | 物流时间戳 |",
-            "| --- | --- | --- | --- | --- |"
-        ]
-
-        for row in records:
-            order_id = str(row[0]) if row[0] is not None else 'NULL'
-            order_status = str(row[1]) if row[1] is not None else 'NULL'
-            order_timestamp = str(row[2]) if row[2] is not None else 'NULL'
-            logistics_status = str(row[3]) if row[3] is not None else 'NULL'
-            logistics_timestamp = str(row[4]) if row[4] is not None else 'NULL'
-
-            result.append(
-                f"| {order_id} | {order_status} | {order_timestamp} | {logistics_status} | {logistics_timestamp} |"
-            )
-
-        return "\n".join(result)
+        column_names = ["订单号", "订单状态", "订单时间戳", "物流状态", "物流时间戳"]
+        return render_rows(column_names, records).rstrip("\n")
 
 
 def overdue_checker(uid, bot) -> str:
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+数据库元数据缓存
+
+表结构一天只变化几次，却会被 Agent 反复查询。本模块缓存表信息、字段信息等元数据，
+使稳态下几乎不再访问系统表
+
+主要功能:
+- 按数据库划分缓存空间，条目键中包含模式名
+- 条目按 TTL 过期，支持显式失效
+- 可选的目录版本检查：定期执行一次廉价的版本查询，版本变化时清空该数据库的缓存
+- 同时支持同步和异步（asyncio）的加载函数
+"""
+
+import threading
+import time
+
+
+class MetadataCache:
+    """线程安全的 TTL 元数据缓存"""
+
+    def __init__(self, ttl=600, version_check_interval=30):
+        """
+        :param ttl: 条目的存活时间（秒）
+        :param version_check_interval: 目录版本检查的最小间隔（秒），None 表示不做版本检查
+        """
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        # scope -> {key: (value, expires_at)}
+        self._entries = {}
+        # scope -> (version, last_checked)
+        self._versions = {}
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'version_checks': 0}
+
+    def _version_due(self, scope, version_func):
+        """是否到达目录版本的检查间隔"""
+        if version_func is None or self.version_check_interval is None:
+            return False
+
+        with self._lock:
+            last_checked = self._versions.get(scope, (None, None))[1]
+        return last_checked is None or time.monotonic() - last_checked >= self.version_check_interval
+
+    def _record_version(self, scope, current):
+        """记录最新的目录版本，版本变化时清空该 scope"""
+        with self._lock:
+            self._stats['version_checks'] += 1
+            version = self._versions.get(scope, (None, None))[0]
+            if version is not None and current != version and scope in self._entries:
+                del self._entries[scope]
+                self._stats['invalidations'] += 1
+            self._versions[scope] = (current, time.monotonic())
+
+    def _lookup(self, scope, key):
+        """返回 (是否命中, 值)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(scope, {}).get(key)
+            if entry is not None and entry[1] > now:
+                self._stats['hits'] += 1
+                return True, entry[0]
+            self._stats['misses'] += 1
+        return False, None
+
+    def _store(self, scope, key, value):
+        with self._lock:
+            self._entries.setdefault(scope, {})[key] = (value, time.monotonic() + self.ttl)
+
+    def get(self, scope, key, loader, version_func=None):
+        """
+        读取缓存，未命中或过期时调用 loader 加载并写入
+
+        :param scope: 缓存空间，通常为 (host, port, database)
+        :param key: 条目键，例如 ('columns', schema, table_name)
+        :param loader: 无参函数，返回需要缓存的值
+        :param version_func: 无参函数，返回当前目录版本
+        :return: 缓存的值
+        """
+        if self._version_due(scope, version_func):
+            self._record_version(scope, version_func())
+
+        hit, value = self._lookup(scope, key)
+        if hit:
+            return value
+
+        value = loader()
+        self._store(scope, key, value)
+        return value
+
+    async def aget(self, scope, key, loader, version_func=None):
+        """
+        get 的异步版本，loader 和 version_func 为无参的协程函数
+
+        与同步客户端共用同一份缓存数据
+        """
+        if self._version_due(scope, version_func):
+            self._record_version(scope, await version_func())
+
+        hit, value = self._lookup(scope, key)
+        if hit:
+            return value
+
+        value = await loader()
+        self._store(scope, key, value)
+        return value
+
+    def version(self, scope):
+        """最近一次检查得到的目录版本，未检查过时返回 None"""
+        with self._lock:
+            return self._versions.get(scope, (None, None))[0]
+
+    def invalidate(self, scope=None, schema=None):
+        """
+        失效缓存
+
+        :param scope: 需要失效的缓存空间，None 表示全部
+        :param schema: 仅失效该模式下的条目（条目键的第二个元素为模式名）
+        """
+        with self._lock:
+            self._stats['invalidations'] += 1
+            if scope is None:
+                self._entries.clear()
+                self._versions.clear()
+                return
+            if schema is None:
+                self._entries.pop(scope, None)
+                self._versions.pop(scope, None)
+                return
+            entries = self._entries.get(scope, {})
+            for key in [k for k in entries if len(k) > 1 and k[1] == schema]:
+                del entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = sum(len(v) for v in self._entries.values())
+        return stats
@@ -12,6 +12,7 @@
 import mysql_tool
 
 from qwen_agent.agents import Assistant, ReActChat
+from agent_registry import agent_registry
 
 
 SYSTEM_PROMPT = """
@@ -23,15 +24,20 @@ SYSTEM_PROMPT = """
 3. 当用户询问数据库结构时，优先使用表信息和字段信息工具
 4. 当用户需要了解数据内容时，使用样例数据工具
 5. 当用户询问某个字段的取值情况时，使用枚举值统计工具
+6. 需要执行 SQL 时，每次只执行一条查询语句
 """
 
 
 class MySQLAgent:
     """MySQL Agent"""
 
-    def __init__(self, llm_cfg, db_config=None):
+    def __init__(self, llm_cfg, db_config=None, use_mcp=False):
         self.llm_cfg = llm_cfg
 
+        # 默认使用进程内的 run_readonly_sql 工具执行 SQL；
+        # 为 True 时改用 MCP Server，每次创建 Agent 都会通过 uvx 启动一个子进程
+        self.use_mcp = use_mcp
+
         # MySQL 数据库配置
         # 允许 db_config 为 None，为 None 时使用 .env 中的配置
         self.db_config = db_config
@@ -44,8 +50,8 @@ class MySQLAgent:
         else:
             mysql_tool.set_db_config(self.db_config)
 
-    def create_tools(self):
-        """获取工具列表"""
+    def create_mcp_server(self):
+        """MySQL MCP Server 的配置"""
 
         # MySQL 数据库配置
         host = self.db_config.get('host')
@@ -54,28 +60,33 @@ class MySQLAgent:
         user = self.db_config.get('user')
         password = self.db_config.get('password')
 
-        # 工具列表
-        tools = [
-            {
-                "mcpServers": {
-                    "mysql": {
-                        "type": "stdio",
-                        "command": "uvx",
-                        "args": [
-                            "--from",
-                            "mysql-mcp-server",
-                            "mysql_mcp_server"
-                        ],
-                        "env": {
-                            "MYSQL_HOST": host,
-                            "MYSQL_PORT": str(port),
-                            "MYSQL_USER": user,
-                            "MYSQL_PASSWORD": password,
-                            "MYSQL_DATABASE": db
-                        }
+        return {
+            "mcpServers": {
+                "mysql": {
+                    "type": "stdio",
+                    "command": "uvx",
+                    "args": [
+                        "--from",
+                        "mysql-mcp-server",
+                        "mysql_mcp_server"
+                    ],
+                    "env": {
+                        "MYSQL_HOST": host,
+                        "MYSQL_PORT": str(port),
+                        "MYSQL_USER": user,
+                        "MYSQL_PASSWORD": password,
+                        "MYSQL_DATABASE": db
                     }
                 }
-            },
+            }
+        }
+
+    def create_tools(self):
+        """获取工具列表"""
+
+        # 工具列表
+        tools = [
+            self.create_mcp_server() if self.use_mcp else 'run_readonly_sql',
             'get_table_info',
             'get_table_columns_info',
             'get_random_sample',
@@ -85,9 +96,10 @@ class MySQLAgent:
         return tools
 
     def create_react_agent(self):
-        """创建 ReActChat 模式的 Agent"""
+        """创建 ReActChat 模式的 Agent，相同配置的 Agent 在进程内只创建一次"""
         tools = self.create_tools()
-        return ReActChat(
+        return agent_registry.get_or_create(
+            ReActChat,
             llm=self.llm_cfg,
             name='MySQL 数据库助手',
             description='使用 ReActChat 模式查询 MySQL 数据库',
@@ -96,9 +108,10 @@ class MySQLAgent:
         )
 
     def create_assistant_agent(self):
-        """创建 Assistant 模式的 Agent"""
+        """创建 Assistant 模式的 Agent，相同配置的 Agent 在进程内只创建一次"""
         tools = self.create_tools()
-        return Assistant(
+        return agent_registry.get_or_create(
+            Assistant,
             llm=self.llm_cfg,
             name='MySQL 数据库助手',
             description='使用 Assistant 模式查询 MySQL 数据库',
@@ -11,14 +11,24 @@ MySQL 查询工具
 - 查询指定表的所有字段的样例数据
 - 查询指定表的指定字段的样例数据
 - 查询指定表的指定字段的枚举值
+- 在只读事务中执行模型生成的查询语句，并缓存查询结果
+- 通过进程级连接池复用数据库连接
 
 安装依赖：
   uv pip install pymysql python-dotenv
 """
 
+import random
+
 import pymysql
 import pymysql.cursors
 
+from db_pool import ConnectionPool, PoolRegistry
+from query_budget import QueryBudget, truncation_notice
+from result_cache import result_cache, normalize_sql, sql_identifiers
+from sql_guard import CURSOR_KINDS, check_readonly_sql
+from table_renderer import render_rows
+
 
 def get_table_info(conn):
     """
@@ -45,16 +55,21 @@ def get_table_info(conn):
         # 获取并打印结果
         records = cursor.fetchall()
 
-        table_info = [
-            f"当前数据库中包含 {len(records)} 张数据表：\n"
-        ]
+    return format_table_info(records)
+
+
+def format_table_info(records):
+    """将表信息查询结果（字典行）渲染为文本，同步和异步客户端共用"""
+    table_info = [
+        f"当前数据库中包含 {len(records)} 张数据表：\n"
+    ]
 
-        for idx, row in enumerate(records):
-            table_name = row['table_name']
-            comment = row['table_comment']
-            table_info.append(f"数据表 #{idx}:")
-            table_info.append(f"  - 名称: {table_name}")
-            table_info.append(f"  - 注释: {comment if comment else '（无注释）'}")
+    for idx, row in enumerate(records):
+        table_name = row['table_name']
+        comment = row['table_comment']
+        table_info.append(f"数据表 #{idx}:")
+        table_info.append(f"  - 名称: {table_name}")
+        table_info.append(f"  - 注释: {comment if comment else '（无注释）'}")
 
     return "\n".join(table_info)
 
@@ -86,36 +101,167 @@ def get_table_columns_info(conn, table_name):
         # 获取查询结果
         records = cursor.fetchall()
 
-        # 如果没有找到表
-        if not records:
-            return f"数据表 {table_name} 不存在或没有用户字段"
+    return format_columns_info(table_name, records)
+
+
+def format_columns_info(table_name, records):
+    """将字段信息查询结果（字典行）渲染为文本，同步和异步客户端共用"""
+    # 如果没有找到表
+    if not records:
+        return f"数据表 {table_name} 不存在或没有用户字段"
+
+    # 构建结果字符串
+    result = [
+        f"数据表 {table_name} 的字段信息如下：\n"
+    ]
 
-        # 构建结果字符串
-        result = [
-            f"数据表 {table_name} 的字段信息如下：\n"
-        ]
+    for i, row in enumerate(records):
+        column_name = row['COLUMN_NAME']
+        data_type = row['COLUMN_TYPE']
+        comment = row['COLUMN_COMMENT']
+        result.append(f"字段 #{i+1}:")
+        result.append(f"  - 名称: {column_name}")
+        result.append(f"  - 类型: {data_type}")
+        result.append(f"  - 注释: {comment if comment else '（无注释）'}")
 
-        for i, row in enumerate(records):
-            column_name = row['COLUMN_NAME']
-            data_type = row['COLUMN_TYPE']
-            comment = row['COLUMN_COMMENT']
-            result.append(f"字段 #{i+1}:")
-            result.append(f"  - 名称: {column_name}")
-            result.append(f"  - 类型: {data_type}")
-            result.append(f"  - 注释: {comment if comment else '（无注释）'}")
+    return "\n".join(result)
 
-        return "\n".join(result)
 
+# 估算行数低于该值的表直接 ORDER BY RAND()，代价可以忽略
+SAMPLE_RAND_MAX_ROWS = 10000
 
-def get_random_sample(conn, table_name, columns=None):
+# 主键区间抽样时的随机探测次数倍数，用于抵消主键空洞导致的重复命中
+SAMPLE_PROBE_FACTOR = 2
+
+_INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint')
+
+
+SAMPLE_TABLE_SQL = """
+    SELECT
+        TABLE_TYPE AS table_type,
+        TABLE_ROWS AS table_rows
+    FROM
+        information_schema.tables
+    WHERE
+        table_schema = DATABASE()
+        AND table_name = %s;
+"""
+
+SAMPLE_PK_SQL = """
+    SELECT
+        COLUMN_NAME AS column_name,
+        DATA_TYPE AS data_type
+    FROM
+        information_schema.COLUMNS
+    WHERE
+        TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = %s
+        AND COLUMN_KEY = 'PRI';
+"""
+
+
+def get_sample_plan(conn, table_name):
     """
-    获取 MySQL 表中随机 10 条数据，并输出为 Markdown 表格
+    获取抽样所需的表信息
+
+    :param conn: 数据库连接对象
+    :param table_name: 表名
+    :return: (估算行数, 单列整数主键名)，不满足主键区间抽样条件时主键名为 None
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(SAMPLE_TABLE_SQL, (table_name,))
+        table = cursor.fetchone()
+
+        cursor.execute(SAMPLE_PK_SQL, (table_name,))
+        pk_columns = cursor.fetchall()
+
+    return sample_plan(table, pk_columns)
+
+
+def sample_plan(table, pk_columns):
+    """根据 SAMPLE_TABLE_SQL 和 SAMPLE_PK_SQL 的查询结果确定抽样方式，同步和异步客户端共用"""
+    if not table or table['table_type'] != 'BASE TABLE':
+        return 0, None
+
+    table_rows = int(table['table_rows'] or 0)
+    if len(pk_columns) != 1 or pk_columns[0]['data_type'].lower() not in _INTEGER_TYPES:
+        return table_rows, None
+
+    return table_rows, pk_columns[0]['column_name']
+
+
+def _sample_by_pk_range(cursor, select_clause, table_name, pk, limit):
+    """
+    在整数主键的取值区间内随机取点，每个点通过主键索引定位一行
+
+    所有探测合并为一条 UNION ALL 查询，只需一次往返
+    """
+    cursor.execute(f"SELECT MIN(`{pk}`) AS lo, MAX(`{pk}`) AS hi FROM `{table_name}`")
+    bounds = cursor.fetchone()
+    if bounds['lo'] is None:
+        return []
+
+    query, points = pk_range_probe(select_clause, table_name, pk, bounds, limit)
+    cursor.execute(query, points)
+    return dedupe_by_pk(cursor.fetchall(), limit)
+
+
+def pk_range_probe(select_clause, table_name, pk, bounds, limit):
+    """构建主键区间随机探测的 UNION ALL 查询，返回 (SQL, 参数)"""
+    lo, hi = int(bounds['lo']), int(bounds['hi'])
+    points = [random.randint(lo, hi) for _ in range(limit * SAMPLE_PROBE_FACTOR)]
+    probe = f"""(
+            {select_clause}, `{pk}` AS `_sample_pk`
+            FROM `{table_name}`
+            WHERE `{pk}` >= %s
+            ORDER BY `{pk}`
+            LIMIT 1
+        )"""
+    return " UNION ALL ".join([probe] * len(points)), points
+
+
+def dedupe_by_pk(rows, limit):
+    """落在同一主键空洞中的点会命中同一行，按主键去重"""
+    records, seen = [], set()
+    for row in rows:
+        row_pk = row.pop('_sample_pk')
+        if row_pk not in seen:
+            seen.add(row_pk)
+            records.append(row)
+    return records[:limit]
+
+
+def get_random_sample(conn, table_name, columns=None, limit=10, strategy='auto', budget=None,
+                      output_format='markdown'):
+    """
+    获取 MySQL 表中随机若干条数据（默认 10 条），并输出为 Markdown 表格
+
+    大表按整数主键区间随机取点，避免 ORDER BY RAND() 的全表扫描和排序
 
     :param conn: 数据库连接对象
     :param table_name: 需要查询的表名
     :param columns: 需要输出的字段名列表（None 表示所有字段）
-    :return: Markdown 格式的表格字符串
+    :param limit: 返回的行数，默认为 10
+    :param strategy: 抽样方式，可选 'auto' / 'rand' / 'pk_range'，
+                     'auto' 根据估算行数和主键类型自动选择
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :param output_format: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :return: 表格字符串，默认为 Markdown 格式
     """
+    if strategy not in ('auto', 'rand', 'pk_range'):
+        raise ValueError(f"不支持的抽样方式：{strategy}")
+
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    pk = None
+    if strategy != 'rand':
+        table_rows, pk = get_sample_plan(conn, table_name)
+        if strategy == 'pk_range' and pk is None:
+            raise ValueError(f"数据表 {table_name} 没有单列整数主键，无法按主键区间抽样")
+        if strategy == 'auto' and table_rows < SAMPLE_RAND_MAX_ROWS:
+            pk = None
 
     with conn.cursor() as cursor:
         # 构建字段选择部分
@@ -126,63 +272,52 @@ def get_random_sample(conn, table_name, columns=None):
         else:
             select_clause = "SELECT *"
 
-        # 构建 SQL 查询
-        query = f"""
-            {select_clause}
-            FROM `{table_name}`
-            ORDER BY RAND()
-            LIMIT 10
-        """
+        if pk is not None:
+            records = _sample_by_pk_range(cursor, select_clause, table_name, pk, limit)
+        else:
+            # 构建 SQL 查询
+            query = f"""
+                {select_clause}
+                FROM `{table_name}`
+                ORDER BY RAND()
+                LIMIT %s
+            """
 
-        cursor.execute(query)
+            cursor.execute(query, (limit,))
 
-        # 获取查询结果
-        records = cursor.fetchall()
+            # 获取查询结果
+            records = cursor.fetchall()
 
-        # 如果没有数据
-        if not records:
-            return f"数据表 {table_name} 中没有数据"
+    return format_sample(table_name, columns, records, output_format, limit, requested)
 
-        # 获取列名
-        if records:
-            column_names = list(records[0].keys())
-        else:
-            return f"数据表 {table_name} 中没有数据"
-
-        # 构建Markdown表格
-        markdown_table = "| " + " | ".join(column_names) + " |\n"
-        markdown_table += "| " + " | ".join(["---"] * len(column_names)) + " |\n"
-
-        # 添加数据行
-        for row in records:
-            formatted_row = []
-            for col in column_names:
-                value = row[col]
-                if value is None:
-                    formatted_row.append("NULL")
-                elif isinstance(value, str):
-                    # 简化处理：移除换行符，截断长文本
-                    clean_value = value.replace('\n', ' ').replace('\r', '')
-                    if len(clean_value) > 50:
-                        clean_value = clean_value[:47] + "..."
-                    formatted_row.append(clean_value)
-                else:
-                    formatted_row.append(str(value))
-
-            markdown_table += "| " + " | ".join(formatted_row) + " |\n"
-
-        # 构建结果字符串
-        prefix = f"数据表 {table_name} 中包含"
-        if columns:
-            columns_str = ", ".join(columns)
-            prefix += f" {columns_str} 字段的示例数据如下：\n\n"
-        else:
-            prefix += "所有字段的示例数据如下：\n\n"
 
-        return prefix + markdown_table
+def format_sample(table_name, columns, records, output_format='markdown', limit=None, requested=None):
+    """将抽样结果（字典行）渲染为表格文本，同步和异步客户端共用"""
+    # 如果没有数据
+    if not records:
+        return f"数据表 {table_name} 中没有数据"
+
+    # 获取列名
+    column_names = list(records[0].keys())
 
+    # 渲染为表格（默认 Markdown）
+    table = render_rows(column_names, records, fmt=output_format)
 
-def get_top_enum_values(conn, table_name, column_name, limit=10):
+    # 构建结果字符串
+    prefix = f"数据表 {table_name} 中包含"
+    if columns:
+        columns_str = ", ".join(columns)
+        prefix += f" {columns_str} 字段的示例数据如下：\n\n"
+    else:
+        prefix += "所有字段的示例数据如下：\n\n"
+
+    if requested is not None and limit < requested:
+        table += "\n" + truncation_notice(f"请求 {requested} 行，超出行数上限，仅返回前 {limit} 行")
+
+    return prefix + table
+
+
+def get_top_enum_values(conn, table_name, column_name, limit=10, budget=None):
     """
     获取 MySQL 表中指定字段出现频率最高的前 N 个枚举值及其计数
 
@@ -190,60 +325,125 @@ def get_top_enum_values(conn, table_name, column_name, limit=10):
     :param table_name: 需要查询的表名
     :param column_name: 需要统计的字段名
     :param limit: 返回的结果数量，默认为前10个
+    :param budget: 查询预算 QueryBudget，限制返回的行数
     :return: Markdown 格式的统计结果
     """
-    with conn.cursor() as cursor:
-        # 构建 SQL 查询
-        query = f"""
-            SELECT 
-                `{column_name}` AS value,
-                COUNT(*) AS frequency
-            FROM 
-                `{table_name}`
-            GROUP BY 
-                `{column_name}`
-            ORDER BY 
-                frequency DESC,
-                value ASC
-            LIMIT %s;
-        """
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
 
-        cursor.execute(query, (limit,))
+    with conn.cursor() as cursor:
+        cursor.execute(enum_values_query(table_name, column_name), (limit,))
 
         # 获取查询结果
         records = cursor.fetchall()
 
-        # 如果没有数据
-        if not records:
-            return f"数据表 {table_name} 中没有找到字段 {column_name} 的数据"
+    return format_enum_values(table_name, column_name, records, limit, requested)
+
+
+def enum_values_query(table_name, column_name):
+    """构建统计字段取值出现次数的 SQL"""
+    return f"""
+        SELECT 
+            `{column_name}` AS value,
+            COUNT(*) AS frequency
+        FROM 
+            `{table_name}`
+        GROUP BY 
+            `{column_name}`
+        ORDER BY 
+            frequency DESC,
+            value ASC
+        LIMIT %s;
+    """
 
-        # 构建结果字符串
-        prefix = f"数据表 {table_name} 中 {column_name} 字段的"
-        if len(records) <= limit:
-            prefix += "枚举值如下："
-        else:
-            prefix += f" TOP {limit} 枚举值如下："
 
-        result = [
-            prefix,
-            "",
-            "| 枚举值 | 出现次数 |",
-            "| --- | --- |"
-        ]
+def format_enum_values(table_name, column_name, records, limit, requested=None):
+    """将枚举值统计结果（字典行）渲染为文本，同步和异步客户端共用"""
+    # 如果没有数据
+    if not records:
+        return f"数据表 {table_name} 中没有找到字段 {column_name} 的数据"
+
+    # 构建结果字符串
+    prefix = f"数据表 {table_name} 中 {column_name} 字段的"
+    if len(records) <= limit:
+        prefix += "枚举值如下："
+    else:
+        prefix += f" TOP {limit} 枚举值如下："
+
+    result = [
+        prefix,
+        "",
+        render_rows(["枚举值", "出现次数"],
+                    ((row['value'], row['frequency']) for row in records)).rstrip("\n")
+    ]
+
+    if requested is not None and limit < requested:
+        result += ["", truncation_notice(f"请求 {requested} 行，超出行数上限，仅返回前 {limit} 行")]
+
+    return "\n".join(result)
+
+
+def _conn_scope(conn):
+    """连接所属数据库的缓存空间"""
+    return (conn.host, conn.port, conn.db)
+
 
-        for row in records:
-            value = row['value']
-            frequency = row['frequency']
-            if value is None:
-                display_value = "NULL"
-            else:
-                display_value = str(value)
+def run_readonly_sql(conn, sql, budget=None, output_format='markdown', use_cache=True):
+    """
+    在只读事务中执行一条查询语句，并渲染结果
+
+    连接上未结束的事务会先回滚；执行结束后同样回滚，不会留下任何修改
+
+    :param conn: 数据库连接对象
+    :param sql: 查询语句，只允许一条 SELECT / WITH / VALUES / TABLE / EXPLAIN / SHOW / DESCRIBE 语句
+    :param budget: 查询预算 QueryBudget，限制执行时间和读取的行数
+    :param output_format: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :param use_cache: 是否使用查询结果缓存，缓存键为规范化后的 SQL
+    :return: 表格字符串，默认为 Markdown 格式
+    :raises ValueError: SQL 不是单条查询语句
+    """
+    sql, kind = check_readonly_sql(sql, 'mysql')
+    budget = budget or QueryBudget()
+
+    if use_cache:
+        key = result_cache.make_key(_conn_scope(conn), 'sql', normalize_sql(sql, 'mysql'), output_format,
+                                    budget.max_rows, budget.statement_timeout)
+        return result_cache.get_or_load(key,
+                                        lambda: run_readonly_sql(conn, sql, budget, output_format, use_cache=False),
+                                        sql_identifiers(sql, 'mysql'))
 
-            result.append(
-                f"| {display_value} | {frequency} |"
-            )
+    conn.rollback()
+    with conn.cursor() as cursor:
+        if budget.statement_timeout:
+            # max_execution_time 只对 SELECT 生效，会话级设置在建立连接时已生效，这里按本次预算覆盖
+            cursor.execute("SET SESSION max_execution_time = %s", (budget.statement_timeout,))
+        cursor.execute("START TRANSACTION READ ONLY")
+
+    # 流式游标按批读取，超出行数上限的部分不会读入内存
+    cursor = conn.cursor(pymysql.cursors.SSDictCursor if kind in CURSOR_KINDS else None)
+    truncated = False
+    try:
+        cursor.execute(sql)
+        rows, truncated = budget.fetch(cursor)
+        column_names = [desc[0] for desc in cursor.description or []]
+    finally:
+        if truncated:
+            # 流式结果必须读完才能在连接上执行下一条语句，直接关闭连接；连接池归还时重置失败，会丢弃该连接
+            conn.close()
+        else:
+            cursor.close()
+            conn.rollback()
+
+    if not column_names:
+        return "查询执行成功，没有返回结果"
+    if not rows:
+        return f"查询结果为空（字段：{', '.join(column_names)}）"
 
-        return "\n".join(result)
+    result = f"查询返回 {len(rows)} 行：\n\n" + render_rows(column_names, rows, fmt=output_format)
+    if truncated:
+        result += "\n" + truncation_notice(f"结果超过 {budget.max_rows} 行，仅返回前 {budget.max_rows} 行")
+    return result
 
 
 def create_conn():
@@ -278,6 +478,12 @@ def load_env():
 
 
 def create_conn_from_dotenv(config: dict):
+    # 会话级语句超时（毫秒），max_execution_time 只对 SELECT 生效
+    init_command = None
+    statement_timeout = QueryBudget.from_config(config).statement_timeout
+    if statement_timeout:
+        init_command = f"SET SESSION max_execution_time={statement_timeout}"
+
     conn = pymysql.connect(
         host=config["host"],
         port=config["port"],
@@ -285,7 +491,8 @@ def create_conn_from_dotenv(config: dict):
         user=config["user"],
         password=config["password"],
         charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
+        cursorclass=pymysql.cursors.DictCursor,
+        init_command=init_command
     )
 
     return conn
@@ -298,6 +505,66 @@ def close_conn(conn, verbose=False):
             print('The `conn` has been closed.')
 
 
+def _ping_conn(conn):
+    """取出连接前预检，连接被 wait_timeout 断开时原地重连"""
+    conn.ping(reconnect=True)
+    return True
+
+
+def _reset_conn(conn):
+    """归还连接前结束事务，避免下次查询读到旧快照"""
+    conn.rollback()
+
+
+def _create_pool(config: dict) -> ConnectionPool:
+    """
+    根据数据库配置创建连接池，池参数可通过 pool_* 配置项调整
+
+    pool_max_lifetime 应小于 MySQL 的 wait_timeout，使连接在被服务端断开前主动轮换
+    """
+    max_lifetime = config.get('pool_max_lifetime', 3600)
+    return ConnectionPool(
+        connect=lambda: create_conn_from_dotenv(config),
+        validate=_ping_conn,
+        reset=_reset_conn,
+        min_size=int(config.get('pool_min_size', 1)),
+        max_size=int(config.get('pool_max_size', 10)),
+        max_idle_time=float(config.get('pool_max_idle_time', 300)),
+        max_lifetime=float(max_lifetime) if max_lifetime is not None else None,
+        # 默认每次取出都预检，ping 只是一次轻量往返
+        check_interval=float(config.get('pool_check_interval', 0)),
+        timeout=float(config.get('pool_timeout', 30)),
+    )
+
+
+_pool_registry = PoolRegistry(_create_pool)
+
+
+def get_pool(config: dict) -> ConnectionPool:
+    """获取数据库配置对应的进程级连接池"""
+    return _pool_registry.get(config)
+
+
+def pooled_conn(config: dict):
+    """
+    从连接池中取出连接的上下文管理器，退出时自动归还
+
+    with pooled_conn(db_config) as conn:
+        print(get_table_info(conn))
+    """
+    return get_pool(config).connection()
+
+
+def discard_pool(config: dict):
+    """关闭并移除数据库配置对应的连接池"""
+    _pool_registry.discard(config)
+
+
+def pool_stats() -> dict:
+    """所有连接池的统计信息"""
+    return _pool_registry.stats()
+
+
 if __name__ == '__main__':
     c = create_conn()
 
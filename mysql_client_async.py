@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+MySQL 异步查询工具
+
+mysql_client 的 asyncio 版本，基于 aiomysql 驱动和 aiomysql 连接池。
+一个事件循环即可同时服务大量会话，等待数据库时不占用线程
+
+主要功能:
+- 查询数据库中所有表及其注释信息
+- 查询指定表的所有字段定义和注释
+- 查询指定表的样例数据（大表按整数主键区间抽样）
+- 查询指定表的指定字段的枚举值
+- 按数据库配置复用异步连接池
+- 与同步客户端共用结果渲染
+
+安装依赖：
+  uv pip install aiomysql python-dotenv
+
+用法：
+  async with pooled_conn(db_config) as conn:
+      print(await get_table_info(conn))
+"""
+
+import asyncio
+import contextlib
+
+import aiomysql
+import pymysql
+
+from db_pool import make_pool_key
+from query_budget import QueryBudget
+from mysql_client import (SAMPLE_RAND_MAX_ROWS, SAMPLE_TABLE_SQL, SAMPLE_PK_SQL, sample_plan,
+                          pk_range_probe, dedupe_by_pk, enum_values_query,
+                          format_table_info, format_columns_info, format_sample, format_enum_values,
+                          load_env)
+
+
+async def get_table_info(conn):
+    """
+    获取 MySQL 数据库中所有表及其表注释信息
+
+    :param conn: 数据库连接对象
+    :return: 当前数据库中的所有表及注释
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT
+                TABLE_NAME as table_name,
+                TABLE_COMMENT as table_comment
+            FROM
+                information_schema.tables
+            WHERE
+                table_schema = DATABASE()
+                AND table_type = 'BASE TABLE'
+            ORDER BY
+                TABLE_NAME;
+        """)
+        records = await cursor.fetchall()
+
+    return format_table_info(records)
+
+
+async def get_table_columns_info(conn, table_name):
+    """
+    获取 MySQL 数据库中指定表的所有字段及字段注释
+
+    :param conn: 数据库连接对象
+    :param table_name: 需要查询的表名
+    :return: 表的所有字段信息
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute("""
+            SELECT
+                COLUMN_NAME,
+                COLUMN_TYPE,
+                COLUMN_COMMENT
+            FROM
+                information_schema.COLUMNS
+            WHERE
+                TABLE_SCHEMA = DATABASE()
+                AND TABLE_NAME = %s
+            ORDER BY
+                ORDINAL_POSITION;
+        """, (table_name,))
+        records = await cursor.fetchall()
+
+    return format_columns_info(table_name, records)
+
+
+async def get_sample_plan(conn, table_name):
+    """
+    获取抽样所需的表信息，见 mysql_client.get_sample_plan
+
+    :return: (估算行数, 单列整数主键名)，不满足主键区间抽样条件时主键名为 None
+    """
+    async with conn.cursor() as cursor:
+        await cursor.execute(SAMPLE_TABLE_SQL, (table_name,))
+        table = await cursor.fetchone()
+
+        await cursor.execute(SAMPLE_PK_SQL, (table_name,))
+        pk_columns = await cursor.fetchall()
+
+    return sample_plan(table, pk_columns)
+
+
+async def get_random_sample(conn, table_name, columns=None, limit=10, strategy='auto', budget=None,
+                            output_format='markdown'):
+    """
+    获取 MySQL 表中随机若干条数据（默认 10 条），并输出为 Markdown 表格
+
+    大表按整数主键区间随机取点，避免 ORDER BY RAND() 的全表扫描和排序
+
+    :param conn: 数据库连接对象
+    :param table_name: 需要查询的表名
+    :param columns: 需要输出的字段名列表（None 表示所有字段）
+    :param limit: 返回的行数，默认为 10
+    :param strategy: 抽样方式，可选 'auto' / 'rand' / 'pk_range'
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :param output_format: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :return: 表格字符串，默认为 Markdown 格式
+    """
+    if strategy not in ('auto', 'rand', 'pk_range'):
+        raise ValueError(f"不支持的抽样方式：{strategy}")
+
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    pk = None
+    if strategy != 'rand':
+        table_rows, pk = await get_sample_plan(conn, table_name)
+        if strategy == 'pk_range' and pk is None:
+            raise ValueError(f"数据表 {table_name} 没有单列整数主键，无法按主键区间抽样")
+        if strategy == 'auto' and table_rows < SAMPLE_RAND_MAX_ROWS:
+            pk = None
+
+    if columns:
+        # 使用反引号包围字段名以防止关键字冲突
+        select_clause = "SELECT " + ", ".join(f"`{col}`" for col in columns)
+    else:
+        select_clause = "SELECT *"
+
+    async with conn.cursor() as cursor:
+        if pk is not None:
+            await cursor.execute(f"SELECT MIN(`{pk}`) AS lo, MAX(`{pk}`) AS hi FROM `{table_name}`")
+            bounds = await cursor.fetchone()
+            records = []
+            if bounds['lo'] is not None:
+                query, points = pk_range_probe(select_clause, table_name, pk, bounds, limit)
+                await cursor.execute(query, points)
+                records = dedupe_by_pk(await cursor.fetchall(), limit)
+        else:
+            await cursor.execute(f"""
+                {select_clause}
+                FROM `{table_name}`
+                ORDER BY RAND()
+                LIMIT %s
+            """, (limit,))
+            records = await cursor.fetchall()
+
+    return format_sample(table_name, columns, records, output_format, limit, requested)
+
+
+async def get_top_enum_values(conn, table_name, column_name, limit=10, budget=None):
+    """
+    获取 MySQL 表中指定字段出现频率最高的前 N 个枚举值及其计数
+
+    :param conn: 数据库连接对象
+    :param table_name: 需要查询的表名
+    :param column_name: 需要统计的字段名
+    :param limit: 返回的结果数量，默认为前10个
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :return: Markdown 格式的统计结果
+    """
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    async with conn.cursor() as cursor:
+        await cursor.execute(enum_values_query(table_name, column_name), (limit,))
+        records = await cursor.fetchall()
+
+    return format_enum_values(table_name, column_name, records, limit, requested)
+
+
+def _connect_kwargs(config: dict):
+    """aiomysql 的连接参数，语句超时在建立会话时生效"""
+    init_command = None
+    statement_timeout = QueryBudget.from_config(config).statement_timeout
+    if statement_timeout:
+        init_command = f"SET SESSION max_execution_time={statement_timeout}"
+
+    return dict(
+        host=config["host"],
+        port=int(config["port"]),
+        db=config["database"],
+        user=config["user"],
+        password=config["password"],
+        charset='utf8mb4',
+        cursorclass=aiomysql.DictCursor,
+        init_command=init_command,
+        # 只读查询无需事务；aiomysql 归还处于事务中的连接时会将其关闭
+        autocommit=True,
+    )
+
+
+async def create_conn_from_dotenv(config: dict):
+    """建立单个异步连接，用完后需调用 conn.close()"""
+    return await aiomysql.connect(**_connect_kwargs(config))
+
+
+async def _create_pool(config: dict):
+    """
+    根据数据库配置创建 aiomysql 连接池，池参数与同步客户端使用相同的 pool_* 配置项
+
+    pool_max_lifetime 对应 aiomysql 的 pool_recycle，应小于 MySQL 的 wait_timeout
+    """
+    max_lifetime = config.get('pool_max_lifetime', 3600)
+    return await aiomysql.create_pool(
+        minsize=int(config.get('pool_min_size', 1)),
+        maxsize=int(config.get('pool_max_size', 10)),
+        pool_recycle=int(max_lifetime) if max_lifetime is not None else -1,
+        **_connect_kwargs(config),
+    )
+
+
+# (事件循环, 连接池键) -> 创建连接池的 Task；aiomysql 连接池只能在创建它的事件循环中使用
+_pools = {}
+
+
+def _drop_closed_loops():
+    """
+    移除已关闭的事件循环中的连接池
+
+    每次 asyncio.run 都会新建事件循环，结束后这些连接池既不能再使用，也无法在原事件循环中关闭；
+    不移除的话，_pools 会一直引用这些事件循环及其连接池。
+    不使用 WeakKeyDictionary：值（Task）引用着事件循环，键永远不会被回收
+    """
+    for key in [k for k in _pools if k[0].is_closed()]:
+        del _pools[key]
+
+
+async def get_pool(config: dict) -> aiomysql.Pool:
+    """获取数据库配置对应的连接池，并发调用时只创建一次"""
+    _drop_closed_loops()
+    key = (asyncio.get_running_loop(), make_pool_key(config))
+    task = _pools.get(key)
+    if task is None:
+        task = _pools[key] = asyncio.ensure_future(_create_pool(config))
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        if _pools.get(key) is task:
+            del _pools[key]
+        raise
+
+
+@contextlib.asynccontextmanager
+async def pooled_conn(config: dict):
+    """
+    从连接池中取出连接的异步上下文管理器，退出时自动归还
+
+    async with pooled_conn(db_config) as conn:
+        print(await get_table_info(conn))
+    """
+    pool = await get_pool(config)
+    conn = await asyncio.wait_for(pool.acquire(), timeout=float(config.get('pool_timeout', 30)))
+    try:
+        # 取出时预检，连接被 wait_timeout 断开时原地重连
+        await conn.ping(reconnect=True)
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+async def _close_pool(task):
+    if task.done() and not task.exception():
+        pool = task.result()
+        pool.close()
+        await pool.wait_closed()
+
+
+async def discard_pool(config: dict):
+    """关闭并移除当前事件循环中数据库配置对应的连接池"""
+    task = _pools.pop((asyncio.get_running_loop(), make_pool_key(config)), None)
+    if task is not None:
+        await _close_pool(task)
+
+
+async def close_all():
+    """关闭当前事件循环中的所有连接池"""
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _pools if k[0] is loop]:
+        await _close_pool(_pools.pop(key))
+
+
+def pool_stats() -> dict:
+    """所有连接池的统计信息，键为 host:port/database"""
+    _drop_closed_loops()
+    result = {}
+    for (_, key), task in list(_pools.items()):
+        if not task.done() or task.exception():
+            continue
+        pool = task.result()
+        config = dict(key)
+        name = f"{config.get('host')}:{config.get('port')}/{config.get('database')}"
+        result[name] = {
+            'size': pool.size,
+            'idle': pool.freesize,
+            'min_size': pool.minsize,
+            'max_size': pool.maxsize,
+        }
+    return result
+
+
+async def main():
+    config = load_env()
+
+    try:
+        async with pooled_conn(config) as conn:
+            # 打印表及表注释
+            print("【查询数据库中所有表及其注释信息】\n")
+            print(await get_table_info(conn))
+            print("*" * 80)
+
+            # 打印字段信息
+            print("【查询指定表的所有字段定义和注释】\n")
+            print(await get_table_columns_info(conn, table_name='students'))
+            print("*" * 80)
+
+            # 打印样例数据
+            print("【查询指定表的所有字段的样例数据】\n")
+            print(await get_random_sample(conn, table_name='students'))
+            print("*" * 80)
+
+            # 打印指定字段的样例数据
+            print("【查询指定表的指定字段的样例数据】\n")
+            print(await get_random_sample(conn, "students", columns=["name", "gpa"]))
+            print("*" * 80)
+
+            # 打印指定字段出现频率前十的枚举值
+            print("【查询指定表的指定字段的枚举值】\n")
+            print(await get_top_enum_values(conn, "students", "class"))
+            print("*" * 80)
+    except pymysql.Error as e:
+        print(f"查询失败: {e}")
+    finally:
+        await close_all()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -8,18 +8,23 @@ MySQL 数据库的 Qwen-Agent Function Calling 模块
 - ColumnsInfoTool: 获取指定表的字段定义和注释
 - SampleDataTool: 获取表的随机样例数据
 - EnumValuesTool: 获取字段的枚举值统计
+- ReadonlySQLTool: 在只读事务中执行查询语句
 """
 
 import json
 import json5
+import pymysql
 
 from qwen_agent.agents import Assistant
 from qwen_agent.tools.base import BaseTool, register_tool
+from query_budget import QueryBudget
+from result_cache import result_cache
 from mysql_client import (get_table_info as mysql_get_table_info,
                           get_table_columns_info as mysql_get_columns_info,
                           get_random_sample as mysql_get_sample,
                           get_top_enum_values as mysql_get_enum_values,
-                          load_env, create_conn_from_dotenv, close_conn)
+                          run_readonly_sql as mysql_run_readonly_sql,
+                          load_env, pooled_conn, discard_pool, pool_stats)
 
 
 # 加载数据库配置
@@ -28,9 +33,33 @@ db_config = dict()  # 未来使用 set_db_config 函数加载
 
 
 def set_db_config(config: dict):
-    """更新数据库配置"""
+    """更新数据库配置，配置变化时关闭旧配置对应的连接池"""
     global db_config
+    old_config = dict(db_config)
     db_config.update(config)
+    if old_config and old_config != db_config:
+        discard_pool(old_config)
+
+
+def get_pool_stats() -> dict:
+    """连接池统计信息，可用于监控采集"""
+    return pool_stats()
+
+
+def get_cache_stats() -> dict:
+    """查询结果缓存的命中统计，可用于调整 TTL"""
+    return {'result': result_cache.stats()}
+
+
+def get_budget() -> QueryBudget:
+    """当前数据库配置下的查询预算"""
+    return QueryBudget.from_config(db_config)
+
+
+def format_result(result: str, budget: QueryBudget = None) -> str:
+    """按预算截断过长的结果，并序列化为工具返回值"""
+    budget = budget or get_budget()
+    return json.dumps({'result': budget.truncate(result)}, ensure_ascii=False)
 
 
 @register_tool('get_table_info')
@@ -40,12 +69,10 @@ class TableInfoTool(BaseTool):
     parameters = []
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
-        try:
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
             result = mysql_get_table_info(conn)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+        return format_result(result, budget)
 
 
 @register_tool('get_table_columns_info')
@@ -60,14 +87,12 @@ class ColumnsInfoTool(BaseTool):
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
-        try:
-            params_dict = json5.loads(params)
-            table_name = params_dict['table_name']
+        params_dict = json5.loads(params)
+        table_name = params_dict['table_name']
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
             result = mysql_get_columns_info(conn, table_name)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+        return format_result(result, budget)
 
 
 @register_tool('get_random_sample')
@@ -84,18 +109,23 @@ class SampleDataTool(BaseTool):
         'type': 'array',
         'description': '需要查询的字段列表，如果不指定则查询所有字段',
         'required': False
+    }, {
+        'name': 'output_format',
+        'type': 'string',
+        'description': '输出格式，可选 markdown、csv、json，默认为 markdown；csv 和 json 更节省篇幅',
+        'default': 'markdown'
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
-        try:
-            params_dict = json5.loads(params)
-            table_name = params_dict['table_name']
-            columns = params_dict.get('columns', None)
-            result = mysql_get_sample(conn, table_name, columns)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+        params_dict = json5.loads(params)
+        table_name = params_dict['table_name']
+        columns = params_dict.get('columns', None)
+        output_format = params_dict.get('output_format', 'markdown')
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
+            result = mysql_get_sample(conn, table_name, columns, budget=budget,
+                                      output_format=output_format)
+        return format_result(result, budget)
 
 
 @register_tool('get_top_enum_values')
@@ -120,16 +150,43 @@ class EnumValuesTool(BaseTool):
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
+        params_dict = json5.loads(params)
+        table_name = params_dict['table_name']
+        column_name = params_dict['column_name']
+        limit = params_dict.get('limit', 10)
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
+            result = mysql_get_enum_values(conn, table_name, column_name, limit, budget=budget)
+        return format_result(result, budget)
+
+
+@register_tool('run_readonly_sql')
+class ReadonlySQLTool(BaseTool):
+    """在只读事务中执行查询语句"""
+    description = '在 MySQL 数据库中执行一条只读的 SQL 查询语句，返回查询结果。不能修改数据，每次只能执行一条语句'
+    parameters = [{
+        'name': 'sql',
+        'type': 'string',
+        'description': '需要执行的 SQL 查询语句',
+        'required': True
+    }, {
+        'name': 'output_format',
+        'type': 'string',
+        'description': '输出格式，可选 markdown、csv、json，默认为 markdown；csv 和 json 更节省篇幅',
+        'default': 'markdown'
+    }]
+
+    def call(self, params: str, **kwargs) -> str:
+        params_dict = json5.loads(params)
+        budget = get_budget()
         try:
-            params_dict = json5.loads(params)
-            table_name = params_dict['table_name']
-            column_name = params_dict['column_name']
-            limit = params_dict.get('limit', 10)
-            result = mysql_get_enum_values(conn, table_name, column_name, limit)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+            with pooled_conn(db_config) as conn:
+                result = mysql_run_readonly_sql(conn, params_dict['sql'], budget,
+                                                output_format=params_dict.get('output_format', 'markdown'))
+        except (ValueError, pymysql.Error) as e:
+            # 把错误信息返回给模型，便于修正 SQL 后重试
+            result = f"SQL 执行失败：{e}"
+        return format_result(result, budget)
 
 
 if __name__ == '__main__':
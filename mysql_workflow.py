@@ -19,8 +19,8 @@ from mysql_agent import MySQLAgent
 class MySQLWorkflow(MySQLAgent):
     """MySQL Workflow"""
 
-    def __init__(self, llm_cfg, db_config=None):
-        super().__init__(llm_cfg, db_config)
+    def __init__(self, llm_cfg, db_config=None, use_mcp=False):
+        super().__init__(llm_cfg, db_config, use_mcp)
         self.llm_cfg = llm_cfg
 
         # MySQL 数据库配置
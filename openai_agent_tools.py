@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+PostgreSQL / MySQL 数据库的 OpenAI Agents SDK 工具
+
+基于 postgres_client_async 和 mysql_client_async，工具函数均为协程，
+在 Runner 的事件循环中直接 await 数据库查询，不阻塞其他会话
+
+用法：
+  tools = create_postgres_tools(db_config)
+  agent = Agent(name="PostgreSQL Assistant", tools=tools, ...)
+"""
+
+import asyncio
+
+from agents import function_tool
+
+import mysql_client_async
+import postgres_client_async
+from query_budget import QueryBudget
+
+
+def create_postgres_tools(db_config: dict) -> list:
+    """
+    创建绑定到指定 PostgreSQL 数据库的工具列表
+
+    :param db_config: 数据库配置，同 postgres_client.load_env 的返回值
+    :return: FunctionTool 列表
+    """
+    client = postgres_client_async
+
+    @function_tool(strict_mode=False)
+    async def get_table_info() -> str:
+        """查询数据库中的所有表及其表注释信息"""
+        budget = QueryBudget.from_config(db_config)
+        async with client.pooled_conn(db_config) as conn:
+            return budget.truncate(await client.get_table_info(conn))
+
+    @function_tool(strict_mode=False)
+    async def get_table_columns_info(table_names: list[str], schema: str = 'public') -> str:
+        """
+        查询指定表的所有字段定义和注释信息
+
+        Args:
+            table_names: 需要查询的表名列表，多张表会并发查询
+            schema: 表所在的模式，默认为 public
+        """
+        budget = QueryBudget.from_config(db_config)
+
+        async def fetch(table_name):
+            async with client.pooled_conn(db_config) as conn:
+                return await client.get_table_columns_info(conn, table_name, schema)
+
+        results = await asyncio.gather(*(fetch(name) for name in table_names))
+        return budget.truncate("\n\n".join(results))
+
+    @function_tool(strict_mode=False)
+    async def get_random_sample(table_name: str, columns: list[str] | None = None, limit: int = 10,
+                                schema: str = 'public', output_format: str = 'markdown') -> str:
+        """
+        查询指定表的随机样例数据
+
+        Args:
+            table_name: 需要查询的表名
+            columns: 需要查询的字段名列表，不填表示所有字段
+            limit: 返回的行数，默认为 10
+            schema: 表所在的模式，默认为 public
+            output_format: 输出格式，可选 markdown / csv / json，csv 和 json 更节省 token
+        """
+        budget = QueryBudget.from_config(db_config)
+        async with client.pooled_conn(db_config) as conn:
+            result = await client.get_random_sample(conn, table_name, schema, columns, limit,
+                                                    budget=budget, output_format=output_format)
+        return budget.truncate(result)
+
+    @function_tool(strict_mode=False)
+    async def get_top_enum_values(table_name: str, column_name: str, limit: int = 10,
+                                  schema: str = 'public', exact: bool = False) -> str:
+        """
+        查询指定字段出现频率最高的枚举值及其出现次数
+
+        Args:
+            table_name: 需要查询的表名
+            column_name: 需要统计的字段名
+            limit: 返回的结果数量，默认为 10
+            schema: 表所在的模式，默认为 public
+            exact: 是否强制精确统计；默认使用统计信息或抽样给出近似值
+        """
+        budget = QueryBudget.from_config(db_config)
+        async with client.pooled_conn(db_config) as conn:
+            result = await client.get_top_enum_values(conn, table_name, column_name, schema, limit,
+                                                      exact=exact, budget=budget)
+        return budget.truncate(result)
+
+    return [get_table_info, get_table_columns_info, get_random_sample, get_top_enum_values]
+
+
+def create_mysql_tools(db_config: dict) -> list:
+    """
+    创建绑定到指定 MySQL 数据库的工具列表
+
+    :param db_config: 数据库配置，同 mysql_client.load_env 的返回值
+    :return: FunctionTool 列表
+    """
+    client = mysql_client_async
+
+    @function_tool(strict_mode=False)
+    async def get_table_info() -> str:
+        """查询数据库中的所有表及其表注释信息"""
+        budget = QueryBudget.from_config(db_config)
+        async with client.pooled_conn(db_config) as conn:
+            return budget.truncate(await client.get_table_info(conn))
+
+    @function_tool(strict_mode=False)
+    async def get_table_columns_info(table_names: list[str]) -> str:
+        """
+        查询指定表的所有字段定义和注释信息
+
+        Args:
+            table_names: 需要查询的表名列表，多张表会并发查询
+        """
+        budget = QueryBudget.from_config(db_config)
+
+        async def fetch(table_name):
+            async with client.pooled_conn(db_config) as conn:
+                return await client.get_table_columns_info(conn, table_name)
+
+        results = await asyncio.gather(*(fetch(name) for name in table_names))
+        return budget.truncate("\n\n".join(results))
+
+    @function_tool(strict_mode=False)
+    async def get_random_sample(table_name: str, columns: list[str] | None = None, limit: int = 10,
+                                output_format: str = 'markdown') -> str:
+        """
+        查询指定表的随机样例数据
+
+        Args:
+            table_name: 需要查询的表名
+            columns: 需要查询的字段名列表，不填表示所有字段
+            limit: 返回的行数，默认为 10
+            output_format: 输出格式，可选 markdown / csv / json，csv 和 json 更节省 token
+        """
+        budget = QueryBudget.from_config(db_config)
+        async with client.pooled_conn(db_config) as conn:
+            result = await client.get_random_sample(conn, table_name, columns, limit,
+                                                    budget=budget, output_format=output_format)
+        return budget.truncate(result)
+
+    @function_tool(strict_mode=False)
+    async def get_top_enum_values(table_name: str, column_name: str, limit: int = 10) -> str:
+        """
+        查询指定字段出现频率最高的枚举值及其出现次数
+
+        Args:
+            table_name: 需要查询的表名
+            column_name: 需要统计的字段名
+            limit: 返回的结果数量，默认为 10
+        """
+        budget = QueryBudget.from_config(db_config)
+        async with client.pooled_conn(db_config) as conn:
+            result = await client.get_top_enum_values(conn, table_name, column_name, limit, budget=budget)
+        return budget.truncate(result)
+
+    return [get_table_info, get_table_columns_info, get_random_sample, get_top_enum_values]
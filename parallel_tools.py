@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+工具调用的并行执行
+
+模型在一步中发出多个互不依赖的工具调用时（例如同时查询三张表的字段），
+Qwen Agent 默认逐个串行执行，每个调用都要等待一次数据库往返。本模块让这些调用并发执行，并按原顺序返回结果
+
+主要内容:
+- ParallelToolCallMixin: 模型输出结束后立即并发执行本步的所有工具调用，Agent 按顺序取结果
+- ParallelAssistant: 启用并行工具调用的 Assistant
+- parallel_map: 在线程池中并发执行批量任务，按输入顺序返回结果
+"""
+
+import contextvars
+import copy
+
+from concurrent.futures import ThreadPoolExecutor
+
+from qwen_agent.agents import Assistant
+
+
+# 并发执行工具调用的线程数，与数据库连接池的默认最大连接数一致
+MAX_PARALLEL_TOOLS = 10
+
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOLS, thread_name_prefix='tool-call')
+
+# 当前运行的待取结果：(工具名, 参数) -> Future 列表，只在推进 ParallelToolCallMixin._run 的一步期间设置
+_current_pending = contextvars.ContextVar('parallel_tool_pending', default=None)
+
+
+def _discard(pending):
+    """清空待取结果，尚未开始执行的调用直接取消"""
+    for futures in pending.values():
+        for future in futures:
+            future.cancel()
+    pending.clear()
+
+
+def parallel_map(func, items, max_workers=MAX_PARALLEL_TOOLS):
+    """
+    并发执行 func(item)，按 items 的顺序返回结果
+
+    :param func: 单个任务的函数，需自行从连接池中取连接
+    :param items: 任务参数列表
+    :param max_workers: 最大并发数，应不超过数据库连接池的最大连接数
+    :return: 结果列表；任务抛出的异常会在取结果时重新抛出
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+class ParallelToolCallMixin:
+    """
+    并行执行同一步中的多个工具调用
+
+    Qwen Agent 的 FnCallAgent 在模型输出结束后，才逐个检测并执行工具调用。
+    本 Mixin 在模型输出流结束时提前把本步所有工具调用提交到线程池，
+    随后 Agent 按原顺序调用 _call_tool 时，直接等待对应的结果
+
+    待取结果保存在本次运行（一次 _run）的状态中：同一个 Agent 实例可能被多个会话并发使用，
+    Gradio 也会在不同的线程中推进同一个生成器，因此不能按线程隔离
+    """
+
+    def _run(self, *args, **kwargs):
+        pending = {}
+        steps = super()._run(*args, **kwargs)
+        try:
+            while True:
+                # 推进一步期间，_call_llm / _call_tool 通过 _current_pending 取得本次运行的待取结果
+                token = _current_pending.set(pending)
+                try:
+                    output = next(steps)
+                except StopIteration:
+                    return
+                finally:
+                    _current_pending.reset(token)
+                yield output
+        finally:
+            steps.close()
+            _discard(pending)
+
+    def _call_llm(self, *args, **kwargs):
+        output_stream = super()._call_llm(*args, **kwargs)
+        if not kwargs.get('stream', True):
+            return output_stream
+        return self._prefetch_tool_calls(output_stream)
+
+    def _prefetch_tool_calls(self, output_stream):
+        output = []
+        for output in output_stream:
+            yield output
+
+        # 新的一步开始前，上一步未取走的结果全部作废
+        pending = _current_pending.get()
+        if pending is None:
+            return
+        _discard(pending)
+
+        calls = []
+        for message in output or []:
+            use_tool, tool_name, tool_args, _ = self._detect_tool(message)
+            tool = self.function_map.get(tool_name) if use_tool else None
+            # 需要读取文件的工具依赖完整的 messages 参数，仍按原方式串行调用
+            if tool is not None and not tool.file_access:
+                calls.append((tool_name, tool_args))
+
+        if len(calls) < 2:
+            return
+
+        for tool_name, tool_args in calls:
+            future = _executor.submit(super()._call_tool, tool_name, copy.deepcopy(tool_args))
+            pending.setdefault((tool_name, str(tool_args)), []).append(future)
+
+    def _call_tool(self, tool_name, tool_args='{}', **kwargs):
+        pending = _current_pending.get()
+        futures = pending.get((tool_name, str(tool_args))) if pending else None
+        if futures:
+            return futures.pop(0).result()
+        return super()._call_tool(tool_name, tool_args, **kwargs)
+
+
+class ParallelAssistant(ParallelToolCallMixin, Assistant):
+    """并行执行工具调用的 Assistant"""
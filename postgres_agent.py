@@ -3,12 +3,15 @@
 """
 简单的 Postgres Agent
 
-支持查询 Postgres 数据库，通过 MCP 和 Funciton Calling 实现
+支持查询 Postgres 数据库，通过 Funciton Calling 实现，也可以改用 MCP 执行 SQL
 """
 
+import copy
 import postgres_tool
 
 from qwen_agent.agents import Assistant, ReActChat
+from agent_registry import agent_registry
+from parallel_tools import ParallelAssistant
 
 
 SYSTEM_PROMPT = """
@@ -17,18 +20,29 @@ SYSTEM_PROMPT = """
 规则：
 1. 始终确保 SQL 查询的安全性，避免修改数据
 2. 以清晰易懂的方式呈现查询结果
-3. 当用户询问数据库结构时，优先使用表信息和字段信息工具
+3. 当用户询问数据库结构时，优先使用表信息和字段信息工具；需要多张表的结构时，使用表结构摘要工具一次性查询
 4. 当用户需要了解数据内容时，使用样例数据工具
 5. 当用户询问某个字段的取值情况时，使用枚举值统计工具
+6. 需要执行 SQL 时，每次只执行一条查询语句
 """
 
 
 class PGAgent:
     """Postgres Agent"""
 
-    def __init__(self, llm_cfg, db_config=None):
+    def __init__(self, llm_cfg, db_config=None, use_vector_search=False, parallel_tools=False, use_mcp=False):
         self.llm_cfg = llm_cfg
 
+        # 表很多时启用向量检索工具，需要先启动 bge-m3 embedding 服务
+        self.use_vector_search = use_vector_search
+
+        # 允许模型在一步中发出多个工具调用，并并行执行（仅对 Assistant 模式生效）
+        self.parallel_tools = parallel_tools
+
+        # 默认使用进程内的 run_readonly_sql 工具执行 SQL；
+        # 为 True 时改用 MCP Server，每次创建 Agent 都会启动一个 Node 子进程
+        self.use_mcp = use_mcp
+
         # Postgres 数据库配置
         # 允许 db_config 为 None，为 None 时使用 .env 中的配置
         self.db_config = db_config
@@ -40,8 +54,8 @@ class PGAgent:
         else:
             postgres_tool.set_db_config(self.db_config)
 
-    def create_tools(self):
-        """获取工具列表"""
+    def create_mcp_server(self):
+        """Postgres MCP Server 的配置"""
 
         # Postgres 数据库配置
         host = self.db_config.get('host')
@@ -50,33 +64,43 @@ class PGAgent:
         user = self.db_config.get('user')
         password = self.db_config.get('password')
 
+        return {
+            "mcpServers": {
+                "postgres": {
+                    "command": "npx",
+                    "args": [
+                        "-y",
+                        "@modelcontextprotocol/server-postgres",
+                        f"postgresql://{user}:{password}@{host}:{port}/{db}",
+                        "--introspect"  # 自动读取数据库模式
+                    ]
+                }
+            }
+        }
+
+    def create_tools(self):
+        """获取工具列表"""
+
         # 工具列表
         tools = [
-            {
-                "mcpServers": {
-                    "postgres": {
-                        "command": "npx",
-                        "args": [
-                            "-y",
-                            "@modelcontextprotocol/server-postgres",
-                            f"postgresql://{user}:{password}@{host}:{port}/{db}",
-                            "--introspect"  # 自动读取数据库模式
-                        ]
-                    }
-                }
-            },
+            self.create_mcp_server() if self.use_mcp else 'run_readonly_sql',
             'get_table_info',
             'get_table_columns_info',
             'get_random_sample',
             'get_top_enum_values',
+            'get_schema_snapshot',
         ]
 
+        if self.use_vector_search:
+            tools.append('search_tables')
+
         return tools
 
     def create_react_agent(self):
-        """创建 ReActChat 模式的 Agent"""
+        """创建 ReActChat 模式的 Agent，相同配置的 Agent 在进程内只创建一次"""
         tools = self.create_tools()
-        return ReActChat(
+        return agent_registry.get_or_create(
+            ReActChat,
             llm=self.llm_cfg,
             name='Postgres 数据库助手',
             description='使用 ReActChat 模式查询 Postgres 数据库',
@@ -85,10 +109,15 @@ class PGAgent:
         )
 
     def create_assistant_agent(self):
-        """创建 Assistant 模式的 Agent"""
+        """创建 Assistant 模式的 Agent，相同配置的 Agent 在进程内只创建一次"""
         tools = self.create_tools()
-        return Assistant(
-            llm=self.llm_cfg,
+        agent_cls, llm_cfg = Assistant, self.llm_cfg
+        if self.parallel_tools:
+            agent_cls, llm_cfg = ParallelAssistant, copy.deepcopy(self.llm_cfg)
+            llm_cfg.setdefault('generate_cfg', {})['parallel_function_calls'] = True
+        return agent_registry.get_or_create(
+            agent_cls,
+            llm=llm_cfg,
             name='Postgres 数据库助手',
             description='使用 Assistant 模式查询 Postgres 数据库',
             system_message=SYSTEM_PROMPT,
@@ -11,19 +11,113 @@ PostgreSQL 查询工具
 - 查询指定表的所有字段的样例数据
 - 查询指定表的指定字段的样例数据
 - 查询指定表的指定字段的枚举值
+- 一次查询获取所有表及字段的结构摘要
+- 在只读事务中执行模型生成的查询语句
+- 通过进程级连接池复用数据库连接
+- 缓存表信息和字段信息，表结构变化时自动失效
+- 缓存样例数据、枚举值和只读 SQL 的查询结果
 """
 
 import psycopg2
 import psycopg2.sql as pyc_sql
 
+from db_pool import ConnectionPool, PoolRegistry
+from metadata_cache import MetadataCache
+from query_budget import QueryBudget, truncation_notice
+from result_cache import result_cache, normalize_sql, sql_identifiers
+from sql_guard import CURSOR_KINDS, check_readonly_sql
+from table_renderer import render_rows
 
-def get_table_info(conn):
+
+# 元数据缓存，ttl 和版本检查间隔可直接修改该对象的属性
+metadata_cache = MetadataCache(ttl=600, version_check_interval=30)
+
+
+def _conn_scope(conn):
+    """连接所属数据库的缓存空间"""
+    info = conn.info
+    return (info.host, info.port, info.dbname)
+
+
+def get_catalog_version(conn):
+    """
+    获取系统目录的版本标识
+
+    DDL 和 COMMENT 会改写 pg_class / pg_attribute / pg_description 中的行，
+    使其 xmin 增大或行数变化，比对这几个值即可廉价地判断表结构是否变化
+
+    :param conn: 数据库连接对象
+    :return: 目录版本元组
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                (SELECT count(*) FROM pg_catalog.pg_class),
+                (SELECT max(xmin::text::bigint) FROM pg_catalog.pg_class),
+                (SELECT max(xmin::text::bigint) FROM pg_catalog.pg_attribute),
+                (SELECT max(xmin::text::bigint) FROM pg_catalog.pg_description);
+        """)
+        return tuple(cursor.fetchone())
+
+
+def cached_metadata(conn, key, loader):
+    """
+    通过元数据缓存读取数据，目录版本变化时自动失效
+
+    :param conn: 数据库连接对象
+    :param key: 条目键，第二个元素为模式名（不区分模式时为 None）
+    :param loader: 无参函数，未命中时调用
+    """
+    return metadata_cache.get(_conn_scope(conn), key, loader,
+                              version_func=lambda: get_catalog_version(conn))
+
+
+def metadata_version(conn):
+    """
+    连接所属数据库的缓存空间，以及元数据缓存最近一次检查得到的目录版本
+
+    用于为依赖表结构的派生数据（如 LLM 总结的表结构）构造缓存键，表结构变化后键随之改变
+    """
+    scope = _conn_scope(conn)
+    return scope, metadata_cache.version(scope)
+
+
+def invalidate_metadata_cache(conn=None, schema=None):
+    """
+    失效元数据缓存
+
+    :param conn: 数据库连接对象，None 表示失效所有数据库的缓存
+    :param schema: 仅失效指定模式下的字段信息
+    """
+    metadata_cache.invalidate(_conn_scope(conn) if conn is not None else None, schema)
+
+
+def cached_result(conn, name, loader, tables, *args):
+    """
+    通过查询结果缓存读取数据，按 TTL 过期
+
+    :param conn: 数据库连接对象
+    :param name: 查询类型，如 'sample'、'enum'、'sql'
+    :param loader: 无参函数，未命中时调用
+    :param tables: 查询涉及的表，包含 result_cache.exclude_tables 中的表时不使用缓存
+    :param args: 参与计算缓存键的查询参数
+    """
+    key = result_cache.make_key(_conn_scope(conn), name, *args)
+    return result_cache.get_or_load(key, loader, tables)
+
+
+def get_table_info(conn, use_cache=True):
     """
     获取 PostgreSQL 数据库中所有表及其表注释信息
 
     :param conn: 数据库连接对象
+    :param use_cache: 是否使用元数据缓存
     :return: 当前数据库中的所有表及注释
     """
+    if use_cache:
+        return cached_metadata(conn, ('table_info', None),
+                               lambda: get_table_info(conn, use_cache=False))
+
     with conn.cursor() as cursor:
         # 执行查询所有表及表注释的 SQL
         cursor.execute("""
@@ -47,28 +141,38 @@ def get_table_info(conn):
         # 获取并打印结果
         records = cursor.fetchall()
 
-        table_info = [
-            f"当前数据库中包含 {len(records)} 张数据表：\n"
-        ]
+    return format_table_info(records)
 
-        for idx, row in enumerate(records):
-            table_name, comment = row
-            table_info.append(f"数据表 #{idx}:")
-            table_info.append(f"  - 名称: {table_name}")
-            table_info.append(f"  - 注释: {comment if comment else '（无注释）'}")
+
+def format_table_info(records):
+    """将 (表名, 表注释) 列表渲染为表信息文本，同步和异步客户端共用"""
+    table_info = [
+        f"当前数据库中包含 {len(records)} 张数据表：\n"
+    ]
+
+    for idx, row in enumerate(records):
+        table_name, comment = row
+        table_info.append(f"数据表 #{idx}:")
+        table_info.append(f"  - 名称: {table_name}")
+        table_info.append(f"  - 注释: {comment if comment else '（无注释）'}")
 
     return "\n".join(table_info)
 
 
-def get_table_columns_info(conn, table_name, schema='public'):
+def get_table_columns_info(conn, table_name, schema='public', use_cache=True):
     """
     获取 PostgreSQL 数据库中指定表的所有字段及字段注释
 
     :param conn: 数据库连接对象
     :param table_name: 需要查询的表名
     :param schema: 表所在的模式，默认为 'public'
+    :param use_cache: 是否使用元数据缓存
     :return: 表的所有字段信息
     """
+    if use_cache:
+        return cached_metadata(conn, ('columns', schema, table_name),
+                               lambda: get_table_columns_info(conn, table_name, schema, use_cache=False))
+
     with conn.cursor() as cursor:
         # 执行查询表字段信息的 SQL
         cursor.execute("""
@@ -96,37 +200,319 @@ def get_table_columns_info(conn, table_name, schema='public'):
         # 获取查询结果
         records = cursor.fetchall()
 
-        # 如果没有找到表
-        if not records:
-            return f"数据表 {table_name} 不存在或没有用户字段"
+    return format_columns_info(table_name, records)
+
+
+def format_columns_info(table_name, records):
+    """将 (字段名, 类型, 注释) 列表渲染为字段信息文本，同步和异步客户端共用"""
+    # 如果没有找到表
+    if not records:
+        return f"数据表 {table_name} 不存在或没有用户字段"
+
+    # 构建结果字符串
+    result = [
+        f"数据表 {table_name} 的字段信息如下：\n"
+    ]
+
+    for i, row in enumerate(records):
+        column_name, data_type, comment = row
+        result.append(f"字段 #{i+1}:")
+        result.append(f"  - 名称: {column_name}")
+        result.append(f"  - 类型: {data_type}")
+        result.append(f"  - 注释: {comment if comment else '（无注释）'}")
+        # result.append("-" * 60)
+
+    return "\n".join(result)
+
+
+def fetch_schema_snapshot(conn, table_names=None):
+    """
+    一次查询取回所有表的表名、注释、估算行数，以及每个字段的类型、注释、主键和外键信息
+
+    :param conn: 数据库连接对象
+    :param table_names: 只查询这些表，None 表示所有表
+    :return: 表信息列表，每个元素为包含 schema / table / comment / rows / columns 的字典
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                n.nspname AS schema_name,
+                c.relname AS table_name,
+                obj_description(c.oid, 'pg_class') AS table_comment,
+                CASE WHEN c.relkind = 'p' THEN (
+                    SELECT COALESCE(sum(GREATEST(ch.reltuples, 0)), -1)
+                    FROM pg_catalog.pg_inherits i
+                    JOIN pg_catalog.pg_class ch ON ch.oid = i.inhrelid
+                    WHERE i.inhparent = c.oid
+                ) ELSE c.reltuples END AS row_estimate,
+                json_agg(json_build_object(
+                    'name', a.attname,
+                    'type', pg_catalog.format_type(a.atttypid, a.atttypmod),
+                    'comment', col_description(c.oid, a.attnum),
+                    'pk', COALESCE(a.attnum = ANY(pk.conkey), false),
+                    'fk', fk.ref
+                ) ORDER BY a.attnum) AS columns
+            FROM
+                pg_catalog.pg_class c
+            JOIN
+                pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            JOIN
+                pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+            LEFT JOIN
+                pg_catalog.pg_constraint pk ON pk.conrelid = c.oid AND pk.contype = 'p'
+            LEFT JOIN LATERAL (
+                SELECT
+                    string_agg(rn.nspname || '.' || rc.relname || '.' || ra.attname, ', ') AS ref
+                FROM
+                    pg_catalog.pg_constraint f
+                JOIN
+                    pg_catalog.pg_class rc ON rc.oid = f.confrelid
+                JOIN
+                    pg_catalog.pg_namespace rn ON rn.oid = rc.relnamespace
+                JOIN
+                    pg_catalog.pg_attribute ra ON ra.attrelid = f.confrelid
+                        AND ra.attnum = f.confkey[array_position(f.conkey, a.attnum)]
+                WHERE
+                    f.conrelid = c.oid
+                    AND f.contype = 'f'
+                    AND a.attnum = ANY(f.conkey)
+            ) fk ON true
+            WHERE
+                c.relkind IN ('r', 'p')
+                AND NOT c.relispartition
+                AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                AND n.nspname NOT LIKE 'pg_toast%%'
+                AND (%s::text[] IS NULL OR c.relname = ANY(%s::text[]))
+            GROUP BY
+                n.nspname, c.oid, c.relname, c.relkind, c.reltuples
+            ORDER BY
+                n.nspname, c.relname;
+        """, (table_names, table_names))
+
+        records = cursor.fetchall()
+
+    return [
+        {
+            'schema': schema_name,
+            'table': table_name,
+            'comment': comment,
+            'rows': int(row_estimate) if row_estimate is not None and row_estimate >= 0 else None,
+            'columns': columns,
+        }
+        for schema_name, table_name, comment, row_estimate, columns in records
+    ]
+
+
+def fetch_enum_stats(conn, max_distinct=50, max_values=20):
+    """
+    从 pg_stats 读取取值较少的字段的高频值，用于 Schema Linking
+
+    :param conn: 数据库连接对象
+    :param max_distinct: 只读取估算不同值个数不超过该值的字段
+    :param max_values: 每个字段最多保留的值个数
+    :return: {(schema, table): {column: [value, ...]}}
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                schemaname,
+                tablename,
+                attname,
+                most_common_vals::text::text[]
+            FROM
+                pg_catalog.pg_stats
+            WHERE
+                schemaname NOT IN ('pg_catalog', 'information_schema')
+                AND most_common_vals IS NOT NULL
+                AND n_distinct BETWEEN 1 AND %s;
+        """, (max_distinct,))
+        records = cursor.fetchall()
+
+    result = {}
+    for schema_name, table_name, column_name, values in records:
+        result.setdefault((schema_name, table_name), {})[column_name] = values[:max_values]
+    return result
+
+
+def render_schema_snapshot(tables):
+    """将 fetch_schema_snapshot 的结果渲染为紧凑的文本摘要"""
+    if not tables:
+        return "没有找到符合条件的数据表"
+
+    lines = [f"共 {len(tables)} 张数据表：", ""]
+    for t in tables:
+        name = t['table'] if t['schema'] == 'public' else f"{t['schema']}.{t['table']}"
+        desc = [t['comment']] if t['comment'] else []
+        if t['rows'] is not None:
+            desc.append(f"约 {t['rows']} 行")
+        lines.append(f"{name}（{'，'.join(desc)}）" if desc else name)
+
+        for col in t['columns']:
+            flags = []
+            if col['pk']:
+                flags.append("PK")
+            if col['fk']:
+                # 同一模式下省略 public. 前缀
+                flags.append(f"FK -> {col['fk'].replace('public.', '')}")
+            line = f"  - {col['name']} {col['type']}"
+            if flags:
+                line += f" [{', '.join(flags)}]"
+            if col['comment']:
+                line += f"：{col['comment']}"
+            lines.append(line)
+        lines.append("")
+
+    return "\n".join(lines).rstrip("\n")
+
+
+def get_schema_tables(conn, use_cache=True):
+    """
+    获取整库的表结构信息（fetch_schema_snapshot 的结果）
+
+    :param conn: 数据库连接对象
+    :param use_cache: 是否使用元数据缓存
+    :return: 表信息列表
+    """
+    if use_cache:
+        return cached_metadata(conn, ('schema_snapshot', None), lambda: fetch_schema_snapshot(conn))
+    return fetch_schema_snapshot(conn)
+
+
+def get_schema_snapshot(conn, table_names=None, use_cache=True):
+    """
+    获取数据库的表结构摘要，一次往返返回所有表及其字段
+
+    :param conn: 数据库连接对象
+    :param table_names: 只返回这些表（表名或 模式名.表名），None 表示所有表
+    :param use_cache: 是否使用元数据缓存
+    :return: 表结构摘要
+    """
+    # 缓存整库快照，按表名过滤在内存中完成，不同的过滤条件共用一份缓存
+    tables = get_schema_tables(conn, use_cache)
+
+    if table_names:
+        wanted = set(table_names)
+        tables = [t for t in tables
+                  if t['table'] in wanted or f"{t['schema']}.{t['table']}" in wanted]
+
+    return render_schema_snapshot(tables)
+
+
+# 估算行数低于该值的表直接 ORDER BY RANDOM()，代价可以忽略
+SAMPLE_RANDOM_MAX_ROWS = 10000
 
-        # 构建结果字符串
-        result = [
-            f"数据表 {table_name} 的字段信息如下：\n"
-        ]
+# 估算行数低于该值的表使用 BERNOULLI 行级抽样（仍需扫描全表，但无需排序），
+# 更大的表使用 SYSTEM 块级抽样，只读取少量数据页
+SAMPLE_BERNOULLI_MAX_ROWS = 1000000
 
-        for i, row in enumerate(records):
-            column_name, data_type, comment = row
-            result.append(f"字段 #{i+1}:")
-            result.append(f"  - 名称: {column_name}")
-            result.append(f"  - 类型: {data_type}")
-            result.append(f"  - 注释: {comment if comment else '（无注释）'}")
-            # result.append("-" * 60)
+# TABLESAMPLE 的过采样倍数，用于抵消死元组、空页等导致的样本不足
+SAMPLE_OVERSAMPLING = 20
 
-        return "\n".join(result)
+# 样本不足时放大抽样比例的上限（百分比），不会退化为全表抽样加全表排序
+SAMPLE_MAX_PERCENT = 10.0
 
 
-def get_random_sample(conn, table_name, schema='public', columns=None):
+def get_relation_stats(conn, table_name, schema='public'):
     """
-    获取 PostgreSQL 表中随机 10 条数据，并输出为 Markdown 表格
+    获取表的类型和估算行数（来自 pg_class.reltuples，分区表为各分区之和）
+
+    :param conn: 数据库连接对象
+    :param table_name: 表名
+    :param schema: 表所在的模式，默认为 'public'
+    :return: (relkind, reltuples)，表不存在时返回 None；从未 ANALYZE 过的表 reltuples 为 -1
+    """
+    def load():
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    c.relkind,
+                    CASE WHEN c.relkind = 'p' THEN (
+                        SELECT COALESCE(sum(GREATEST(ch.reltuples, 0)), -1)
+                        FROM pg_catalog.pg_inherits i
+                        JOIN pg_catalog.pg_class ch ON ch.oid = i.inhrelid
+                        WHERE i.inhparent = c.oid
+                    ) ELSE c.reltuples END AS reltuples
+                FROM
+                    pg_catalog.pg_class c
+                JOIN
+                    pg_catalog.pg_namespace n ON c.relnamespace = n.oid
+                WHERE
+                    n.nspname = %s
+                    AND c.relname = %s;
+            """, (schema, table_name))
+            row = cursor.fetchone()
+        return (row[0], float(row[1])) if row else None
+
+    return cached_metadata(conn, ('relation_stats', schema, table_name), load)
+
+
+def choose_sample_strategy(relkind, reltuples):
+    """
+    根据表类型和估算行数选择抽样方式
+
+    :param relkind: pg_class.relkind
+    :param reltuples: 估算行数，未知时为负数
+    :return: 'random' / 'bernoulli' / 'system'
+    """
+    # 视图、外部表等不支持 TABLESAMPLE；没有统计信息时也无从估算抽样比例
+    if relkind not in ('r', 'm', 'p') or reltuples < SAMPLE_RANDOM_MAX_ROWS:
+        return 'random'
+    if reltuples < SAMPLE_BERNOULLI_MAX_ROWS:
+        return 'bernoulli'
+    return 'system'
+
+
+def sample_percent(reltuples, limit):
+    """达到 limit 行所需的抽样百分比（含过采样）"""
+    return min(100.0, limit * SAMPLE_OVERSAMPLING * 100.0 / max(reltuples, 1.0))
+
+
+def sample_percents(reltuples, limit):
+    """依次尝试的抽样百分比：样本不足时放大一次，放大后不超过 SAMPLE_MAX_PERCENT"""
+    percent = sample_percent(reltuples, limit)
+    retry = min(SAMPLE_MAX_PERCENT, percent * 10)
+    return [percent, retry] if retry > percent else [percent]
+
+
+def get_random_sample(conn, table_name, schema='public', columns=None, limit=10, strategy='auto', budget=None,
+                      output_format='markdown', use_cache=True):
+    """
+    获取 PostgreSQL 表中随机若干条数据（默认 10 条），并输出为 Markdown 表格
+
+    大表使用 TABLESAMPLE 抽样，避免 ORDER BY RANDOM() 的全表扫描和排序
 
     Markdown格式的表格字符串
     :param conn: 数据库连接对象
     :param table_name: 需要查询的表名
     :param schema: 表所在的模式，默认为 'public'
     :param columns: 需要输出的字段名列表（None 表示所有字段）
-    :return: Markdown 格式的表格字符串
+    :param limit: 返回的行数，默认为 10
+    :param strategy: 抽样方式，可选 'auto' / 'random' / 'bernoulli' / 'system'，
+                     'auto' 根据 pg_class.reltuples 自动选择
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :param output_format: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :param use_cache: 是否使用查询结果缓存，TTL 内的相同请求返回同一份样例
+    :return: 表格字符串，默认为 Markdown 格式
     """
+    if strategy not in ('auto', 'random', 'bernoulli', 'system'):
+        raise ValueError(f"不支持的抽样方式：{strategy}")
+
+    if use_cache:
+        return cached_result(conn, 'sample',
+                             lambda: get_random_sample(conn, table_name, schema, columns, limit, strategy, budget,
+                                                       output_format, use_cache=False),
+                             [f"{schema}.{table_name}"],
+                             schema, table_name, columns, limit, strategy, output_format,
+                             budget.max_rows if budget else None)
+
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    stats = get_relation_stats(conn, table_name, schema)
+    relkind, reltuples = stats if stats else (None, -1.0)
+    if strategy == 'auto':
+        strategy = choose_sample_strategy(relkind, reltuples)
 
     with conn.cursor() as cursor:
         # 构建字段选择部分
@@ -137,80 +523,236 @@ def get_random_sample(conn, table_name, schema='public', columns=None):
         else:
             select_clause = pyc_sql.SQL("SELECT *")
 
+        if strategy == 'random':
+            sample_clause = pyc_sql.SQL("")
+            percents = [None]
+        else:
+            sample_clause = pyc_sql.SQL("TABLESAMPLE {} (%s)").format(pyc_sql.SQL(strategy.upper()))
+            # 样本不足时放大一次抽样比例
+            percents = sample_percents(reltuples, limit)
+
         # 安全地构建SQL查询
+        # 对抽样结果再做 ORDER BY RANDOM()，打乱块级抽样带来的物理顺序，此时只需排序少量行
         query = pyc_sql.SQL("""
             {select_clause}
-            FROM {schema}.{table}
+            FROM {schema}.{table} {sample_clause}
             ORDER BY RANDOM()
-            LIMIT 10
+            LIMIT %s
         """).format(
             select_clause=select_clause,
             schema=pyc_sql.Identifier(schema),
-            table=pyc_sql.Identifier(table_name))
-
-        cursor.execute(query)
+            table=pyc_sql.Identifier(table_name),
+            sample_clause=sample_clause)
 
-        # 获取查询结果
-        records = cursor.fetchall()
+        for percent in percents:
+            args = (limit,) if percent is None else (percent, limit)
+            cursor.execute(query, args)
 
-        # 如果没有数据
-        if not records:
-            return f"数据表 {table_name} 中没有数据"
+            # 获取查询结果
+            records = cursor.fetchall()
+            if len(records) >= limit:
+                break
 
         # 获取列名（使用实际查询的列名）
         column_names = [desc[0] for desc in cursor.description]
 
-        # 构建Markdown表格
-        markdown_table = "| " + " | ".join(column_names) + " |\n"
-        markdown_table += "| " + " | ".join(["---"] * len(column_names)) + " |\n"
-
-        # 添加数据行
-        for row in records:
-            formatted_row = []
-            for value in row:
-                if value is None:
-                    formatted_row.append("NULL")
-                elif isinstance(value, str):
-                    # 简化处理：移除换行符，截断长文本
-                    clean_value = value.replace('\n', ' ').replace('\r', '')
-                    if len(clean_value) > 50:
-                        clean_value = clean_value[:47] + "..."
-                    formatted_row.append(clean_value)
-                else:
-                    formatted_row.append(str(value))
-
-            markdown_table += "| " + " | ".join(formatted_row) + " |\n"
-
-        # 构建结果字符串
-        prefix = f"数据表 {table_name} 中包含"
-        if columns:
-            columns = ", ".join(columns)
-            prefix += f" {columns} 字段的示例数据如下：\n\n"
-        else:
-            prefix += "所有字段的示例数据如下：\n\n"
+    return format_sample(table_name, columns, column_names, records, output_format, limit, requested, percent)
+
+
+def format_sample(table_name, columns, column_names, records, output_format='markdown', limit=None, requested=None,
+                  percent=None):
+    """
+    将抽样结果渲染为表格文本，同步和异步客户端共用
+
+    :param table_name: 表名
+    :param columns: 调用方指定的字段名列表（None 表示所有字段）
+    :param column_names: 结果的实际列名
+    :param records: 结果行
+    :param output_format: 输出格式
+    :param limit: 实际返回的行数上限
+    :param requested: 调用方请求的行数，大于 limit 时附上截断说明
+    :param percent: TABLESAMPLE 的抽样百分比，样本少于 limit 行时附上说明
+    """
+    sample_note = ""
+    if percent is not None and limit is not None and len(records) < limit:
+        sample_note = (f"按 {percent:.4g}% 的比例抽样仅得到 {len(records)} 行，少于请求的 {limit} 行；"
+                       f"表的统计信息可能已过期，可执行 ANALYZE 后重试，或直接查询该表")
+
+    # 如果没有数据
+    if not records:
+        if sample_note:
+            return f"数据表 {table_name} 的抽样结果为空：{sample_note}"
+        return f"数据表 {table_name} 中没有数据"
+
+    # 渲染为表格（默认 Markdown）
+    table = render_rows(column_names, records, fmt=output_format)
+
+    # 构建结果字符串
+    prefix = f"数据表 {table_name} 中包含"
+    if columns:
+        columns = ", ".join(columns)
+        prefix += f" {columns} 字段的示例数据如下：\n\n"
+    else:
+        prefix += "所有字段的示例数据如下：\n\n"
+
+    if requested is not None and limit < requested:
+        table += "\n" + truncation_notice(f"请求 {requested} 行，超出行数上限，仅返回前 {limit} 行")
+    if sample_note:
+        table += "\n" + sample_note
+
+    return prefix + table
+
+
+def get_column_stats(conn, table_name, column_name, schema='public'):
+    """
+    从 pg_stats 读取字段的高频值统计
+
+    :param conn: 数据库连接对象
+    :param table_name: 表名
+    :param column_name: 字段名
+    :param schema: 表所在的模式，默认为 'public'
+    :return: (null_frac, 高频值列表, 频率列表)，没有统计信息或没有高频值时返回 None
+    """
+    with conn.cursor() as cursor:
+        # most_common_vals 是 anyarray，经 text 转换为 text[] 后才能取回
+        # 分区表的统计信息记录在 inherited = true 的行中，优先使用
+        cursor.execute("""
+            SELECT
+                null_frac,
+                most_common_vals::text::text[],
+                most_common_freqs
+            FROM
+                pg_catalog.pg_stats
+            WHERE
+                schemaname = %s
+                AND tablename = %s
+                AND attname = %s
+            ORDER BY
+                inherited DESC
+            LIMIT 1;
+        """, (schema, table_name, column_name))
+        row = cursor.fetchone()
+
+    if not row or row[1] is None:
+        return None
+    null_frac, values, freqs = row
+    return float(null_frac or 0), list(values), [float(f) for f in freqs]
+
 
-        return prefix + markdown_table
+def approx_enum_values(stats, reltuples, limit):
+    """将 pg_stats 中的频率按估算行数换算为出现次数"""
+    null_frac, values, freqs = stats
+    items = list(zip(values, freqs))
+    if null_frac > 0:
+        items.append((None, null_frac))
+    items.sort(key=lambda item: -item[1])
+    return [(value, int(round(freq * reltuples))) for value, freq in items[:limit]]
 
 
-def get_top_enum_values(conn, table_name, column_name, schema='public', limit=10):
+def get_top_enum_values(conn, table_name, column_name, schema='public', limit=10, exact=False, budget=None,
+                        use_cache=True):
     """
     获取 PostgreSQL 表中指定字段出现频率最高的前 N 个枚举值及其计数
 
+    默认优先使用 pg_stats 中的高频值统计做近似估算，无需扫描全表；
+    没有统计信息时，大表做抽样统计，小表做精确统计
+
     :param conn: 数据库连接对象
     :param table_name: 需要查询的表名
     :param column_name: 需要统计的字段名
     :param schema: 表所在的模式，默认为 'public'
     :param limit: 返回的结果数量，默认为前10个
+    :param exact: 是否强制做精确统计（GROUP BY 全表）
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :param use_cache: 是否使用查询结果缓存
     :return: Markdown 格式的统计结果
     """
+    if use_cache:
+        return cached_result(conn, 'enum',
+                             lambda: get_top_enum_values(conn, table_name, column_name, schema, limit, exact, budget,
+                                                         use_cache=False),
+                             [f"{schema}.{table_name}"],
+                             schema, table_name, column_name, limit, exact, budget.max_rows if budget else None)
+
+    records = None
+    note = ""
+
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    if not exact:
+        rel_stats = get_relation_stats(conn, table_name, schema)
+        relkind, reltuples = rel_stats if rel_stats else (None, -1.0)
+
+        col_stats = get_column_stats(conn, table_name, column_name, schema) if reltuples > 0 else None
+        if col_stats is not None:
+            records = approx_enum_values(col_stats, reltuples, limit)
+            note = f"（近似值：根据 pg_stats 统计信息按估算总行数 {int(reltuples)} 换算）"
+        elif choose_sample_strategy(relkind, reltuples) == 'system':
+            percent = sample_percent(reltuples, limit * 100)
+            records = _count_enum_values(conn, table_name, column_name, schema, limit, percent)
+            records = [(value, int(round(freq * 100.0 / percent))) for value, freq in records]
+            note = f"（近似值：根据 {percent:.4g}% 的抽样数据换算）"
+
+    if records is None:
+        records = _count_enum_values(conn, table_name, column_name, schema, limit)
+
+    return format_enum_values(table_name, column_name, records, limit, requested, note)
+
+
+def format_enum_values(table_name, column_name, records, limit, requested=None, note=""):
+    """
+    将 (枚举值, 出现次数) 列表渲染为统计结果，同步和异步客户端共用
+
+    :param table_name: 表名
+    :param column_name: 字段名
+    :param records: 统计结果
+    :param limit: 实际返回的结果数上限
+    :param requested: 调用方请求的结果数，大于 limit 时附上截断说明
+    :param note: 附在标题后的说明，如近似值的来源
+    """
+    # 如果没有数据
+    if not records:
+        return f"数据表 {table_name} 中没有找到字段 {column_name} 的数据"
+
+    # 构建结果字符串
+    prefix = f"数据表 {table_name} 中 {column_name} 字段的"
+    if len(records) <= limit:
+        prefix += "枚举值如下"
+    else:
+        prefix += f" TOP {limit} 枚举值如下"
+    prefix += note + "："
+
+    result = [
+        prefix,
+        "",
+        render_rows(["枚举值", "出现次数"], records).rstrip("\n")
+    ]
+
+    if requested is not None and limit < requested:
+        result += ["", truncation_notice(f"请求 {requested} 行，超出行数上限，仅返回前 {limit} 行")]
+
+    return "\n".join(result)
+
+
+def _count_enum_values(conn, table_name, column_name, schema, limit, percent=None):
+    """GROUP BY 统计字段取值的出现次数，指定 percent 时只统计 TABLESAMPLE SYSTEM 抽样数据"""
     with conn.cursor() as cursor:
+        if percent is None:
+            sample_clause = pyc_sql.SQL("")
+            args = (limit,)
+        else:
+            sample_clause = pyc_sql.SQL("TABLESAMPLE SYSTEM (%s)")
+            args = (percent, limit)
+
         # 安全地构建SQL查询
         query = pyc_sql.SQL("""
             SELECT
                 {column} AS value,
                 COUNT(*) AS frequency
             FROM
-                {schema}.{table}
+                {schema}.{table} {sample_clause}
             GROUP BY
                 {column}
             ORDER BY
@@ -220,44 +762,67 @@ def get_top_enum_values(conn, table_name, column_name, schema='public', limit=10
         """).format(
             schema=pyc_sql.Identifier(schema),
             table=pyc_sql.Identifier(table_name),
-            column=pyc_sql.Identifier(column_name)
+            column=pyc_sql.Identifier(column_name),
+            sample_clause=sample_clause
         )
 
-        cursor.execute(query, (limit,))
+        cursor.execute(query, args)
 
         # 获取查询结果
-        records = cursor.fetchall()
+        return cursor.fetchall()
 
-        # 如果没有数据
-        if not records:
-            return f"数据表 {table_name} 中没有找到字段 {column_name} 的数据"
 
-        # 构建结果字符串
-        prefix = f"数据表 {table_name} 中 {column_name} 字段的"
-        if len(records) <= limit:
-            prefix += "枚举值如下："
-        else:
-            prefix += f" TOP {limit} 枚举值如下："
+def run_readonly_sql(conn, sql, budget=None, output_format='markdown', use_cache=True):
+    """
+    在只读事务中执行一条查询语句，并渲染结果
+
+    连接上未结束的事务会先回滚；执行结束后同样回滚，不会留下任何修改
 
-        result = [
-            prefix,
-            "",
-            "| 枚举值 | 出现次数 |",
-            "| --- | --- |"
-        ]
+    :param conn: 数据库连接对象
+    :param sql: 查询语句，只允许一条 SELECT / WITH / VALUES / TABLE / EXPLAIN / SHOW 语句
+    :param budget: 查询预算 QueryBudget，限制执行时间和读取的行数
+    :param output_format: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :param use_cache: 是否使用查询结果缓存，缓存键为规范化后的 SQL
+    :return: 表格字符串，默认为 Markdown 格式
+    :raises ValueError: SQL 不是单条查询语句
+    """
+    sql, kind = check_readonly_sql(sql, 'postgres')
+    budget = budget or QueryBudget()
+
+    if use_cache:
+        return cached_result(conn, 'sql',
+                             lambda: run_readonly_sql(conn, sql, budget, output_format, use_cache=False),
+                             sql_identifiers(sql),
+                             normalize_sql(sql), output_format, budget.max_rows, budget.statement_timeout)
 
-        for row in records:
-            value, frequency = row
-            if value is None:
-                display_value = "NULL"
-            else:
-                display_value = str(value)
+    conn.rollback()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION READ ONLY")
+            # check_readonly_sql 按普通字符串不支持反斜杠转义来识别语句分隔符，服务端须保持一致
+            cursor.execute("SET LOCAL standard_conforming_strings = on")
+            if budget.statement_timeout:
+                cursor.execute("SET LOCAL statement_timeout = %s", (budget.statement_timeout,))
+
+        # 服务端游标按批读取，超出行数上限的部分不会传到客户端；
+        # EXPLAIN / SHOW 不能用于 DECLARE，使用普通游标
+        cursor = conn.cursor(name='readonly_sql') if kind in CURSOR_KINDS else conn.cursor()
+        with cursor:
+            cursor.execute(sql)
+            rows, truncated = budget.fetch(cursor)
+            column_names = [desc[0] for desc in cursor.description or []]
+    finally:
+        conn.rollback()
 
-            result.append(
-                f"| {display_value} | {frequency} |"
-            )
+    if not column_names:
+        return "查询执行成功，没有返回结果"
+    if not rows:
+        return f"查询结果为空（字段：{', '.join(column_names)}）"
 
-        return "\n".join(result)
+    result = f"查询返回 {len(rows)} 行：\n\n" + render_rows(column_names, rows, fmt=output_format)
+    if truncated:
+        result += "\n" + truncation_notice(f"结果超过 {budget.max_rows} 行，仅返回前 {budget.max_rows} 行")
+    return result
 
 
 def create_conn():
@@ -290,12 +855,19 @@ def load_env():
 
 
 def create_conn_from_dotenv(config: dict):
+    # 会话级语句超时（毫秒），防止单条查询长时间占用后端进程
+    options = None
+    statement_timeout = QueryBudget.from_config(config).statement_timeout
+    if statement_timeout:
+        options = f"-c statement_timeout={statement_timeout}"
+
     conn = psycopg2.connect(
         host=config["host"],
         port=config["port"],
         database=config["database"],
         user=config["user"],
-        password=config["password"]
+        password=config["password"],
+        options=options
     )
 
     return conn
@@ -308,6 +880,65 @@ def close_conn(conn, verbose=False):
             print('The `conn` has been closed.')
 
 
+def _check_conn(conn):
+    """连接健康检查"""
+    if conn.closed:
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    conn.rollback()
+    return True
+
+
+def _reset_conn(conn):
+    """归还连接前结束未提交的事务，避免连接停留在 idle in transaction 状态"""
+    if conn.closed:
+        raise psycopg2.InterfaceError("connection already closed")
+    conn.rollback()
+
+
+def _create_pool(config: dict) -> ConnectionPool:
+    """根据数据库配置创建连接池，池参数可通过 pool_* 配置项调整"""
+    return ConnectionPool(
+        connect=lambda: create_conn_from_dotenv(config),
+        validate=_check_conn,
+        reset=_reset_conn,
+        min_size=int(config.get('pool_min_size', 1)),
+        max_size=int(config.get('pool_max_size', 10)),
+        max_idle_time=float(config.get('pool_max_idle_time', 300)),
+        check_interval=float(config.get('pool_check_interval', 30)),
+        timeout=float(config.get('pool_timeout', 30)),
+    )
+
+
+_pool_registry = PoolRegistry(_create_pool)
+
+
+def get_pool(config: dict) -> ConnectionPool:
+    """获取数据库配置对应的进程级连接池"""
+    return _pool_registry.get(config)
+
+
+def pooled_conn(config: dict):
+    """
+    从连接池中取出连接的上下文管理器，退出时自动归还
+
+    with pooled_conn(db_config) as conn:
+        print(get_table_info(conn))
+    """
+    return get_pool(config).connection()
+
+
+def discard_pool(config: dict):
+    """关闭并移除数据库配置对应的连接池"""
+    _pool_registry.discard(config)
+
+
+def pool_stats() -> dict:
+    """所有连接池的统计信息"""
+    return _pool_registry.stats()
+
+
 if __name__ == '__main__':
     c = create_conn()
 
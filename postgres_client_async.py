@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+"""
+PostgreSQL 异步查询工具
+
+postgres_client 的 asyncio 版本，基于 asyncpg 驱动和 asyncpg 连接池。
+一个事件循环即可同时服务大量会话，等待数据库时不占用线程
+
+主要功能:
+- 查询数据库中所有表及其注释信息
+- 查询指定表的所有字段定义和注释
+- 查询指定表的样例数据（大表使用 TABLESAMPLE 抽样）
+- 查询指定表的指定字段的枚举值（优先使用 pg_stats 近似统计）
+- 按数据库配置复用异步连接池
+- 与同步客户端共用元数据缓存和结果渲染
+
+安装依赖：
+  uv pip install asyncpg python-dotenv
+
+用法：
+  async with pooled_conn(db_config) as conn:
+      print(await get_table_info(conn))
+"""
+
+import asyncio
+import contextlib
+
+import asyncpg
+
+from db_pool import make_pool_key
+from query_budget import QueryBudget
+from postgres_client import (metadata_cache, choose_sample_strategy, sample_percent, sample_percents,
+                             approx_enum_values, format_table_info, format_columns_info, format_sample,
+                             format_enum_values, load_env)
+
+
+class ScopedConnection(asyncpg.Connection):
+    """记录所属数据库的连接，用于划分元数据缓存空间"""
+    scope = None
+
+
+def quote_ident(name):
+    """引用 SQL 标识符（asyncpg 没有 psycopg2.sql.Identifier 的等价物）"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _conn_scope(conn):
+    """连接所属数据库的缓存空间，与同步客户端的 (host, port, dbname) 一致"""
+    return conn.scope if conn.scope is not None else id(conn)
+
+
+async def get_catalog_version(conn):
+    """获取系统目录的版本标识，见 postgres_client.get_catalog_version"""
+    return tuple(await conn.fetchrow("""
+        SELECT
+            (SELECT count(*) FROM pg_catalog.pg_class),
+            (SELECT max(xmin::text::bigint) FROM pg_catalog.pg_class),
+            (SELECT max(xmin::text::bigint) FROM pg_catalog.pg_attribute),
+            (SELECT max(xmin::text::bigint) FROM pg_catalog.pg_description);
+    """))
+
+
+async def cached_metadata(conn, key, loader):
+    """
+    通过元数据缓存读取数据，目录版本变化时自动失效
+
+    :param conn: 数据库连接对象
+    :param key: 条目键，第二个元素为模式名（不区分模式时为 None）
+    :param loader: 无参协程函数，未命中时调用
+    """
+    return await metadata_cache.aget(_conn_scope(conn), key, loader,
+                                     version_func=lambda: get_catalog_version(conn))
+
+
+async def get_table_info(conn, use_cache=True):
+    """
+    获取 PostgreSQL 数据库中所有表及其表注释信息
+
+    :param conn: 数据库连接对象
+    :param use_cache: 是否使用元数据缓存
+    :return: 当前数据库中的所有表及注释
+    """
+    if use_cache:
+        return await cached_metadata(conn, ('table_info', None),
+                                     lambda: get_table_info(conn, use_cache=False))
+
+    records = await conn.fetch("""
+        SELECT
+            t.table_name,
+            obj_description(pc.oid, 'pg_class') AS table_comment
+        FROM
+            information_schema.tables t
+        JOIN
+            pg_catalog.pg_class pc ON t.table_name = pc.relname
+        JOIN
+            pg_catalog.pg_namespace pn ON pn.oid = pc.relnamespace
+        WHERE
+            t.table_schema NOT IN ('pg_catalog', 'information_schema')
+            AND t.table_type = 'BASE TABLE'
+            AND pn.nspname NOT IN ('pg_catalog', 'information_schema')
+        ORDER BY
+            t.table_name;
+    """)
+    return format_table_info(records)
+
+
+async def get_table_columns_info(conn, table_name, schema='public', use_cache=True):
+    """
+    获取 PostgreSQL 数据库中指定表的所有字段及字段注释
+
+    :param conn: 数据库连接对象
+    :param table_name: 需要查询的表名
+    :param schema: 表所在的模式，默认为 'public'
+    :param use_cache: 是否使用元数据缓存
+    :return: 表的所有字段信息
+    """
+    if use_cache:
+        return await cached_metadata(conn, ('columns', schema, table_name),
+                                     lambda: get_table_columns_info(conn, table_name, schema, use_cache=False))
+
+    records = await conn.fetch("""
+        SELECT
+            a.attname AS column_name,
+            pg_catalog.format_type(a.atttypid, a.atttypmod) AS data_type,
+            d.description AS column_comment
+        FROM
+            pg_catalog.pg_attribute a
+        LEFT JOIN
+            pg_catalog.pg_description d ON (d.objoid = a.attrelid AND d.objsubid = a.attnum)
+        JOIN
+            pg_catalog.pg_class c ON a.attrelid = c.oid
+        JOIN
+            pg_catalog.pg_namespace n ON c.relnamespace = n.oid
+        WHERE
+            n.nspname = $1
+            AND c.relname = $2
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+        ORDER BY
+            a.attnum;
+    """, schema, table_name)
+    return format_columns_info(table_name, records)
+
+
+async def get_relation_stats(conn, table_name, schema='public'):
+    """
+    获取表的类型和估算行数，见 postgres_client.get_relation_stats
+
+    :return: (relkind, reltuples)，表不存在时返回 None
+    """
+    async def load():
+        row = await conn.fetchrow("""
+            SELECT
+                c.relkind,
+                CASE WHEN c.relkind = 'p' THEN (
+                    SELECT COALESCE(sum(GREATEST(ch.reltuples, 0)), -1)
+                    FROM pg_catalog.pg_inherits i
+                    JOIN pg_catalog.pg_class ch ON ch.oid = i.inhrelid
+                    WHERE i.inhparent = c.oid
+                ) ELSE c.reltuples END AS reltuples
+            FROM
+                pg_catalog.pg_class c
+            JOIN
+                pg_catalog.pg_namespace n ON c.relnamespace = n.oid
+            WHERE
+                n.nspname = $1
+                AND c.relname = $2;
+        """, schema, table_name)
+        # relkind 是 "char" 类型，asyncpg 返回 bytes
+        return (row[0].decode() if isinstance(row[0], bytes) else row[0], float(row[1])) if row else None
+
+    return await cached_metadata(conn, ('relation_stats', schema, table_name), load)
+
+
+async def get_random_sample(conn, table_name, schema='public', columns=None, limit=10, strategy='auto', budget=None,
+                            output_format='markdown'):
+    """
+    获取 PostgreSQL 表中随机若干条数据（默认 10 条），并输出为 Markdown 表格
+
+    大表使用 TABLESAMPLE 抽样，避免 ORDER BY RANDOM() 的全表扫描和排序
+
+    :param conn: 数据库连接对象
+    :param table_name: 需要查询的表名
+    :param schema: 表所在的模式，默认为 'public'
+    :param columns: 需要输出的字段名列表（None 表示所有字段）
+    :param limit: 返回的行数，默认为 10
+    :param strategy: 抽样方式，可选 'auto' / 'random' / 'bernoulli' / 'system'
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :param output_format: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :return: 表格字符串，默认为 Markdown 格式
+    """
+    if strategy not in ('auto', 'random', 'bernoulli', 'system'):
+        raise ValueError(f"不支持的抽样方式：{strategy}")
+
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    stats = await get_relation_stats(conn, table_name, schema)
+    relkind, reltuples = stats if stats else (None, -1.0)
+    if strategy == 'auto':
+        strategy = choose_sample_strategy(relkind, reltuples)
+
+    select_clause = "SELECT " + (", ".join(quote_ident(col) for col in columns) if columns else "*")
+    source = f"{quote_ident(schema)}.{quote_ident(table_name)}"
+
+    if strategy == 'random':
+        query = f"{select_clause} FROM {source} ORDER BY RANDOM() LIMIT $1"
+        percents = [None]
+    else:
+        # 对抽样结果再做 ORDER BY RANDOM()，打乱块级抽样带来的物理顺序
+        query = f"{select_clause} FROM {source} TABLESAMPLE {strategy.upper()} ($1) ORDER BY RANDOM() LIMIT $2"
+        # 样本不足时放大一次抽样比例
+        percents = sample_percents(reltuples, limit)
+
+    for percent in percents:
+        args = (limit,) if percent is None else (percent, limit)
+        records = await conn.fetch(query, *args)
+        if len(records) >= limit:
+            break
+
+    column_names = list(records[0].keys()) if records else []
+    return format_sample(table_name, columns, column_names, records, output_format, limit, requested, percent)
+
+
+async def get_column_stats(conn, table_name, column_name, schema='public'):
+    """
+    从 pg_stats 读取字段的高频值统计，见 postgres_client.get_column_stats
+
+    :return: (null_frac, 高频值列表, 频率列表)，没有统计信息或没有高频值时返回 None
+    """
+    row = await conn.fetchrow("""
+        SELECT
+            null_frac,
+            most_common_vals::text::text[],
+            most_common_freqs
+        FROM
+            pg_catalog.pg_stats
+        WHERE
+            schemaname = $1
+            AND tablename = $2
+            AND attname = $3
+        ORDER BY
+            inherited DESC
+        LIMIT 1;
+    """, schema, table_name, column_name)
+
+    if not row or row[1] is None:
+        return None
+    null_frac, values, freqs = row
+    return float(null_frac or 0), list(values), [float(f) for f in freqs]
+
+
+async def _count_enum_values(conn, table_name, column_name, schema, limit, percent=None):
+    """GROUP BY 统计字段取值的出现次数，指定 percent 时只统计 TABLESAMPLE SYSTEM 抽样数据"""
+    column = quote_ident(column_name)
+    if percent is None:
+        sample_clause, args = "", (limit,)
+    else:
+        sample_clause, args = "TABLESAMPLE SYSTEM ($2)", (limit, percent)
+
+    records = await conn.fetch(f"""
+        SELECT
+            {column} AS value,
+            COUNT(*) AS frequency
+        FROM
+            {quote_ident(schema)}.{quote_ident(table_name)} {sample_clause}
+        GROUP BY
+            {column}
+        ORDER BY
+            frequency DESC,
+            value ASC
+        LIMIT $1;
+    """, *args)
+    return [tuple(row) for row in records]
+
+
+async def get_top_enum_values(conn, table_name, column_name, schema='public', limit=10, exact=False, budget=None):
+    """
+    获取 PostgreSQL 表中指定字段出现频率最高的前 N 个枚举值及其计数
+
+    默认优先使用 pg_stats 中的高频值统计做近似估算，无需扫描全表；
+    没有统计信息时，大表做抽样统计，小表做精确统计
+
+    :param conn: 数据库连接对象
+    :param table_name: 需要查询的表名
+    :param column_name: 需要统计的字段名
+    :param schema: 表所在的模式，默认为 'public'
+    :param limit: 返回的结果数量，默认为前10个
+    :param exact: 是否强制做精确统计（GROUP BY 全表）
+    :param budget: 查询预算 QueryBudget，限制返回的行数
+    :return: Markdown 格式的统计结果
+    """
+    records = None
+    note = ""
+
+    requested = limit
+    if budget is not None:
+        limit = budget.cap_rows(limit)
+
+    if not exact:
+        rel_stats = await get_relation_stats(conn, table_name, schema)
+        relkind, reltuples = rel_stats if rel_stats else (None, -1.0)
+
+        col_stats = await get_column_stats(conn, table_name, column_name, schema) if reltuples > 0 else None
+        if col_stats is not None:
+            records = approx_enum_values(col_stats, reltuples, limit)
+            note = f"（近似值：根据 pg_stats 统计信息按估算总行数 {int(reltuples)} 换算）"
+        elif choose_sample_strategy(relkind, reltuples) == 'system':
+            percent = sample_percent(reltuples, limit * 100)
+            records = await _count_enum_values(conn, table_name, column_name, schema, limit, percent)
+            records = [(value, int(round(freq * 100.0 / percent))) for value, freq in records]
+            note = f"（近似值：根据 {percent:.4g}% 的抽样数据换算）"
+
+    if records is None:
+        records = await _count_enum_values(conn, table_name, column_name, schema, limit)
+
+    return format_enum_values(table_name, column_name, records, limit, requested, note)
+
+
+def _connect_kwargs(config: dict):
+    """asyncpg 的连接参数，语句超时在建立会话时生效"""
+    server_settings = {}
+    statement_timeout = QueryBudget.from_config(config).statement_timeout
+    if statement_timeout:
+        server_settings['statement_timeout'] = str(statement_timeout)
+
+    return dict(
+        host=config["host"],
+        port=int(config["port"]),
+        database=config["database"],
+        user=config["user"],
+        password=config["password"],
+        server_settings=server_settings,
+        connection_class=ScopedConnection,
+    )
+
+
+def _scope_of(config: dict):
+    return (config["host"], int(config["port"]), config["database"])
+
+
+async def create_conn_from_dotenv(config: dict):
+    """建立单个异步连接，用完后需 await conn.close()"""
+    conn = await asyncpg.connect(**_connect_kwargs(config))
+    conn.scope = _scope_of(config)
+    return conn
+
+
+async def _create_pool(config: dict):
+    """根据数据库配置创建 asyncpg 连接池，池参数与同步客户端使用相同的 pool_* 配置项"""
+    scope = _scope_of(config)
+
+    async def init(conn):
+        conn.scope = scope
+
+    return await asyncpg.create_pool(
+        min_size=int(config.get('pool_min_size', 1)),
+        max_size=int(config.get('pool_max_size', 10)),
+        max_inactive_connection_lifetime=float(config.get('pool_max_idle_time', 300)),
+        init=init,
+        **_connect_kwargs(config),
+    )
+
+
+# (事件循环, 连接池键) -> 创建连接池的 Task；asyncpg 连接池只能在创建它的事件循环中使用
+_pools = {}
+
+
+def _drop_closed_loops():
+    """
+    移除已关闭的事件循环中的连接池
+
+    每次 asyncio.run 都会新建事件循环，结束后这些连接池既不能再使用，也无法在原事件循环中关闭；
+    不移除的话，_pools 会一直引用这些事件循环及其连接池。
+    不使用 WeakKeyDictionary：值（Task）引用着事件循环，键永远不会被回收
+    """
+    for key in [k for k in _pools if k[0].is_closed()]:
+        del _pools[key]
+
+
+async def get_pool(config: dict) -> asyncpg.Pool:
+    """获取数据库配置对应的连接池，并发调用时只创建一次"""
+    _drop_closed_loops()
+    key = (asyncio.get_running_loop(), make_pool_key(config))
+    task = _pools.get(key)
+    if task is None:
+        task = _pools[key] = asyncio.ensure_future(_create_pool(config))
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        if _pools.get(key) is task:
+            del _pools[key]
+        raise
+
+
+@contextlib.asynccontextmanager
+async def pooled_conn(config: dict):
+    """
+    从连接池中取出连接的异步上下文管理器，退出时自动归还
+
+    async with pooled_conn(db_config) as conn:
+        print(await get_table_info(conn))
+    """
+    pool = await get_pool(config)
+    async with pool.acquire(timeout=float(config.get('pool_timeout', 30))) as conn:
+        yield conn
+
+
+async def discard_pool(config: dict):
+    """关闭并移除当前事件循环中数据库配置对应的连接池"""
+    task = _pools.pop((asyncio.get_running_loop(), make_pool_key(config)), None)
+    if task is not None and task.done() and not task.exception():
+        await task.result().close()
+
+
+async def close_all():
+    """关闭当前事件循环中的所有连接池"""
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _pools if k[0] is loop]:
+        task = _pools.pop(key)
+        if task.done() and not task.exception():
+            await task.result().close()
+
+
+def pool_stats() -> dict:
+    """所有连接池的统计信息，键为 host:port/database"""
+    _drop_closed_loops()
+    result = {}
+    for (_, key), task in list(_pools.items()):
+        if not task.done() or task.exception():
+            continue
+        pool = task.result()
+        config = dict(key)
+        name = f"{config.get('host')}:{config.get('port')}/{config.get('database')}"
+        result[name] = {
+            'size': pool.get_size(),
+            'idle': pool.get_idle_size(),
+            'min_size': pool.get_min_size(),
+            'max_size': pool.get_max_size(),
+        }
+    return result
+
+
+async def main():
+    config = load_env()
+
+    try:
+        async with pooled_conn(config) as conn:
+            # 打印表及表注释
+            print("【查询数据库中所有表及其注释信息】\n")
+            print(await get_table_info(conn))
+            print("*" * 80)
+
+            # 打印字段信息
+            print("【查询指定表的所有字段定义和注释】\n")
+            print(await get_table_columns_info(conn, table_name='logistics'))
+            print("*" * 80)
+
+            # 打印样例数据
+            print("【查询指定表的所有字段的样例数据】\n")
+            print(await get_random_sample(conn, table_name='logistics'))
+            print("*" * 80)
+
+            # 打印指定字段的样例数据
+            print("【查询指定表的指定字段的样例数据】\n")
+            print(await get_random_sample(conn, "orders", columns=["order_id", "status"]))
+            print("*" * 80)
+
+            # 打印指定字段出现频率前十的枚举值
+            print("【查询指定表的指定字段的枚举值】\n")
+            print(await get_top_enum_values(conn, "orders", "status"))
+            print("*" * 80)
+    except asyncpg.PostgresError as e:
+        print(f"查询失败: {e}")
+    finally:
+        await close_all()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -8,18 +8,32 @@ PostgreSQL 数据库的 Qwen-Agent Function Calling 模块
 - ColumnsInfoTool: 获取指定表的字段定义和注释
 - SampleDataTool: 获取表的随机样例数据
 - EnumValuesTool: 获取字段的枚举值统计
+- SchemaSnapshotTool: 一次性获取多张表的表结构摘要
+- SearchTablesTool: 按语义检索与问题最相关的表
+- ReadonlySQLTool: 在只读事务中执行查询语句
 """
 
 import json
 import json5
+import os
+import threading
+
+import psycopg2
 
 from qwen_agent.agents import Assistant
 from qwen_agent.tools.base import BaseTool, register_tool
+from parallel_tools import parallel_map
+from query_budget import QueryBudget
+from result_cache import result_cache
+from table_index import EMBEDDING_URL, EmbeddingClient, TableVectorIndex
 from postgres_client import (get_table_info as pg_get_table_info,
                              get_table_columns_info as pg_get_columns_info,
                              get_random_sample as pg_get_sample,
                              get_top_enum_values as pg_get_enum_values,
-                             load_env, create_conn_from_dotenv, close_conn)
+                             get_schema_snapshot as pg_get_schema_snapshot,
+                             run_readonly_sql as pg_run_readonly_sql,
+                             get_schema_tables, metadata_version, render_schema_snapshot, metadata_cache,
+                             load_env, get_pool, pooled_conn, discard_pool, pool_stats)
 
 
 # 加载数据库配置
@@ -28,9 +42,67 @@ db_config = load_env() # 从 .env 文件中加载
 
 
 def set_db_config(config: dict):
-    """更新数据库配置"""
+    """更新数据库配置，配置变化时关闭旧配置对应的连接池"""
     global db_config
+    old_config = dict(db_config)
     db_config.update(config)
+    if old_config and old_config != db_config:
+        discard_pool(old_config)
+
+
+def get_pool_stats() -> dict:
+    """连接池统计信息，可用于监控采集"""
+    return pool_stats()
+
+
+def get_cache_stats() -> dict:
+    """元数据缓存和查询结果缓存的命中统计，可用于调整 TTL"""
+    return {'metadata': metadata_cache.stats(), 'result': result_cache.stats()}
+
+
+# 表结构向量索引的存储目录
+TABLE_INDEX_DIR = 'index'
+
+_table_indexes = dict()
+# 索引名 -> 索引最近一次更新时的目录版本
+_table_index_versions = dict()
+_table_indexes_lock = threading.Lock()
+
+
+def get_table_index(tables, version) -> TableVectorIndex:
+    """
+    当前数据库的表结构向量索引，目录版本变化时增量更新
+
+    更新时需要调用 embedding 服务，不占用数据库连接：调用方先在连接中读取表结构和目录版本
+
+    :param tables: get_schema_tables 返回的表信息列表
+    :param version: metadata_version 返回的目录版本，None 表示未知，总是更新
+    """
+    name = f"{db_config.get('host')}_{db_config.get('port')}_{db_config.get('database')}"
+    with _table_indexes_lock:
+        index = _table_indexes.get(name)
+        if index is None:
+            embed = EmbeddingClient(db_config.get('embedding_url', EMBEDDING_URL))
+            index = TableVectorIndex(os.path.join(TABLE_INDEX_DIR, name), embed)
+            _table_indexes[name] = index
+        if version is not None and _table_index_versions.get(name) == version:
+            return index
+
+    index.update(tables)
+    with _table_indexes_lock:
+        _table_index_versions[name] = version
+    return index
+
+
+def get_budget() -> QueryBudget:
+    """当前数据库配置下的查询预算"""
+    return QueryBudget.from_config(db_config)
+
+
+def format_result(result: str, budget: QueryBudget = None) -> str:
+    """按预算截断过长的结果，并序列化为工具返回值"""
+    budget = budget or get_budget()
+    return json.dumps({'result': budget.truncate(result)}, ensure_ascii=False)
 
 
 @register_tool('get_table_info')
@@ -40,12 +112,10 @@ class TableInfoTool(BaseTool):
     parameters = []
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
-        try:
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
             result = pg_get_table_info(conn)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+        return format_result(result, budget)
 
 
 @register_tool('get_table_columns_info')
@@ -56,7 +126,12 @@ class ColumnsInfoTool(BaseTool):
         'name': 'table_name',
         'type': 'string',
         'description': '需要查询的表名',
-        'required': True
+        'required': False
+    }, {
+        'name': 'table_names',
+        'type': 'array',
+        'description': '需要查询的多个表名，多张表会并行查询',
+        'required': False
     }, {
         'name': 'schema',
         'type': 'string',
@@ -65,13 +140,22 @@ class ColumnsInfoTool(BaseTool):
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
-        try:
-            params_dict = json5.loads(params)
-            result = pg_get_columns_info(conn, **params_dict)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+        params_dict = json5.loads(params)
+        budget = get_budget()
+        table_names = params_dict.get('table_names') or (
+            [params_dict['table_name']] if params_dict.get('table_name') else [])
+        if isinstance(table_names, str):
+            table_names = [table_names]
+        if not table_names:
+            return format_result("参数错误：请提供 table_name 或 table_names", budget)
+        schema = params_dict.get('schema', 'public')
+
+        def fetch(table_name):
+            with pooled_conn(db_config) as conn:
+                return pg_get_columns_info(conn, table_name, schema)
+
+        results = parallel_map(fetch, table_names, max_workers=get_pool(db_config).max_size)
+        return format_result("\n\n".join(results), budget)
 
 
 @register_tool('get_random_sample')
@@ -93,16 +177,19 @@ class SampleDataTool(BaseTool):
         'type': 'array',
         'description': '需要查询的字段列表',
         'required': False
+    }, {
+        'name': 'output_format',
+        'type': 'string',
+        'description': '输出格式，可选 markdown、csv、json，默认为 markdown；csv 和 json 更节省篇幅',
+        'default': 'markdown'
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
-        try:
-            params_dict = json5.loads(params)
-            result = pg_get_sample(conn, **params_dict)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+        params_dict = json5.loads(params)
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
+            result = pg_get_sample(conn, budget=budget, **params_dict)
+        return format_result(result, budget)
 
 
 @register_tool('get_top_enum_values')
@@ -129,16 +216,95 @@ class EnumValuesTool(BaseTool):
         'type': 'integer',
         'description': '返回的结果数量',
         'default': 10
+    }, {
+        'name': 'exact',
+        'type': 'boolean',
+        'description': '是否需要精确计数。默认根据统计信息返回近似计数，速度更快；只有用户明确要求精确数量时才设为 true',
+        'default': False
+    }]
+
+    def call(self, params: str, **kwargs) -> str:
+        params_dict = json5.loads(params)
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
+            result = pg_get_enum_values(conn, budget=budget, **params_dict)
+        return format_result(result, budget)
+
+
+@register_tool('get_schema_snapshot')
+class SchemaSnapshotTool(BaseTool):
+    """一次性获取多张表的表结构摘要"""
+    description = '一次性查询多张表（或所有表）的表名、注释、估算行数，以及字段类型、注释、主键和外键'
+    parameters = [{
+        'name': 'table_names',
+        'type': 'array',
+        'description': '需要查询的表名列表，不指定则返回所有表',
+        'required': False
+    }]
+
+    def call(self, params: str, **kwargs) -> str:
+        params_dict = json5.loads(params) if params else {}
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
+            result = pg_get_schema_snapshot(conn, table_names=params_dict.get('table_names'))
+        return format_result(result, budget)
+
+
+@register_tool('search_tables')
+class SearchTablesTool(BaseTool):
+    """按语义检索与问题最相关的表"""
+    description = '根据问题检索最相关的若干张表，返回这些表的表结构。数据库中表很多时，优先使用该工具'
+    parameters = [{
+        'name': 'query',
+        'type': 'string',
+        'description': '用户的问题，或需要查找的数据的描述',
+        'required': True
+    }, {
+        'name': 'k',
+        'type': 'integer',
+        'description': '返回的表数',
+        'default': 5
+    }]
+
+    def call(self, params: str, **kwargs) -> str:
+        params_dict = json5.loads(params)
+        budget = get_budget()
+        with pooled_conn(db_config) as conn:
+            tables = get_schema_tables(conn)
+            _, version = metadata_version(conn)
+        # 生成向量需要调用 embedding 服务，归还连接后再执行
+        hits = get_table_index(tables, version).search(params_dict['query'], int(params_dict.get('k', 5)))
+        result = render_schema_snapshot([table for table, _ in hits])
+        return format_result(result, budget)
+
+
+@register_tool('run_readonly_sql')
+class ReadonlySQLTool(BaseTool):
+    """在只读事务中执行查询语句"""
+    description = '在 PostgreSQL 数据库中执行一条只读的 SQL 查询语句，返回查询结果。不能修改数据，每次只能执行一条语句'
+    parameters = [{
+        'name': 'sql',
+        'type': 'string',
+        'description': '需要执行的 SQL 查询语句',
+        'required': True
+    }, {
+        'name': 'output_format',
+        'type': 'string',
+        'description': '输出格式，可选 markdown、csv、json，默认为 markdown；csv 和 json 更节省篇幅',
+        'default': 'markdown'
     }]
 
     def call(self, params: str, **kwargs) -> str:
-        conn = create_conn_from_dotenv(db_config)
+        params_dict = json5.loads(params)
+        budget = get_budget()
         try:
-            params_dict = json5.loads(params)
-            result = pg_get_enum_values(conn, **params_dict)
-            return json.dumps({'result': result}, ensure_ascii=False)
-        finally:
-            close_conn(conn)
+            with pooled_conn(db_config) as conn:
+                result = pg_run_readonly_sql(conn, params_dict['sql'], budget,
+                                             output_format=params_dict.get('output_format', 'markdown'))
+        except (ValueError, psycopg2.Error) as e:
+            # 把错误信息返回给模型，便于修正 SQL 后重试
+            result = f"SQL 执行失败：{e}"
+        return format_result(result, budget)
 
 
 if __name__ == '__main__':
@@ -160,7 +326,8 @@ if __name__ == '__main__':
     2. 以清晰易懂的方式呈现查询结果
     """
 
-    tools = ['get_table_info', 'get_table_columns_info', 'get_random_sample', 'get_top_enum_values']
+    tools = ['get_table_info', 'get_table_columns_info', 'get_random_sample', 'get_top_enum_values',
+             'get_schema_snapshot']
     bot = Assistant(
         llm=llm_cfg,
         name='数据库查询助手',
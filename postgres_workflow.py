@@ -8,21 +8,80 @@
 2. 查询可能用到的表和表结构
 3. 将表名和表结构作为上下文，注入原始查询
 
+步骤 1、2 默认由 Schema Linking 在本地完成，不调用 LLM；置信度不足时回退到 LLM。
+回退到 LLM 时，步骤 2 的结果按 (数据库, 表集合, 目录版本) 缓存，涉及相同表的提问只需调用一次 LLM
+workflow_stream 流式产出各阶段的进度和 LLM 输出，界面无需等待所有步骤结束才有响应
+
+投机模式（speculative=True）下，步骤 1 的 LLM 调用进行时，并发用 Schema Linking 预取候选表的表结构；
+LLM 选出的表都在候选表中时直接使用预取结果，跳过步骤 2 的 LLM 调用，立即开始回答
+
 适用性：
   只接受需要用到一张表的情况，如果需要多张表和表结构，需要额外开发
 """
 
+import re
+
+import postgres_tool
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from postgres_agent import PGAgent
+from postgres_client import (pooled_conn, cached_metadata, get_schema_tables, metadata_version,
+                             fetch_enum_stats, render_schema_snapshot)
+from result_cache import ResultCache
+from schema_linker import LinkResult, SchemaIndex
+
+
+# 步骤 2 的结果缓存；目录版本是缓存键的一部分，表结构变化后旧条目不再命中，随 LRU 淘汰
+schema_hint_cache = ResultCache(ttl=3600, max_bytes=8 * 1024 * 1024)
+
+# 投机模式下预取候选表结构的线程池
+_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='schema-prefetch')
+
+
+def table_name(table: dict) -> str:
+    """public 模式下为表名，其他模式为 模式名.表名"""
+    return table['table'] if table['schema'] == 'public' else f"{table['schema']}.{table['table']}"
+
+
+def mentioned_tables(text: str, tables) -> tuple:
+    """
+    找出文本中提到的表
+
+    :param text: LLM 的回复
+    :param tables: fetch_schema_snapshot 返回的表信息列表
+    :return: 提到的表名（public 模式下为表名，其他模式为 模式名.表名），已排序
+    """
+    found = set()
+    for t in tables:
+        if re.search(rf"(?<![A-Za-z0-9_]){re.escape(t['table'])}(?![A-Za-z0-9_])", text):
+            found.add(table_name(t))
+    return tuple(sorted(found))
 
 
 class PGWorkflow(PGAgent):
     """Postgres Workflow"""
 
-    def __init__(self, llm_cfg, db_config=None):
-        super().__init__(llm_cfg, db_config)
+    def __init__(self, llm_cfg, db_config=None, linking='auto', speculative=False, **kwargs):
+        """
+        :param llm_cfg: LLM 配置
+        :param db_config: 数据库配置
+        :param linking: 定位数据表的方式
+            - 'llm': 调用两次 LLM 定位数据表、查询表结构
+            - 'lexical': 只使用本地 Schema Linking，不调用 LLM
+            - 'auto': 优先使用 Schema Linking，置信度不足时回退到 LLM
+        :param speculative: 回退到 LLM 时，是否在步骤 1 进行的同时预取候选表的表结构，
+            LLM 的选择与候选表一致时跳过步骤 2
+        :param kwargs: 传给 PGAgent 的其他参数，如 parallel_tools
+        """
+        super().__init__(llm_cfg, db_config, **kwargs)
         self.llm_cfg = llm_cfg
 
+        if linking not in ('llm', 'lexical', 'auto'):
+            raise ValueError(f"不支持的 linking 方式：{linking}")
+        self.linking = linking
+        self.speculative = speculative
+
         # Postgres 数据库配置
         # 允许 db_config 为 None，为 None 时使用 .env 中的配置
         self.db_config = db_config
@@ -39,17 +98,189 @@ class PGWorkflow(PGAgent):
             'assistant': self.create_assistant_agent(),
         }
 
-    def workflow(self, messages: list) -> list:
-        """定制的查询 workflow，可提高查询成功率，但速度较慢"""
+    def get_schema_index(self) -> SchemaIndex:
+        """获取 Schema Linking 索引，表结构变化时随元数据缓存一同重建"""
+        with pooled_conn(postgres_tool.db_config) as conn:
+            return cached_metadata(conn, ('schema_index', None),
+                                   lambda: SchemaIndex(get_schema_tables(conn), fetch_enum_stats(conn)))
 
-        react_bot = self.agents['react']
-        assistant_bot = self.agents['assistant']
+    def link_tables(self, query: str):
+        """不调用 LLM，为提问挑选候选表"""
+        return self.get_schema_index().link(query)
+
+    def workflow(self, messages: list) -> list:
+        """定制的查询 workflow，可提高查询成功率"""
 
         # 提取用户 query
         query = messages[-1].get('content', '').strip()
 
+        return self.build_messages(messages, query, self.schema_hint(messages, query))
+
+    def workflow_stream(self, messages: list):
+        """
+        流式运行完整的 workflow：定位数据表、查询表结构、回答用户问题
+
+        每个阶段开始时立即产出事件，LLM 调用的输出逐段产出，界面不必等待所有隐藏阶段结束
+
+        :return: 事件生成器，事件格式见 schema_hint_stream 和 answer_stream
+        """
+        query = messages[-1].get('content', '').strip()
+
+        hint = None
+        for event in self.schema_hint_stream(messages, query):
+            if event['stage'] == 'hint':
+                hint = event['hint']
+            yield event
+
+        yield from self.answer_stream(messages, query, hint)
+
+    def answer_stream(self, messages: list, query: str, hint):
+        """
+        注入表结构提示后，由 ReAct Agent 回答用户问题
+
+        :param hint: schema_hint 的返回值
+        :return: 事件生成器，产出 {'stage': 'answer', 'content': 当前完整回答, 'done': 是否结束}
+        """
+        content = ""
+        for chunk in self.agents['react'].run(self.build_messages(messages, query, hint)):
+            content = chunk[-1].get('content', '') if chunk else ""
+            yield {'stage': 'answer', 'content': content, 'done': False}
+        yield {'stage': 'answer', 'content': content, 'done': True}
+
+    def schema_hint(self, messages: list, query: str):
+        """
+        定位可能用到的数据表，返回表结构提示
+
+        :return: 表结构提示；没有可用表时返回 None
+        """
+        hint = None
+        for event in self.schema_hint_stream(messages, query):
+            if event['stage'] == 'hint':
+                hint = event['hint']
+        return hint
+
+    def schema_hint_stream(self, messages: list, query: str):
+        """
+        流式定位可能用到的数据表
+
+        产出的事件：
+        - {'stage': 'tables', 'content': ..., 'done': ...}：定位数据表，content 为候选表或 LLM 的当前输出
+        - {'stage': 'schema', 'content': ..., 'done': ...}：查询表结构，content 为 LLM 的当前输出
+        - {'stage': 'hint', 'hint': ...}：最后一个事件，hint 同 schema_hint 的返回值
+        """
+        yield {'stage': 'tables', 'content': "", 'done': False}
+
+        prefetch = None
+        if self.linking != 'llm':
+            result = self.link_tables(query)
+            prefetch = result
+            if result.confident or self.linking == 'lexical':
+                yield {'stage': 'tables', 'content': "、".join(map(table_name, result.tables)), 'done': True}
+                if not result.tables:
+                    yield {'stage': 'hint', 'hint': None}
+                    return
+
+                yield {'stage': 'hint', 'hint': "\n".join([
+                    "可能用到的表，以及对应的表结构如下：",
+                    f"{render_schema_snapshot(result.tables)}\n\n",
+                ])}
+                return
+
+        # 投机模式：auto 模式下 Schema Linking 的结果已经就绪；llm 模式下与步骤 1 并发计算
+        if not self.speculative:
+            prefetch = None
+        elif prefetch is None:
+            prefetch = _prefetch_executor.submit(self.link_tables, query)
+
+        yield from self._llm_schema_hint_stream(messages, query, prefetch)
+
+    @staticmethod
+    def _speculative_hint(prefetch, selected):
+        """
+        LLM 选出的表都在预取的候选表中时，直接由预取的表结构生成提示
+
+        :param prefetch: LinkResult，或计算 LinkResult 的 Future
+        :param selected: LLM 选出的表名
+        :return: 表结构提示；选择不一致或预取失败时返回 None
+        """
+        if prefetch is None or not selected:
+            return None
+        if not isinstance(prefetch, LinkResult):
+            try:
+                prefetch = prefetch.result()
+            except Exception:
+                return None
+
+        candidates = {table_name(t): t for t in prefetch.tables}
+        if not set(selected) <= candidates.keys():
+            return None
+        return "\n".join([
+            "可能用到的表，以及对应的表结构如下：",
+            f"{render_schema_snapshot([candidates[name] for name in selected])}\n\n",
+        ])
+
+    def build_messages(self, messages: list, query: str, hint) -> list:
+        """将 schema_hint 的结果写入原始查询中"""
+        if hint is None:
+            return self._no_table_messages(messages, query)
+        return self._inject_hint(messages, query, hint)
+
+    def _no_table_messages(self, messages: list, query: str) -> list:
+        """没有可用表时，直接让 Agent 回答"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return messages[:-1] + [
+            {
+                'role': 'user',
+                'content': "\n".join([
+                    f"当前时间：{now}",
+                    "",
+                    "用户问题如下：",
+                    f"{query}",
+                    "",
+                    "请你调用 Postgres 数据库查询工具，回答用户的问题。",
+                ])
+            }
+        ]
+
+    def _inject_hint(self, messages: list, query: str, hint: str) -> list:
+        """将相关数据表的 Schema 作为上下文，写入原始查询中"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return messages[:-1] + [
+            {
+                'role': 'user',
+                'content': "\n".join([
+                    f"当前时间：{now}",
+                    "",
+                    hint + "用户问题如下：",
+                    f"{query}",
+                    "",
+                    "请你调用 Postgres 数据库查询工具，参考表结构信息，回答用户的问题。",
+                ])
+            }
+        ]
+
+    @staticmethod
+    def _stream_run(agent, messages: list, stage: str):
+        """流式运行 Agent，逐段产出 stage 阶段的事件，最后一个事件带上完整回复"""
+        response = []
+        for response in agent.run(messages):
+            content = response[-1].get('content', '') if response else ""
+            yield {'stage': stage, 'content': content, 'done': False}
+        content = (response[-1].get('content') or '').strip() if response else ""
+        yield {'stage': stage, 'content': content, 'done': True}
+
+    def _llm_schema_hint_stream(self, messages: list, query: str, prefetch=None):
+        """
+        由 LLM 定位数据表并查询表结构，速度较慢，因此流式产出 LLM 的输出
+
+        :param prefetch: 投机模式下预取的 LinkResult（或其 Future），None 表示不使用投机模式
+        """
+
+        assistant_bot = self.agents['assistant']
+
         # 1. 定位数据表
-        first_response = assistant_bot.run_nonstream(messages[:-1] + [
+        first_message = ""
+        for event in self._stream_run(assistant_bot, messages[:-1] + [
             {
                 'role': 'user',
                 'content': "\n".join([
@@ -61,43 +292,54 @@ class PGWorkflow(PGAgent):
                     "注意，最终返回结果中，只需包含你认为可能用到的表，不要有多余的文字。如果没有可用表，回答无可用表。",
                 ])
             }
-        ])
-
-        
-        first_message = first_response[-1].get('content').strip()
-
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ], 'tables'):
+            first_message = event['content']
+            yield event
 
         # 如果没有可用表，直接返回
         if "无可用表" in first_message:
-            return messages[:-1] + [
-                {
-                    'role': 'user',
-                    'content': "\n".join([
-                        f"当前时间：{now}",
-                        "",
-                        "用户问题如下：",
-                        f"{query}",
-                        "",
-                        "请你调用 Postgres 数据库查询工具，回答用户的问题。",
-                    ])
-                }
-            ]
-
-        # 2. 查询表结构
-        second_response = assistant_bot.run_nonstream([
+            if prefetch is not None and not isinstance(prefetch, LinkResult):
+                prefetch.cancel()
+            yield {'stage': 'hint', 'hint': None}
+            return
+
+        # 2. 查询表结构：结果只取决于表集合和表结构，命中缓存时跳过第二次 LLM 调用
+        with pooled_conn(postgres_tool.db_config) as conn:
+            selected = mentioned_tables(first_message, get_schema_tables(conn))
+            scope, version = metadata_version(conn)
+
+        # 投机模式：选择与预取一致时跳过第二次 LLM 调用；不一致时取消尚未开始的预取
+        hint = self._speculative_hint(prefetch, selected)
+        if hint is not None:
+            yield {'stage': 'schema', 'content': "", 'done': True}
+            yield {'stage': 'hint', 'hint': hint}
+            return
+        if prefetch is not None and not isinstance(prefetch, LinkResult):
+            prefetch.cancel()
+
+        cache_key = schema_hint_cache.make_key(scope, 'schema_hint', selected, version)
+        if selected:
+            hit, hint = schema_hint_cache.get(cache_key)
+            if hit:
+                yield {'stage': 'schema', 'content': "", 'done': True}
+                yield {'stage': 'hint', 'hint': hint}
+                return
+
+        second_message = ""
+        for event in self._stream_run(assistant_bot, [
             {
                 'role': 'user',
                 'content': "\n".join([
                     "【提示】用户提问可能与以下表有关：",
                     f"{first_message}",
                     "",
-                    "请你调用 Postgres 数据库工具，查询这些的表结构和注释信息。",
+                    "请你调用 get_schema_snapshot 工具，一次性查询这些表的表结构和注释信息。",
                     "最后返回结果中，请注明可用表的表名，以及对应的表结构。不要有无关的文字。",
                 ])
             }
-        ])
-        second_message = second_response[-1].get('content').strip()
+        ], 'schema'):
+            second_message = event['content']
+            yield event
 
         hint = ""
         if len(second_message) > 15:
@@ -105,23 +347,11 @@ class PGWorkflow(PGAgent):
                 "可能用到的表，以及对应的表结构如下：",
                 f"{second_message}\n\n",
             ])
+            if selected:
+                schema_hint_cache.put(cache_key, hint)
 
-        # 3. 将相关数据表的 Schema 作为上下文，写入原始查询中
-        messages = messages[:-1] + [
-            {
-                'role': 'user',
-                'content': "\n".join([
-                    f"当前时间：{now}",
-                    "",
-                    hint + "用户问题如下：",
-                    f"{query}",
-                    "",
-                    "请你调用 Postgres 数据库查询工具，参考表结构信息，回答用户的问题。",
-                ])
-            }
-        ]
-
-        return messages
+        # 3. 由 build_messages 将相关数据表的 Schema 作为上下文，写入原始查询中
+        yield {'stage': 'hint', 'hint': hint}
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+查询预算
+
+限制 Agent 发起的每次查询的执行时间、返回行数和结果大小，避免一次错误的调用长时间占用数据库连接，
+或将超大结果读入内存、塞进模型上下文
+
+预算通过数据库配置设置：
+- statement_timeout: 单条 SQL 的最长执行时间（毫秒），在建立会话时生效
+- max_rows: 单次查询最多读取的行数
+- max_bytes: 返回给 Agent 的结果最多包含的字节数（UTF-8）
+"""
+
+
+DEFAULT_STATEMENT_TIMEOUT = 30000
+DEFAULT_MAX_ROWS = 1000
+DEFAULT_MAX_BYTES = 32768
+
+# 每批从游标读取的行数
+FETCH_BATCH_SIZE = 200
+
+
+class QueryBudget:
+    """单次工具调用的执行预算"""
+
+    def __init__(self,
+                 statement_timeout=DEFAULT_STATEMENT_TIMEOUT,
+                 max_rows=DEFAULT_MAX_ROWS,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param statement_timeout: 单条 SQL 的最长执行时间（毫秒），None 或 0 表示不限制
+        :param max_rows: 单次查询最多读取的行数，None 表示不限制
+        :param max_bytes: 结果最多包含的字节数，None 表示不限制
+        """
+        self.statement_timeout = statement_timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """从数据库配置中读取预算，未配置的项使用默认值"""
+        def read(key, default):
+            value = config.get(key, default)
+            return int(value) if value not in (None, '') else None
+
+        return cls(statement_timeout=read('statement_timeout', DEFAULT_STATEMENT_TIMEOUT),
+                   max_rows=read('max_rows', DEFAULT_MAX_ROWS),
+                   max_bytes=read('max_bytes', DEFAULT_MAX_BYTES))
+
+    def cap_rows(self, limit):
+        """将调用方请求的行数限制在预算之内"""
+        if self.max_rows is None:
+            return limit
+        return min(int(limit), self.max_rows)
+
+    def fetch(self, cursor):
+        """
+        分批读取游标中的数据，最多读取 max_rows 行
+
+        :param cursor: 已执行查询的游标
+        :return: (rows, truncated)，truncated 表示结果因行数限制被截断
+        """
+        rows = []
+        while True:
+            size = FETCH_BATCH_SIZE
+            if self.max_rows is not None:
+                # 多读一行，用于判断是否还有剩余数据
+                size = min(size, self.max_rows + 1 - len(rows))
+            batch = cursor.fetchmany(size)
+            if not batch:
+                return rows, False
+            rows.extend(batch)
+            if self.max_rows is not None and len(rows) > self.max_rows:
+                return rows[:self.max_rows], True
+
+    def truncate(self, text: str) -> str:
+        """超过 max_bytes 时按行截断文本，并附上截断说明"""
+        if self.max_bytes is None:
+            return text
+
+        data = text.encode('utf-8')
+        if len(data) <= self.max_bytes:
+            return text
+
+        head = data[:self.max_bytes].decode('utf-8', errors='ignore')
+        if '\n' in head:
+            head = head[:head.rindex('\n')]
+        return head + "\n\n" + truncation_notice(f"结果过长，已截断为前 {self.max_bytes} 字节（原始长度 {len(data)} 字节）")
+
+
+def truncation_notice(reason: str) -> str:
+    """告知 Agent 结果不完整的提示语"""
+    return f"【注意】{reason}，结果不完整。如需更多数据，请缩小查询范围或添加过滤条件。"
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+查询结果缓存
+
+不同用户经常提出相同的问题，Agent 会反复执行相同的 SQL。本模块缓存只读查询渲染后的结果，
+相同的 SQL 和参数在 TTL 内直接返回缓存结果，不再访问数据库
+
+主要功能:
+- 缓存键由数据库、规范化后的 SQL（或工具函数名）和参数组成
+- 条目按 TTL 过期，总大小（UTF-8 字节数）超出上限时按 LRU 淘汰
+- 数据变化频繁的表可以排除在缓存之外
+- 命中 / 未命中 / 淘汰等计数，便于调整 TTL
+"""
+
+import json
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+from sql_guard import tokenize_sql
+
+
+_IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_$]*')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str, dialect='postgres') -> str:
+    """
+    规范化 SQL 文本：去除注释和结尾分号，连续空白压缩为一个空格
+
+    只改变引号之外的空白和注释，不改变大小写，避免把 MySQL 中大小写敏感的表名视为同一张表；
+    字符串按 dialect 的转义规则识别（与 sql_guard 共用），其中的内容保持原样
+
+    :param dialect: 'postgres' 或 'mysql'
+    """
+    parts = []
+    for kind, token in tokenize_sql(sql, dialect):
+        if kind == 'comment':
+            token = ' '
+        elif kind == 'code':
+            token = _WHITESPACE_RE.sub(' ', token)
+        # 注释和空白相邻时只保留一个空格
+        if parts and parts[-1].endswith(' ') and token.startswith(' '):
+            token = token[1:]
+        if token:
+            parts.append(token)
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def sql_identifiers(sql: str, dialect='postgres') -> set:
+    """SQL 中出现的所有标识符（小写，去除引号），用于判断是否涉及被排除的表"""
+    names = set()
+    for kind, token in tokenize_sql(sql, dialect):
+        if kind == 'identifier':
+            quote = token[0]
+            names.add(token[1:-1].replace(quote * 2, quote).lower())
+        elif kind == 'code':
+            names.update(name.lower() for name in _IDENTIFIER_RE.findall(token))
+    return names
+
+
+class ResultCache:
+    """线程安全、按字节数限制容量的 TTL + LRU 结果缓存"""
+
+    def __init__(self, ttl=300, max_bytes=64 * 1024 * 1024, exclude_tables=()):
+        """
+        :param ttl: 条目的存活时间（秒），为 0 时不缓存
+        :param max_bytes: 所有条目的总大小上限（UTF-8 字节数）
+        :param exclude_tables: 不缓存的表名（不区分大小写），涉及这些表的查询总是访问数据库
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.exclude_tables = {name.lower() for name in exclude_tables}
+        self._lock = threading.Lock()
+        # key -> (value, size, expires_at)，按最近使用顺序排列
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'bypasses': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def make_key(scope, name, *args, **kwargs):
+        """
+        :param scope: 缓存空间，通常为 (host, port, database)
+        :param name: 查询类型，如 'sql'、'sample'、'enum'
+        :param args: 查询参数，如规范化后的 SQL、表名、字段名
+        """
+        return (scope, name, json.dumps([args, kwargs], sort_keys=True, ensure_ascii=False, default=str))
+
+    def is_excluded(self, tables) -> bool:
+        """tables 中是否有被排除的表，tables 中的元素可以是表名或 模式名.表名"""
+        if not self.exclude_tables:
+            return False
+        for table in tables:
+            table = str(table).lower()
+            if table in self.exclude_tables or table.rsplit('.', 1)[-1] in self.exclude_tables:
+                return True
+        return False
+
+    def _evict(self):
+        """调用方需持有锁"""
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats['evictions'] += 1
+
+    def get(self, key):
+        """返回 (是否命中, 值)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return True, entry[0]
+                del self._entries[key]
+                self._bytes -= entry[1]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+        return False, None
+
+    def put(self, key, value: str):
+        size = len(value.encode('utf-8'))
+        if not self.ttl or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            self._evict()
+
+    def get_or_load(self, key, loader, tables=()):
+        """
+        读取缓存，未命中时调用 loader 并写入；loader 抛出的异常不会被缓存
+
+        :param key: make_key 生成的缓存键
+        :param loader: 无参函数，返回查询结果字符串
+        :param tables: 查询涉及的表，包含被排除的表时不使用缓存
+        """
+        if not self.ttl or self.is_excluded(tables):
+            with self._lock:
+                self._stats['bypasses'] += 1
+            return loader()
+
+        hit, value = self.get(key)
+        if hit:
+            return value
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def invalidate(self, scope=None):
+        """
+        清空缓存
+
+        :param scope: 只清空该数据库的条目，None 表示全部
+        """
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            for key in [k for k in self._entries if k[0] == scope]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# 进程级的查询结果缓存，PostgreSQL 和 MySQL 共用；ttl、容量和排除的表可直接修改该对象的属性
+result_cache = ResultCache()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Schema Linking
+
+不调用 LLM，在内存中为表名、字段名、注释和高频枚举值建立 BM25 索引，
+毫秒级地为用户提问挑选候选表，替代 Workflow 中「定位数据表」和「查询表结构」两次模型调用
+
+主要功能:
+- 中英文混合分词：英文按单词和下划线切分，中文按单字和双字切分
+- 表名、注释、字段、枚举值按不同权重建索引
+- 返回候选表及置信度，置信度不足时由调用方回退到 LLM
+"""
+
+import math
+import re
+
+from collections import Counter
+
+
+# 各字段在索引中的权重（重复次数）
+TABLE_NAME_WEIGHT = 3
+TABLE_COMMENT_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 1
+COLUMN_COMMENT_WEIGHT = 1
+ENUM_VALUE_WEIGHT = 1
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 常见但不具区分度的中文单字和英文词
+STOPWORDS = set("的了是我你他她它们在有和与及或吗呢吧啊把被给对从到为请帮查询看下一个些哪什么怎样多少几") | {
+    'the', 'a', 'an', 'of', 'to', 'in', 'for', 'and', 'or', 'is', 'are', 'me', 'show', 'what', 'which',
+}
+
+_TOKEN_RE = re.compile(r'[a-z]+|[0-9]+|[一-鿿]+')
+_CAMEL_RE = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+
+def tokenize(text):
+    """
+    中英文混合分词
+
+    英文按驼峰、下划线和非字母数字字符切分；连续的中文同时切出单字和相邻双字，
+    使「订单」既能匹配「订单表」，也能匹配「订单号」
+
+    :param text: 任意文本
+    :return: 词列表
+    """
+    if not text:
+        return []
+
+    tokens = []
+    for match in _TOKEN_RE.finditer(_CAMEL_RE.sub(' ', str(text)).lower()):
+        piece = match.group()
+        if '一' <= piece[0] <= '鿿':
+            tokens.extend(ch for ch in piece if ch not in STOPWORDS)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        elif piece not in STOPWORDS:
+            tokens.append(piece)
+    return tokens
+
+
+class LinkResult:
+    """Schema Linking 的结果"""
+
+    def __init__(self, tables, scores, confident):
+        """
+        :param tables: 候选表信息列表（fetch_schema_snapshot 的元素），按得分降序
+        :param scores: 对应的 BM25 得分
+        :param confident: 置信度是否足够，可以跳过 LLM
+        """
+        self.tables = tables
+        self.scores = scores
+        self.confident = confident
+
+    @property
+    def table_names(self):
+        return [t['table'] for t in self.tables]
+
+    def __repr__(self):
+        pairs = ", ".join(f"{name}={score:.2f}" for name, score in zip(self.table_names, self.scores))
+        return f"LinkResult([{pairs}], confident={self.confident})"
+
+
+class SchemaIndex:
+    """基于 BM25 的表检索索引"""
+
+    def __init__(self, tables, enum_values=None):
+        """
+        :param tables: fetch_schema_snapshot 返回的表信息列表
+        :param enum_values: {(schema, table): {column: [高频值, ...]}}，可选
+        """
+        self.tables = list(tables)
+        enum_values = enum_values or {}
+
+        self._doc_tfs = []
+        self._doc_lens = []
+        df = Counter()
+        for t in self.tables:
+            tf = Counter(self._table_tokens(t, enum_values.get((t['schema'], t['table']), {})))
+            self._doc_tfs.append(tf)
+            self._doc_lens.append(sum(tf.values()))
+            df.update(tf.keys())
+
+        n_docs = len(self.tables)
+        self._avg_len = (sum(self._doc_lens) / n_docs) if n_docs else 0.0
+        self._idf = {
+            term: math.log(1 + (n_docs - freq + 0.5) / (freq + 0.5))
+            for term, freq in df.items()
+        }
+
+    @staticmethod
+    def _table_tokens(table, enums):
+        tokens = []
+        tokens += tokenize(table['table']) * TABLE_NAME_WEIGHT
+        tokens += tokenize(table.get('comment')) * TABLE_COMMENT_WEIGHT
+        for col in table.get('columns', []):
+            tokens += tokenize(col['name']) * COLUMN_NAME_WEIGHT
+            tokens += tokenize(col.get('comment')) * COLUMN_COMMENT_WEIGHT
+        for values in enums.values():
+            for value in values:
+                tokens += tokenize(value) * ENUM_VALUE_WEIGHT
+        return tokens
+
+    def score(self, query):
+        """计算每张表与提问的 BM25 得分"""
+        terms = Counter(tokenize(query))
+        scores = []
+        for tf, doc_len in zip(self._doc_tfs, self._doc_lens):
+            total = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self._avg_len) if self._avg_len else BM25_K1
+            for term, q_count in terms.items():
+                freq = tf.get(term)
+                if freq:
+                    total += q_count * self._idf[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            scores.append(total)
+        return scores
+
+    def link(self, query, k=3, min_score=2.0, relative_cutoff=0.5):
+        """
+        为提问挑选候选表
+
+        :param query: 用户提问
+        :param k: 最多返回的表数
+        :param min_score: 最高得分低于该值时，认为置信度不足
+        :param relative_cutoff: 只保留得分不低于最高分该比例的表
+        :return: LinkResult
+        """
+        scores = self.score(query)
+        ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+        top = scores[ranked[0]] if ranked else 0.0
+
+        picked = [i for i in ranked[:k] if scores[i] > 0 and scores[i] >= top * relative_cutoff]
+        return LinkResult(tables=[self.tables[i] for i in picked],
+                          scores=[scores[i] for i in picked],
+                          confident=bool(picked) and top >= min_score)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+只读 SQL 检查
+
+模型生成的 SQL 在只读事务中执行，数据库会拒绝任何写操作。
+但一次提交多条语句时，后面的语句可能先 COMMIT 结束只读事务再执行写操作，
+因此执行前需确认只有一条语句，且语句类型属于查询
+
+主要功能:
+- 识别字符串（包括 PostgreSQL 的 E'...' 转义字符串）、引用标识符、注释和美元引用，找出真正的语句分隔符
+- 去除结尾的分号，拒绝多条语句
+- 只允许 SELECT / WITH / VALUES / TABLE / EXPLAIN / SHOW / DESCRIBE 等查询语句
+- 拒绝 MySQL 的 SELECT ... INTO OUTFILE
+"""
+
+import re
+
+
+# 允许执行的语句类型（首个关键字）
+READONLY_KINDS = ('select', 'with', 'values', 'table', 'explain', 'show', 'describe', 'desc')
+
+# 可以用服务端游标逐批读取的语句类型（PostgreSQL 的 DECLARE 只支持这些语句）
+CURSOR_KINDS = ('select', 'with', 'values', 'table')
+
+# 美元引用的标签不能以数字开头，$1 等是参数占位符
+_DOLLAR_TAG_RE = re.compile(r'\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$')
+_IDENT_CHAR_RE = re.compile(r'[A-Za-z_0-9$]')
+_KEYWORD_RE = re.compile(r'[A-Za-z]+')
+
+# MySQL 的只读事务不限制写文件
+_MYSQL_OUTFILE_RE = re.compile(r'\binto\s+(outfile|dumpfile)\b', re.IGNORECASE)
+
+
+def _after_ident(sql, i):
+    """sql[i] 是否紧跟在标识符字符之后（不在词的边界上）"""
+    return i > 0 and _IDENT_CHAR_RE.match(sql[i - 1]) is not None
+
+
+def _backslash_escapes(sql, i, ch, dialect):
+    """从 sql[i] 开始的引用中，反斜杠是否表示转义"""
+    if dialect == 'mysql':
+        return ch != '`'
+    # PostgreSQL 只有 E'...' 字符串支持反斜杠转义，E 需位于词的开头
+    return ch == "'" and i > 0 and sql[i - 1] in 'Ee' and not _after_ident(sql, i - 1)
+
+
+def tokenize_sql(sql, dialect='postgres'):
+    """
+    将 SQL 切分为片段，依次拼接各片段即为原 SQL
+
+    :param dialect: 'postgres' 或 'mysql'；MySQL 支持 # 注释和反引号，PostgreSQL 支持 E'...' 和 $tag$ 引用
+    :return: (类型, 文本) 的生成器，类型为 'string'（字符串和美元引用）、'identifier'（双引号和反引号引用）、
+        'comment' 或 'code'（其余部分，包括空白和分号）
+    """
+    i, n = 0, len(sql)
+    start = 0
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"') or (ch == '`' and dialect == 'mysql'):
+            # 字符串或引用标识符，成对的引号表示转义；MySQL 字符串和 PostgreSQL 的 E'...' 中还允许反斜杠转义
+            backslash = _backslash_escapes(sql, i, ch, dialect)
+            j = i + 1
+            while j < n:
+                if sql[j] == '\\' and backslash:
+                    j += 2
+                    continue
+                if sql[j] == ch:
+                    if j + 1 < n and sql[j + 1] == ch:
+                        j += 2
+                        continue
+                    break
+                j += 1
+            kind, end = ('string' if ch == "'" else 'identifier'), min(j + 1, n)
+        elif sql.startswith('--', i) or (ch == '#' and dialect == 'mysql'):
+            j = sql.find('\n', i)
+            kind, end = 'comment', n if j < 0 else j
+        elif sql.startswith('/*', i):
+            j = sql.find('*/', i + 2)
+            kind, end = 'comment', n if j < 0 else j + 2
+        elif ch == '$' and dialect == 'postgres' and not _after_ident(sql, i) and _DOLLAR_TAG_RE.match(sql, i):
+            tag = _DOLLAR_TAG_RE.match(sql, i).group()
+            j = sql.find(tag, i + len(tag))
+            kind, end = 'string', n if j < 0 else j + len(tag)
+        else:
+            i += 1
+            continue
+
+        if start < i:
+            yield 'code', sql[start:i]
+        yield kind, sql[i:end]
+        i = start = end
+
+    if start < n:
+        yield 'code', sql[start:]
+
+
+def _scan(sql, dialect):
+    """
+    扫描 SQL，返回语句分隔符的位置、去除注释后的文本，以及进一步去除字符串内容的文本
+    """
+    separators = []
+    text = []
+    code = []
+    length = 0
+    for kind, token in tokenize_sql(sql, dialect):
+        if kind == 'code':
+            separators.extend(length + k for k, c in enumerate(token) if c == ';')
+        elif kind == 'comment':
+            # 行注释直接去掉（换行符保留在后面的片段中），块注释替换为一个空格
+            if not token.startswith('/*'):
+                continue
+            token = ' '
+        text.append(token)
+        if kind == 'string':
+            code.append("''")
+        elif kind == 'identifier':
+            code.append(token[0] * 2)
+        else:
+            code.append(token)
+        length += len(token)
+    return separators, ''.join(text), ''.join(code)
+
+
+def check_readonly_sql(sql, dialect='postgres'):
+    """
+    检查 SQL 是否为单条查询语句
+
+    :param sql: 待执行的 SQL
+    :param dialect: 'postgres' 或 'mysql'
+    :return: (去除注释和结尾分号后的 SQL, 语句类型)
+    :raises ValueError: 包含多条语句、为空或不是查询语句
+    """
+    separators, text, code = _scan(sql, dialect)
+
+    # 结尾的分号可以去掉，其余的分号说明包含多条语句
+    stripped = text.rstrip()
+    while stripped.endswith(';'):
+        stripped = stripped[:-1].rstrip()
+    if any(pos < len(stripped) for pos in separators):
+        raise ValueError("只允许执行一条 SQL 语句")
+
+    stripped = stripped.strip()
+    match = _KEYWORD_RE.match(stripped.lstrip('('))
+    if not match:
+        raise ValueError("SQL 语句为空")
+
+    kind = match.group().lower()
+    if kind not in READONLY_KINDS:
+        raise ValueError(f"只允许执行查询语句（{' / '.join(k.upper() for k in READONLY_KINDS)}），"
+                         f"不支持 {kind.upper()}")
+    if dialect == 'mysql' and _MYSQL_OUTFILE_RE.search(code):
+        raise ValueError("不允许将查询结果写入文件")
+    return stripped, kind
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+表结构向量索引
+
+表很多时，把所有表都塞进模型上下文会显著增加 prompt 长度和 prefill 时间。
+本模块用 bge-m3 为每张表的描述（表名、注释、字段及字段注释）生成向量，检索时只返回最相关的 k 张表
+
+主要功能:
+- 调用 test_qwen3/archived/embedding_server.py 提供的 bge-m3 服务生成向量
+- 索引持久化到本地磁盘，重启后无需重新计算
+- 表结构变化时增量重建：只为新增或描述发生变化的表重新生成向量
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import requests
+
+
+EMBEDDING_URL = "http://localhost:9523/generate"
+
+
+class EmbeddingClient:
+    """bge-m3 embedding 服务的客户端"""
+
+    def __init__(self, url=EMBEDDING_URL, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def __call__(self, text: str) -> np.ndarray:
+        """返回 L2 归一化后的向量"""
+        # 服务端的 normalize 按 batch 维度归一化，这里在客户端按向量归一化
+        response = self._session.post(self.url, data=json.dumps({'text': text}), timeout=self.timeout)
+        response.raise_for_status()
+        vector = np.asarray(response.json(), dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+def describe_table(table: dict) -> str:
+    """将 fetch_schema_snapshot 中的一张表转换为用于生成向量的文本"""
+    lines = [f"表名：{table['table']}"]
+    if table.get('comment'):
+        lines.append(f"表注释：{table['comment']}")
+    for col in table.get('columns', []):
+        line = f"字段：{col['name']}"
+        if col.get('comment'):
+            line += f"（{col['comment']}）"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class TableVectorIndex:
+    """可持久化、可增量更新的表结构向量索引"""
+
+    def __init__(self, path, embed=None):
+        """
+        :param path: 索引文件路径（不含扩展名），会生成 path.npz 和 path.json
+        :param embed: 文本转向量的函数，默认使用 EmbeddingClient
+        """
+        self.path = path
+        self.embed = embed or EmbeddingClient()
+        self._lock = threading.Lock()
+
+        # 与 _vectors 的行一一对应
+        self._keys = []
+        self._hashes = []
+        self._tables = []
+        self._vectors = None
+        self._load()
+
+    def _load(self):
+        if not (os.path.exists(self.path + '.npz') and os.path.exists(self.path + '.json')):
+            return
+        with open(self.path + '.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        self._keys = [tuple(key) for key in meta['keys']]
+        self._hashes = meta['hashes']
+        self._tables = meta['tables']
+        self._vectors = np.load(self.path + '.npz')['vectors']
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        np.savez(self.path + '.npz', vectors=self._vectors)
+        with open(self.path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'keys': self._keys, 'hashes': self._hashes, 'tables': self._tables},
+                      f, ensure_ascii=False)
+
+    def update(self, tables):
+        """
+        根据最新的表结构增量更新索引，只为新增或描述变化的表生成向量
+
+        :param tables: fetch_schema_snapshot 返回的表信息列表
+        :return: self
+        """
+        with self._lock:
+            existing = {key: (h, i) for i, (key, h) in enumerate(zip(self._keys, self._hashes))}
+
+            keys, hashes, vectors = [], [], []
+            changed = len(tables) != len(self._keys)
+            for table in tables:
+                key = (table['schema'], table['table'])
+                digest = hashlib.sha1(describe_table(table).encode('utf-8')).hexdigest()
+                old = existing.get(key)
+                if old is not None and old[0] == digest:
+                    vectors.append(self._vectors[old[1]])
+                else:
+                    vectors.append(self.embed(describe_table(table)))
+                    changed = True
+                keys.append(key)
+                hashes.append(digest)
+
+            self._keys = keys
+            self._hashes = hashes
+            self._tables = list(tables)
+            self._vectors = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            if changed:
+                self._save()
+        return self
+
+    def search(self, query: str, k: int = 5):
+        """
+        检索与提问最相关的 k 张表
+
+        :param query: 用户提问
+        :param k: 返回的表数
+        :return: [(表信息, 余弦相似度), ...]，按相似度降序
+        """
+        vector = self.embed(query)
+        with self._lock:
+            if self._vectors is None or len(self._vectors) == 0:
+                return []
+            scores = self._vectors @ vector
+            top = np.argsort(-scores)[:k]
+            return [(self._tables[i], float(scores[i])) for i in top]
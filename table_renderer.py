@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+查询结果渲染
+
+将数据库查询结果渲染为 Markdown 表格、CSV 或紧凑 JSON，供 PostgreSQL / MySQL 工具共用
+
+主要功能:
+- 逐行写入缓冲区，避免字符串反复拼接
+- 按列数计算每列的截断宽度，每列只计算一次
+- 高效处理 bytes / JSON / 日期时间 / Decimal 等类型
+- CSV 和紧凑 JSON 格式比 Markdown 更节省 token
+"""
+
+import csv
+import datetime
+import decimal
+import io
+import json
+import uuid
+
+
+# 支持的输出格式
+FORMATS = ('markdown', 'csv', 'json')
+
+# 单元格的最大显示宽度
+MAX_CELL_WIDTH = 50
+
+# 列数较多时，各列宽度之和的上限；单列宽度不低于 MIN_CELL_WIDTH
+MAX_ROW_WIDTH = 400
+MIN_CELL_WIDTH = 12
+
+# bytes 类型只展示前若干字节的十六进制
+BYTES_PREVIEW = 16
+
+
+def _format_bytes(value):
+    data = bytes(value)
+    preview = data[:BYTES_PREVIEW].hex()
+    suffix = "..." if len(data) > BYTES_PREVIEW else ""
+    return f"<{len(data)} bytes 0x{preview}{suffix}>"
+
+
+def format_value(value):
+    """将单个值转换为字符串，NULL 显示为 'NULL'"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float, decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _format_bytes(value)
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=format_value)
+    return str(value)
+
+
+def column_widths(n_columns, max_width=MAX_CELL_WIDTH):
+    """按列数计算单元格截断宽度，列越多每列越窄"""
+    if n_columns == 0:
+        return max_width
+    return max(MIN_CELL_WIDTH, min(max_width, MAX_ROW_WIDTH // n_columns))
+
+
+def _truncate(text, width):
+    if len(text) > width:
+        return text[:width - 3] + "..."
+    return text
+
+
+def _iter_rows(column_names, rows):
+    """兼容元组行和字典行（如 PyMySQL 的 DictCursor）"""
+    for row in rows:
+        if isinstance(row, dict):
+            yield [row[col] for col in column_names]
+        else:
+            yield row
+
+
+def _render_markdown(buffer, column_names, rows, width):
+    write = buffer.write
+    write("| " + " | ".join(column_names) + " |\n")
+    write("| " + " | ".join(["---"] * len(column_names)) + " |\n")
+    for row in rows:
+        cells = []
+        for value in row:
+            text = format_value(value)
+            if isinstance(value, str) or len(text) > width:
+                # 移除换行符、转义竖线，截断长文本
+                text = _truncate(text.replace('\n', ' ').replace('\r', '').replace('|', '\\|'), width)
+            cells.append(text)
+        write("| " + " | ".join(cells) + " |\n")
+
+
+def _render_csv(buffer, column_names, rows, width):
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(column_names)
+    for row in rows:
+        writer.writerow([
+            "" if value is None
+            else _truncate(format_value(value).replace('\r', '').replace('\n', ' '), width)
+            for value in row
+        ])
+
+
+def _json_value(value, width):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return _truncate(format_value(value), width)
+
+
+def _render_json(buffer, column_names, rows, width):
+    # 列名只输出一次，行以数组形式输出，比逐行输出对象更紧凑
+    dumps = json.dumps
+    write = buffer.write
+    write('{"columns":')
+    write(dumps(list(column_names), ensure_ascii=False, separators=(',', ':')))
+    write(',"rows":[')
+    for i, row in enumerate(rows):
+        if i:
+            write(',')
+        write(dumps([_json_value(value, width) for value in row],
+                    ensure_ascii=False, separators=(',', ':')))
+    write(']}')
+
+
+_RENDERERS = {
+    'markdown': _render_markdown,
+    'csv': _render_csv,
+    'json': _render_json,
+}
+
+
+def render_rows(column_names, rows, fmt='markdown', max_width=MAX_CELL_WIDTH):
+    """
+    渲染查询结果
+
+    :param column_names: 列名列表
+    :param rows: 可迭代的行，元素为元组 / 列表，或以列名为键的字典
+    :param fmt: 输出格式，可选 'markdown' / 'csv' / 'json'
+    :param max_width: 单元格的最大显示宽度
+    :return: 渲染后的字符串
+    """
+    if fmt not in _RENDERERS:
+        raise ValueError(f"不支持的输出格式：{fmt}，可选：{', '.join(FORMATS)}")
+
+    column_names = list(column_names)
+    buffer = io.StringIO()
+    _RENDERERS[fmt](buffer, column_names, _iter_rows(column_names, rows),
+                    column_widths(len(column_names), max_width))
+    return buffer.getvalue()
+
+
+def iter_cursor(cursor, batch_size=200):
+    """以 fetchmany 分批迭代游标中的行"""
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+
+def render_cursor(cursor, fmt='markdown', max_width=MAX_CELL_WIDTH):
+    """
+    直接从已执行查询的游标流式渲染结果
+
+    :param cursor: 已执行查询的游标
+    :param fmt: 输出格式
+    :param max_width: 单元格的最大显示宽度
+    :return: 渲染后的字符串
+    """
+    column_names = [desc[0] for desc in cursor.description]
+    return render_rows(column_names, iter_cursor(cursor), fmt, max_width)
@@ -8,6 +8,12 @@
 #   - https://fastapi.tiangolo.com/advanced/events/
 
 import os
+import copy
+import json
+import sqlite3
+import queue
+import asyncio
+import threading
 import collections
 import torch
 import transformers
@@ -19,6 +25,7 @@ from typing import List, Optional
 from pydantic import BaseModel
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.security import HTTPBearer
+from fastapi.responses import StreamingResponse
 from contextlib import asynccontextmanager
 
 
@@ -26,7 +33,19 @@ from contextlib import asynccontextmanager
 API_KEY = "token-kcgyrk" # 配置 API 密钥
 MODEL_NAME = "Qwen3-4B-FP8"
 MODEL_PATH = "../model/Qwen/Qwen3-4B-FP8"
-MAX_HISTORY_LENGTH = 3
+MAX_HISTORY_LENGTH = None # 每个会话保留的对话轮数上限，None 表示只按 token 数裁剪
+MAX_HISTORY_TOKENS = 4096 # 每个会话保留的历史记录的 token 数上限
+MEMORY_MAX_CHATS = 1000 # 内存中最多保留的会话数
+MEMORY_MAX_BYTES = 64 * 1024 * 1024 # 内存中所有历史记录的总大小上限
+MEMORY_TTL = 24 * 3600 # 会话超过该时间（秒）未活动即过期
+MEMORY_DB_PATH = None # 历史记录持久化的 SQLite 文件路径，如 "./memory_bank.db"，None 表示不持久化
+MEMORY_DB_MAX_ROWS = 100000 # SQLite 中最多保留的会话数
+MEMORY_PURGE_INTERVAL = 60 # 写入时清理 SQLite 中过期和超出数量的会话的最小间隔（秒）
+MAX_BATCH_SIZE = 8 # 同时解码的最大请求数
+THINK_START_ID = 151667 # <think>
+THINK_END_ID = 151668 # </think>
+PREFIX_CACHE_SIZE = 16 # 最多缓存多少份 past_key_values（会话 + 共享的 system prompt）
+PREFIX_CACHE_BYTES = 2 * 1024 ** 3 # 所有缓存的 past_key_values 的总字节数上限，Qwen3-4B 每个 token 约 144KB（bf16）
 
 
 # 指定使用哪一块显卡
@@ -35,31 +54,173 @@ os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
 # 聊天记录管理
 class MemoryBank:
-    def __init__(self, max_length=10):
+    """
+    线程安全的聊天记录
+
+    - 每个会话按消息数和 token 数裁剪，超出时丢弃最早的一轮对话
+    - 会话数或总字节数超出上限时按 LRU 淘汰，超过 TTL 未活动的会话过期
+    - 配置 db_path 时写入 SQLite，被淘汰的会话或重启后的会话在下次访问时从 SQLite 重新加载；
+      写入时定期删除 SQLite 中过期的会话，并只保留最近活动的 max_rows 个会话
+    - 读写 SQLite 会阻塞，在事件循环中应放到线程池中调用
+    """
+
+    def __init__(self, max_length=None, max_tokens=None, max_chats=MEMORY_MAX_CHATS,
+                 max_bytes=MEMORY_MAX_BYTES, ttl=MEMORY_TTL, db_path=None, count_tokens=None,
+                 max_rows=MEMORY_DB_MAX_ROWS, purge_interval=MEMORY_PURGE_INTERVAL):
+        """
+        :param max_length: 每个会话保留的对话轮数，None 表示不限制
+        :param max_tokens: 每个会话保留的 token 数，None 表示不限制
+        :param count_tokens: 计算文本 token 数的函数，默认按字符数估算
+        :param max_rows: SQLite 中最多保留的会话数，None 表示不限制
+        :param purge_interval: 两次清理 SQLite 的最小间隔（秒）
+        """
         self.max_length = max_length
-        self._storage = collections.defaultdict(list)
-    
+        self.max_tokens = max_tokens
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.count_tokens = count_tokens or len
+        self.max_rows = max_rows
+        self.purge_interval = purge_interval
+        self._purged_at = 0
+        self._lock = threading.Lock()
+        # chat_id -> 消息列表，按最近访问顺序排列
+        self._storage = collections.OrderedDict()
+        self._sizes = {}
+        self._touched = {}
+        self._bytes = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS memory_bank "
+                             "(chat_id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS memory_bank_updated_at ON memory_bank (updated_at)")
+            self._db.commit()
+
+    def _expired(self, updated_at):
+        return self.ttl is not None and time.time() - updated_at > self.ttl
+
+    def _load(self, chat_id):
+        """调用方需持有锁；从内存或 SQLite 中取出会话，过期时删除"""
+        if chat_id in self._storage:
+            if not self._expired(self._touched[chat_id]):
+                self._storage.move_to_end(chat_id)
+                return self._storage[chat_id]
+            self._drop(chat_id)
+        elif self._db is not None:
+            row = self._db.execute("SELECT messages, updated_at FROM memory_bank WHERE chat_id = ?",
+                                   (chat_id,)).fetchone()
+            if row is not None and not self._expired(row[1]):
+                self._put(chat_id, json.loads(row[0]), row[1])
+                return self._storage[chat_id]
+            if row is not None:
+                self._delete_row(chat_id)
+        return None
+
+    def _put(self, chat_id, messages, updated_at):
+        """调用方需持有锁；写入内存，超出容量时淘汰最久未访问的会话（SQLite 中的记录保留）"""
+        size = len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+        self._bytes += size - self._sizes.get(chat_id, 0)
+        self._storage[chat_id] = messages
+        self._storage.move_to_end(chat_id)
+        self._sizes[chat_id] = size
+        self._touched[chat_id] = updated_at
+        while len(self._storage) > 1 and (len(self._storage) > self.max_chats or self._bytes > self.max_bytes):
+            oldest = next(iter(self._storage))
+            self._bytes -= self._sizes.pop(oldest)
+            del self._storage[oldest], self._touched[oldest]
+
+    def _drop(self, chat_id):
+        """调用方需持有锁"""
+        if chat_id in self._storage:
+            self._bytes -= self._sizes.pop(chat_id)
+            del self._storage[chat_id], self._touched[chat_id]
+        self._delete_row(chat_id)
+
+    def _delete_row(self, chat_id):
+        if self._db is not None:
+            self._db.execute("DELETE FROM memory_bank WHERE chat_id = ?", (chat_id,))
+            self._db.commit()
+
+    def _purge(self, now):
+        """调用方需持有锁；删除 SQLite 中过期的会话，以及最近活动的 max_rows 个会话之外的会话"""
+        if now - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = now
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM memory_bank WHERE updated_at < ?", (now - self.ttl,))
+        if self.max_rows is not None:
+            self._db.execute("DELETE FROM memory_bank WHERE chat_id IN "
+                             "(SELECT chat_id FROM memory_bank ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                             (self.max_rows,))
+
+    def _trim(self, messages):
+        """按轮数和 token 数裁剪，只在用户消息处截断，至少保留最后一轮对话"""
+        if self.max_length is not None:
+            messages = messages[-self.max_length * 2:] # *2 because each exchange has 2 messages
+
+        # 不从助手消息开始，保持 user / assistant 交替
+        while messages and messages[0]["role"] != "user":
+            messages = messages[1:]
+
+        if self.max_tokens is not None:
+            tokens = [self.count_tokens(m["content"]) for m in messages]
+            total = sum(tokens)
+            while total > self.max_tokens:
+                # 丢弃最早的一轮对话：截断到下一条用户消息
+                cut = next((i for i in range(1, len(messages)) if messages[i]["role"] == "user"), None)
+                if cut is None:
+                    break
+                total -= sum(tokens[:cut])
+                del tokens[:cut]
+                messages = messages[cut:]
+        return messages
+
     def get(self, chat_id):
-        return self._storage.get(chat_id, [])
-    
+        with self._lock:
+            messages = self._load(chat_id)
+            return list(messages) if messages else []
+
     def add(self, chat_id, message):
-        if chat_id not in self._storage:
-            self._storage[chat_id] = []
-        
-        self._storage[chat_id].append(message)
-        
-        # Trim history if exceeds max length
-        if len(self._storage[chat_id]) > self.max_length * 2: # *2 because each exchange has 2 messages
-            self._storage[chat_id] = self._storage[chat_id][-self.max_length * 2:]
-    
+        self.extend(chat_id, [message])
+
+    def extend(self, chat_id, new_messages):
+        """追加多条消息，如一轮对话的用户消息和助手回复，只写入一次 SQLite"""
+        with self._lock:
+            messages = (self._load(chat_id) or []) + list(new_messages)
+            # 一轮对话完整后（写入助手消息时）才裁剪，避免截断到一轮对话的中间
+            if messages[-1]["role"] != "user":
+                messages = self._trim(messages)
+            now = time.time()
+            self._put(chat_id, messages, now)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO memory_bank (chat_id, messages, updated_at) VALUES (?, ?, ?)",
+                                 (chat_id, json.dumps(messages, ensure_ascii=False), now))
+                self._purge(now)
+                self._db.commit()
+
     def clear(self, chat_id=None):
-        if chat_id:
-            self._storage.pop(chat_id, None)
-        else:
+        with self._lock:
+            if chat_id:
+                self._drop(chat_id)
+                return
             self._storage.clear()
+            self._sizes.clear()
+            self._touched.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM memory_bank")
+                self._db.commit()
 
+    def stats(self):
+        with self._lock:
+            return {"chats": len(self._storage), "bytes": self._bytes}
 
-memory_bank = MemoryBank(max_length=MAX_HISTORY_LENGTH)
+
+memory_bank = MemoryBank(max_length=MAX_HISTORY_LENGTH,
+                         max_tokens=MAX_HISTORY_TOKENS,
+                         db_path=MEMORY_DB_PATH)
 
 
 llm_model = {}
@@ -78,7 +239,10 @@ async def lifespan(app: FastAPI):
     tokenizer, model = load_model()
     llm_model["tokenizer"] = tokenizer
     llm_model["model"] = model
+    memory_bank.count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    scheduler.start()
     yield
+    await scheduler.stop()
     llm_model.clear()
 
 
@@ -99,6 +263,7 @@ class ChatCompletionRequest(BaseModel):
     repetition_penalty: Optional[float] = 1.1
     add_generation_prompt: bool = True
     enable_thinking: bool = True
+    stream: bool = False
     chat_id: str
 
 
@@ -108,56 +273,485 @@ def verify_token(credentials: HTTPBearer = Depends(security)):
         raise HTTPException(401, "Invalid API Key")
 
 
-def model_infr(messages,
-               chat_id,
-               tokenizer,
-               model,
-               max_new_tokens,
-               temperature,
-               top_p,
-               repetition_penalty,
-               add_generation_prompt,
-               enable_thinking
-              ):
-    """模型生成文本"""
+def build_prompt(messages, chat_id, tokenizer, add_generation_prompt, enable_thinking):
+    """拼接历史记录，生成模型输入文本"""
 
     # fetch history from memory_bank
     history = memory_bank.get(chat_id)
 
-    chats = history + messages
-    text = tokenizer.apply_chat_template(
+    chats = history + [m.model_dump() for m in messages]
+    return tokenizer.apply_chat_template(
         chats,
         tokenize=False,
         add_generation_prompt=add_generation_prompt,
         enable_thinking=enable_thinking
     )
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
-
-    # conduct text completion
-    generated_ids = model.generate(
-        **model_inputs,
-        max_new_tokens=max_new_tokens,
-        temperature=temperature,
-        top_p=top_p,
-        repetition_penalty=repetition_penalty
-    )
-    output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
+
+
+def system_prefix_length(tokenizer, messages):
+    """system prompt 部分的 token 数，没有 system prompt 时返回 0"""
+    if not messages or messages[0].role != "system":
+        return 0
+    # 与完整输入的分词方式一致：先生成文本再分词
+    text = tokenizer.apply_chat_template([messages[0].model_dump()], tokenize=False)
+    return len(tokenizer(text).input_ids)
+
+
+class PrefixCache:
+    """
+    前缀 KV 缓存
+
+    按 chat_id 缓存上一轮生成后的 past_key_values，并在会话之间共享相同 system prompt 的 past_key_values。
+    新的输入与缓存的 token 序列有公共前缀时，裁剪缓存到公共前缀的长度后用于 prefill，只需计算新增的 token。
+    按条数和 past_key_values 实际占用的显存字节数限制总大小，超出时淘汰最久未使用的缓存。
+    只在生成线程中访问，无需加锁
+    """
+
+    def __init__(self, max_entries=PREFIX_CACHE_SIZE, max_bytes=PREFIX_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (token ids, past_key_values, 字节数)，key 为 ("chat", chat_id) 或 ("system", token ids)
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "cached_tokens": 0, "evictions": 0}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def _common_prefix(a, b):
+        n = min(len(a), len(b))
+        i = 0
+        while i < n and a[i] == b[i]:
+            i += 1
+        return i
+
+    def _pop(self, key):
+        ids, cache, size = self._entries.pop(key)
+        self._bytes -= size
+        return ids, cache
+
+    def match(self, chat_id, input_ids):
+        """
+        查找与 input_ids 公共前缀最长的缓存
+
+        :return: (裁剪后的 past_key_values, 复用的 token 数)，未命中时为 (None, 0)
+        """
+        best_key, best_length = None, 0
+        for key, (ids, _, _) in self._entries.items():
+            if key[0] == "chat" and key[1] != chat_id:
+                continue
+            length = self._common_prefix(ids, input_ids)
+            if length > best_length:
+                best_key, best_length = key, length
+
+        # 至少留一个 token 交给模型计算
+        best_length = min(best_length, len(input_ids) - 1)
+        if best_key is None or best_length <= 0:
+            self.stats["misses"] += 1
+            return None, 0
+
+        if best_key[0] == "chat":
+            # 会话的缓存由本次生成接管，生成结束后写回新的缓存
+            _, cache = self._pop(best_key)
+        else:
+            cache = copy.deepcopy(self._entries[best_key][1])
+            self._entries.move_to_end(best_key)
+        cache.crop(best_length)
+
+        self.stats["hits"] += 1
+        self.stats["cached_tokens"] += best_length
+        return cache, best_length
+
+    def put(self, key, token_ids, cache):
+        if key in self._entries:
+            self._pop(key)
+        size = cache_nbytes(cache)
+        self._entries[key] = (token_ids, cache, size)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._pop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def clear(self, chat_id=None):
+        if chat_id is None:
+            self._entries.clear()
+            self._bytes = 0
+        elif ("chat", chat_id) in self._entries:
+            self._pop(("chat", chat_id))
+
+
+prefix_cache = PrefixCache()
+
+
+def make_usage(prompt_tokens, completion_tokens, cached_tokens):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens}
+    }
+
+
+def cache_layers(cache):
+    """past_key_values 每一层的 (key, value)，形状为 (batch, kv_heads, 序列长度, head_dim)"""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    # transformers 4.x
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def cache_nbytes(cache):
+    """past_key_values 占用的显存字节数：层数 × kv_heads × head_dim × 2 × 序列长度 × dtype 大小"""
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in cache_layers(cache))
+
+
+def build_cache(layers):
+    """由每一层的 (key, value) 构造 DynamicCache"""
+    cache = transformers.DynamicCache()
+    for i, (key, value) in enumerate(layers):
+        cache.update(key, value, i)
+    return cache
+
+
+def left_pad(tensor, length):
+    """在序列维度（倒数第二维）左侧补零到 length"""
+    return torch.nn.functional.pad(tensor, (0, 0, length - tensor.shape[-2], 0))
+
+
+def sample_token(logits, seen_ids, temperature, top_p, repetition_penalty):
+    """按单个请求的采样参数，从一行 logits 中采样下一个 token"""
+    logits = logits.float()
+    if repetition_penalty and repetition_penalty != 1.0:
+        ids = torch.tensor(list(seen_ids), device=logits.device)
+        score = logits[ids]
+        logits[ids] = torch.where(score < 0, score * repetition_penalty, score / repetition_penalty)
+    if not temperature:
+        return int(logits.argmax())
+
+    probs = torch.softmax(logits / temperature, dim=-1)
+    if top_p is not None and top_p < 1.0:
+        # 保留累计概率达到 top_p 的最少 token
+        sorted_probs, indices = probs.sort(descending=True)
+        sorted_probs[sorted_probs.cumsum(-1) - sorted_probs > top_p] = 0
+        return int(indices[torch.multinomial(sorted_probs, 1)])
+    return int(torch.multinomial(probs, 1))
+
+
+def parse_output(tokenizer, output_ids):
+    """拆分思考内容和回答内容"""
 
     # parsing thinking content
     try:
         # rindex finding 151668 (</think>)
-        index = len(output_ids) - output_ids[::-1].index(151668)
+        index = len(output_ids) - output_ids[::-1].index(THINK_END_ID)
     except ValueError:
         index = 0
 
     think_content = tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
     answer_content = tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
+    return think_content, answer_content
 
-    # update memory_bank
-    memory_bank.add(chat_id, messages[-1].model_dump())
-    memory_bank.add(chat_id, {"role": "assistant", "content": answer_content})
 
-    return think_content, answer_content
+class ReasoningStreamer(transformers.TextIteratorStreamer):
+    """
+    流式输出生成的文本，按 </think> 拆分思考内容和回答内容
+
+    迭代得到 (类型, 文本)，类型为 "reasoning_content" 或 "content"
+    """
+
+    def __init__(self, tokenizer, enable_thinking=True, **kwargs):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True, **kwargs)
+        self.kind = "reasoning_content" if enable_thinking else "content"
+
+    def put(self, value):
+        if len(value.shape) > 1:
+            value = value[0]
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            return super().put(value)
+
+        ids = value.tolist()
+        if THINK_START_ID in ids:
+            value = value[[i for i, t in enumerate(ids) if t != THINK_START_ID]]
+            ids = value.tolist()
+        if THINK_END_ID not in ids:
+            if ids:
+                super().put(value)
+            return
+
+        # 输出 </think> 之前缓存的思考内容，之后的 token 属于回答内容
+        index = ids.index(THINK_END_ID)
+        if index:
+            super().put(value[:index])
+        if self.token_cache:
+            text = self.tokenizer.decode(self.token_cache, **self.decode_kwargs)
+            self.on_finalized_text(text[self.print_len:])
+            self.token_cache = []
+            self.print_len = 0
+        self.kind = "content"
+        if index + 1 < len(ids):
+            super().put(value[index + 1:])
+
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.text_queue.put((self.kind, text), timeout=self.timeout)
+        if stream_end:
+            self.text_queue.put(self.stop_signal, timeout=self.timeout)
+
+
+class GenerationRequest:
+    """等待生成或正在生成的请求，生成状态只在生成线程中修改"""
+
+    def __init__(self, text, chat_id, sampling, max_new_tokens, system_prefix_len, loop, future,
+                 streamer=None, cancelled=None):
+        self.text = text
+        self.chat_id = chat_id
+        self.sampling = sampling # (temperature, top_p, repetition_penalty)
+        self.max_new_tokens = max_new_tokens
+        self.system_prefix_len = system_prefix_len
+        self.loop = loop
+        self.future = future
+        self.streamer = streamer
+        self.cancelled = cancelled
+        self.prompt_ids = []
+        self.output_ids = []
+        self.seen_ids = set() # 重复惩罚作用的 token
+        self.cached_tokens = 0
+
+    def is_cancelled(self):
+        """客户端已断开"""
+        return (self.cancelled is not None and self.cancelled.is_set()) or self.future.cancelled()
+
+
+class BatchScheduler:
+    """
+    连续批处理调度器
+
+    生成线程逐个 token 解码同一批请求：每一步之前，新到达的请求单独 prefill（复用前缀 KV 缓存），
+    其 past_key_values 左侧补零后并入这一批；请求遇到结束符、达到自己的 max_new_tokens 或客户端断开后，
+    立即返回结果并移出这一批，短请求不会被同批的长请求拖住。每个请求按自己的采样参数采样
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.stats = {"requests": 0, "steps": 0}
+
+        # 以下只在生成线程中访问
+        self._running = []
+        self._cache = None
+        self._mask = None # (batch, 序列长度)，左侧补齐的位置为 0
+        self._eos_ids = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="generate", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+
+    async def submit(self, text, chat_id, temperature, top_p, repetition_penalty, max_new_tokens,
+                     system_prefix_len=0, streamer=None, cancelled=None):
+        """
+        提交请求，生成结束后返回 (生成的 token id 列表, 输入的 token 数, 复用缓存的 token 数)
+
+        :param streamer: 逐个写入生成的 token，用于流式输出
+        :param cancelled: threading.Event，置位后停止生成
+        """
+        loop = asyncio.get_running_loop()
+        request = GenerationRequest(text, chat_id, (temperature, top_p, repetition_penalty), max_new_tokens,
+                                    system_prefix_len, loop, loop.create_future(), streamer, cancelled)
+        self._queue.put(request)
+        return await request.future
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            # 这一批为空时阻塞等待新请求，否则只取出已到达的请求
+            block = not self._running
+            while len(self._running) < self.max_batch_size:
+                try:
+                    request = self._queue.get(block=block)
+                except queue.Empty:
+                    break
+                if request is None:
+                    break
+                block = False
+                try:
+                    self._prefill(request)
+                except Exception as e:
+                    self._resolve(request, e)
+
+            if self._running and not self._stopped.is_set():
+                try:
+                    self._step()
+                except Exception as e:
+                    for request in self._running:
+                        self._resolve(request, e)
+                    self._reset()
+
+        error = RuntimeError("server is shutting down")
+        for request in self._running:
+            self._resolve(request, error)
+        while not self._queue.empty():
+            request = self._queue.get_nowait()
+            if request is not None:
+                self._resolve(request, error)
+
+    def _reset(self):
+        self._running, self._cache, self._mask = [], None, None
+
+    def _finished(self, request):
+        return (request.output_ids[-1] in self._eos_ids
+                or len(request.output_ids) >= request.max_new_tokens
+                or request.is_cancelled())
+
+    def _append(self, request, logits):
+        """采样下一个 token"""
+        token = sample_token(logits, request.seen_ids, *request.sampling)
+        request.output_ids.append(token)
+        request.seen_ids.add(token)
+        if request.streamer is not None:
+            request.streamer.put(torch.tensor([token]))
+
+    @torch.no_grad()
+    def _prefill(self, request):
+        """计算新请求的输入，采样第一个 token 后并入这一批"""
+        tokenizer, model = llm_model["tokenizer"], llm_model["model"]
+        if self._eos_ids is None:
+            eos = model.generation_config.eos_token_id
+            self._eos_ids = set(eos if isinstance(eos, list) else [eos]) | {tokenizer.eos_token_id}
+
+        prompt_ids = tokenizer(request.text).input_ids
+        request.prompt_ids = prompt_ids
+        request.seen_ids.update(prompt_ids)
+        if request.is_cancelled():
+            self._resolve(request)
+            return
+
+        cache, cached_tokens = prefix_cache.match(request.chat_id, prompt_ids)
+        request.cached_tokens = cached_tokens
+        outputs = model(
+            input_ids=torch.tensor([prompt_ids[cached_tokens:]], device=model.device),
+            attention_mask=torch.ones(1, len(prompt_ids), dtype=torch.long, device=model.device),
+            position_ids=torch.arange(cached_tokens, len(prompt_ids), device=model.device).unsqueeze(0),
+            past_key_values=cache,
+            use_cache=True,
+            logits_to_keep=1
+        )
+        cache = outputs.past_key_values
+
+        if 0 < request.system_prefix_len < len(prompt_ids):
+            key = ("system", tuple(prompt_ids[:request.system_prefix_len]))
+            if key not in prefix_cache:
+                # 复制而不是裁剪视图，避免共享缓存占用整个输入的显存
+                n = request.system_prefix_len
+                shared = build_cache([(k[:, :, :n].clone(), v[:, :, :n].clone()) for k, v in cache_layers(cache)])
+                prefix_cache.put(key, prompt_ids[:n], shared)
+
+        if request.streamer is not None:
+            # 跳过输入部分
+            request.streamer.put(torch.tensor(prompt_ids))
+        self._append(request, outputs.logits[0, -1])
+        if self._finished(request):
+            self._release(request, cache)
+            return
+
+        # past_key_values 左侧补零，与这一批对齐后拼接
+        length = len(prompt_ids)
+        width = max(length, self._mask.shape[1]) if self._running else length
+        layers = [(left_pad(k, width), left_pad(v, width)) for k, v in cache_layers(cache)]
+        mask = torch.nn.functional.pad(torch.ones(1, length, dtype=torch.long, device=model.device),
+                                       (width - length, 0))
+        if self._running:
+            layers = [(torch.cat([left_pad(bk, width), k]), torch.cat([left_pad(bv, width), v]))
+                      for (bk, bv), (k, v) in zip(cache_layers(self._cache), layers)]
+            mask = torch.cat([torch.nn.functional.pad(self._mask, (width - self._mask.shape[1], 0)), mask])
+        self._cache = build_cache(layers)
+        self._mask = mask
+        self._running.append(request)
+
+    @torch.no_grad()
+    def _step(self):
+        """这一批的所有请求各生成一个 token"""
+        model = llm_model["model"]
+        device = self._mask.device
+        self._mask = torch.cat([self._mask, self._mask.new_ones(len(self._running), 1)], dim=1)
+        outputs = model(
+            input_ids=torch.tensor([[r.output_ids[-1]] for r in self._running], device=device),
+            attention_mask=self._mask,
+            position_ids=torch.tensor([[len(r.prompt_ids) + len(r.output_ids) - 1] for r in self._running],
+                                      device=device),
+            past_key_values=self._cache,
+            use_cache=True
+        )
+        self._cache = outputs.past_key_values
+        self.stats["steps"] += 1
+
+        logits = outputs.logits[:, -1]
+        for i, request in enumerate(self._running):
+            self._append(request, logits[i])
+        finished = [i for i, request in enumerate(self._running) if self._finished(request)]
+        if finished:
+            self._remove(finished)
+
+    def _remove(self, finished):
+        """结束的请求移出这一批"""
+        layers = cache_layers(self._cache)
+        for i in finished:
+            # 去掉左侧补齐的位置，作为该会话的前缀缓存
+            pad = int((self._mask[i] == 0).sum())
+            cache = build_cache([(k[i:i + 1, :, pad:].clone(), v[i:i + 1, :, pad:].clone()) for k, v in layers])
+            self._release(self._running[i], cache)
+
+        keep = [i for i in range(len(self._running)) if i not in finished]
+        if not keep:
+            self._reset()
+            return
+        self._running = [self._running[i] for i in keep]
+        self._mask = self._mask[keep]
+        layers = [(k[keep], v[keep]) for k, v in layers]
+
+        # 去掉所有请求都是补齐的列
+        pad = int((self._mask.sum(dim=0) == 0).sum())
+        if pad:
+            self._mask = self._mask[:, pad:]
+            layers = [(k[:, :, pad:], v[:, :, pad:]) for k, v in layers]
+        self._cache = build_cache(layers)
+
+    def _release(self, request, cache):
+        """写回会话的前缀缓存并返回结果；past_key_values 不包含最后一个生成的 token"""
+        sequence = request.prompt_ids + request.output_ids
+        prefix_cache.put(("chat", request.chat_id), sequence[:cache.get_seq_length()], cache)
+        self.stats["requests"] += 1
+        self._resolve(request)
+
+    @staticmethod
+    def _resolve(request, error=None):
+        """在请求所在的事件循环中设置结果"""
+        if request.streamer is not None:
+            # 结束迭代，避免读取 streamer 的协程一直等待
+            request.streamer.end()
+
+        def set_result():
+            if request.future.done():
+                return
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result((request.output_ids, len(request.prompt_ids), request.cached_tokens))
+
+        try:
+            request.loop.call_soon_threadsafe(set_result)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+
+scheduler = BatchScheduler()
 
 
 @app.get("/v1/models", dependencies=[Depends(verify_token)])
@@ -179,19 +773,31 @@ async def list_models():
 @app.post("/v1/chat/completions", dependencies=[Depends(verify_token)])
 async def create_chat_completion(request: ChatCompletionRequest):
 
-    # 模型推理
-    think_content, answer_content = model_infr(
-        messages=request.messages,
-        chat_id=request.chat_id,
-        tokenizer=llm_model["tokenizer"],
-        model=llm_model["model"],
-        max_new_tokens=request.max_new_tokens,
+    if request.stream:
+        return StreamingResponse(stream_chat_completion(request), media_type="text/event-stream")
+
+    # 模型推理：请求进入调度器，与其他请求一起解码
+    loop = asyncio.get_running_loop()
+    tokenizer = llm_model["tokenizer"]
+    # 读取历史记录可能访问 SQLite，在线程池中执行
+    text = await loop.run_in_executor(None, build_prompt, request.messages, request.chat_id, tokenizer,
+                                      request.add_generation_prompt, request.enable_thinking)
+    output_ids, prompt_tokens, cached_tokens = await scheduler.submit(
+        text,
+        request.chat_id,
         temperature=request.temperature,
         top_p=request.top_p,
         repetition_penalty=request.repetition_penalty,
-        add_generation_prompt=request.add_generation_prompt,
-        enable_thinking=request.enable_thinking
+        max_new_tokens=request.max_new_tokens,
+        system_prefix_len=system_prefix_length(tokenizer, request.messages)
     )
+    think_content, answer_content = parse_output(tokenizer, output_ids)
+
+    # update memory_bank
+    await loop.run_in_executor(None, memory_bank.extend, request.chat_id, [
+        request.messages[-1].model_dump(),
+        {"role": "assistant", "content": answer_content}
+    ])
 
     # 输出排版
     lst = [
@@ -212,8 +818,78 @@ async def create_chat_completion(request: ChatCompletionRequest):
                 "content": content.strip()
             },
             "finish_reason": "stop"
+        }],
+        "usage": make_usage(prompt_tokens, len(output_ids), cached_tokens)
+    }
+
+
+def completion_chunk(completion_id, created, delta, finish_reason=None, usage=None):
+    """chat.completion.chunk 格式的 SSE 事件"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": MODEL_NAME,
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason
         }]
     }
+    if usage is not None:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+async def stream_chat_completion(request: ChatCompletionRequest):
+    """流式返回生成的文本，思考内容和回答内容分别放在 delta 的 reasoning_content 和 content 中"""
+    completion_id = f"chatcmpl-{str(uuid.uuid4())}"
+    created = int(time.time())
+    loop = asyncio.get_running_loop()
+    tokenizer = llm_model["tokenizer"]
+
+    # 读取历史记录可能访问 SQLite，在线程池中执行
+    text = await loop.run_in_executor(None, build_prompt, request.messages, request.chat_id, tokenizer,
+                                      request.add_generation_prompt, request.enable_thinking)
+    streamer = ReasoningStreamer(tokenizer, enable_thinking=request.enable_thinking)
+    cancelled = threading.Event()
+    generation = asyncio.ensure_future(scheduler.submit(
+        text,
+        request.chat_id,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        repetition_penalty=request.repetition_penalty,
+        max_new_tokens=request.max_new_tokens,
+        system_prefix_len=system_prefix_length(tokenizer, request.messages),
+        streamer=streamer,
+        cancelled=cancelled
+    ))
+
+    # streamer 的迭代会阻塞，在线程池中读取，不阻塞事件循环
+    answer = []
+    try:
+        yield completion_chunk(completion_id, created, {"role": "assistant", "content": ""})
+        while True:
+            item = await loop.run_in_executor(None, next, streamer, None)
+            if item is None:
+                break
+            kind, delta = item
+            if kind == "content":
+                answer.append(delta)
+            yield completion_chunk(completion_id, created, {kind: delta})
+
+        output_ids, prompt_tokens, cached_tokens = await generation
+        yield completion_chunk(completion_id, created, {}, finish_reason="stop",
+                               usage=make_usage(prompt_tokens, len(output_ids), cached_tokens))
+        yield "data: [DONE]\n\n"
+    finally:
+        cancelled.set()
+
+    # update memory_bank
+    await loop.run_in_executor(None, memory_bank.extend, request.chat_id, [
+        request.messages[-1].model_dump(),
+        {"role": "assistant", "content": "".join(answer).strip("\n")}
+    ])
 
 
 if __name__ == "__main__":
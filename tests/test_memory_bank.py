@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('fastapi')
+pytest.importorskip('uvicorn')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_qwen3'))
+
+from transformers_server import MemoryBank  # noqa: E402
+
+
+def chat(bank, chat_id, turns):
+    for i in range(turns):
+        bank.add(chat_id, {"role": "user", "content": f"u{i}"})
+        bank.add(chat_id, {"role": "assistant", "content": f"a{i}"})
+
+
+def assert_alternating(history):
+    assert history[0]["role"] == "user"
+    assert [m["role"] for m in history] == ["user", "assistant"] * (len(history) // 2) + ["user"] * (len(history) % 2)
+
+
+def test_trim_by_length_keeps_alternation():
+    bank = MemoryBank(max_length=2, count_tokens=len)
+    chat(bank, "c", 5)
+    history = bank.get("c")
+    assert [m["content"] for m in history] == ["u3", "a3", "u4", "a4"]
+    assert_alternating(history)
+
+    # 写入用户消息后、助手回复前，历史记录同样以用户消息开头
+    bank.add("c", {"role": "user", "content": "u5"})
+    assert_alternating(bank.get("c"))
+
+
+def test_trim_by_tokens_keeps_alternation():
+    bank = MemoryBank(max_length=10, max_tokens=5, count_tokens=len)
+    chat(bank, "c", 6)
+    history = bank.get("c")
+    assert [m["content"] for m in history] == ["u5", "a5"]
+
+    bank = MemoryBank(max_length=10, max_tokens=1, count_tokens=len)
+    chat(bank, "c", 3)
+    assert [m["content"] for m in bank.get("c")] == ["u2", "a2"]
+
+
+def test_persisted_history_keeps_alternation(tmp_path):
+    db_path = str(tmp_path / "memory_bank.db")
+    chat(MemoryBank(max_length=2, max_tokens=6, db_path=db_path, count_tokens=len), "c", 5)
+    history = MemoryBank(max_length=2, db_path=db_path).get("c")
+    assert history[-1]["content"] == "a4"
+    assert_alternating(history)
+
+
+def test_max_length_is_optional():
+    bank = MemoryBank(max_tokens=100, count_tokens=len)
+    chat(bank, "c", 20)
+    assert len(bank.get("c")) == 40
+
+
+def test_purge_bounds_sqlite(tmp_path):
+    db_path = str(tmp_path / "memory_bank.db")
+    bank = MemoryBank(db_path=db_path, max_rows=3, purge_interval=0)
+    for i in range(5):
+        chat(bank, f"c{i}", 1)
+    assert bank._db.execute("SELECT chat_id FROM memory_bank ORDER BY updated_at").fetchall() == [
+        ("c2",), ("c3",), ("c4",)]
+
+    bank._db.execute("UPDATE memory_bank SET updated_at = 0 WHERE chat_id = 'c2'")
+    bank.ttl = 60
+    chat(bank, "c5", 1)
+    assert sorted(r[0] for r in bank._db.execute("SELECT chat_id FROM memory_bank")) == ["c3", "c4", "c5"]
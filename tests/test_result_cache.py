@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from result_cache import ResultCache, normalize_sql, sql_identifiers
+
+
+@pytest.mark.parametrize('a, b, dialect', [
+    ("SELECT * FROM t WHERE s = 'x\\'  y'", "SELECT * FROM t WHERE s = 'x\\' y'", 'mysql'),
+    ("SELECT * FROM t WHERE s = E'x\\'  y'", "SELECT * FROM t WHERE s = E'x\\' y'", 'postgres'),
+    ("SELECT $$a  b$$", "SELECT $$a b$$", 'postgres'),
+])
+def test_whitespace_inside_escaped_string_is_kept(a, b, dialect):
+    assert normalize_sql(a, dialect) != normalize_sql(b, dialect)
+    key = ResultCache.make_key('db', 'sql', normalize_sql(a, dialect))
+    assert key != ResultCache.make_key('db', 'sql', normalize_sql(b, dialect))
+
+
+def test_whitespace_and_comments_are_collapsed():
+    sql = "SELECT  a,\n  b -- 注释\nFROM /* x */ t ;"
+    assert normalize_sql(sql) == "SELECT a, b FROM t"
+    assert normalize_sql("SELECT 'a  b'  FROM t") == "SELECT 'a  b' FROM t"
+
+
+def test_sql_identifiers():
+    names = sql_identifiers('SELECT "Order Items".id FROM "Order Items" WHERE note = \'orders\'')
+    assert 'order items' in names
+    assert 'orders' not in names
+    assert 'orders' in sql_identifiers("SELECT * FROM `orders`", 'mysql')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from sql_guard import check_readonly_sql
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT E'abc\\''; COMMIT; DELETE FROM orders; --'",
+    "SELECT e'abc\\\\'; COMMIT; DELETE FROM orders",
+    "SELECT 1 AS x$y$; COMMIT; DELETE FROM orders",
+    "SELECT 1; DELETE FROM orders",
+    "SELECT 1; SELECT 2",
+])
+def test_postgres_rejects_multiple_statements(sql):
+    with pytest.raises(ValueError):
+        check_readonly_sql(sql, 'postgres')
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT 'a\\\\'; DELETE FROM orders",
+    "SELECT \"a\\\\\"; DELETE FROM orders",
+])
+def test_mysql_rejects_multiple_statements(sql):
+    with pytest.raises(ValueError):
+        check_readonly_sql(sql, 'mysql')
+
+
+def test_mysql_backslash_escape_inside_string():
+    sql = "SELECT 'a\\'; DELETE FROM orders; --'"
+    assert check_readonly_sql(sql, 'mysql') == (sql, 'select')
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT 1;", "SELECT 1"),
+    ("SELECT 'a;b' AS s;  -- 注释", "SELECT 'a;b' AS s"),
+    ("SELECT E'it\\'s; fine'", "SELECT E'it\\'s; fine'"),
+    ("SELECT 'C:\\' AS path", "SELECT 'C:\\' AS path"),
+    ("SELECT $$a; b$$", "SELECT $$a; b$$"),
+    ("SELECT $tag$a; b$tag$", "SELECT $tag$a; b$tag$"),
+    ("SELECT x$y FROM t", "SELECT x$y FROM t"),
+])
+def test_postgres_single_statement(sql, expected):
+    assert check_readonly_sql(sql, 'postgres') == (expected, 'select')
+
+
+def test_rejects_write_statement():
+    with pytest.raises(ValueError):
+        check_readonly_sql("DELETE FROM orders")
+
+
+def test_mysql_rejects_outfile():
+    with pytest.raises(ValueError):
+        check_readonly_sql("SELECT * FROM orders INTO OUTFILE '/tmp/x'", 'mysql')
+    assert check_readonly_sql("SELECT 'into outfile' AS s", 'mysql')[1] == 'select'